@@ -0,0 +1,111 @@
+from functools import partial
+
+import numpy as np
+from rdkit import Chem
+from rdkit.Chem import AllChem
+
+
+class BitCountIndex:
+    """
+    Reference Morgan fingerprint bit counts stored as sorted arrays of bit ids (uint32) and counts (int64).
+    This is the index format shared by SillyWalks and SillyBits, query bits are looked up in a batch with searchsorted.
+    """
+
+    def __init__(self, bits=(), counts=(), radius: int = 2):
+        """
+        :param bits: Morgan fingerprint bit ids
+        :param counts: Corresponding counts in the reference dataset
+        :param radius: Morgan fingerprint radius
+        """
+        bits = np.asarray(bits, dtype=np.uint32)
+        counts = np.asarray(counts, dtype=np.int64)
+        assert len(bits) == len(counts), "bits and counts must be the same length"
+        if np.any(counts <= 0):
+            keep = counts > 0
+            bits, counts = bits[keep], counts[keep]
+        if np.any(bits[1:] <= bits[:-1]):
+            bits, inverse = np.unique(bits, return_inverse=True)
+            counts = np.bincount(inverse, weights=counts).astype(np.int64)
+        self.bits = bits
+        self.counts = counts
+        self.radius = radius
+
+    def __len__(self):
+        return len(self.bits)
+
+    @staticmethod
+    def mol_bits(mol, radius: int = 2):
+        """
+        Morgan fingerprint bit ids and counts of a molecule
+        :param mol: SMILES or RDKit Mol
+        :return: (bits, counts) or None if the molecule is invalid
+        """
+        if isinstance(mol, str):
+            mol = Chem.MolFromSmiles(mol)
+        if mol is None:
+            return None
+        elements = AllChem.GetMorganFingerprint(mol, radius).GetNonzeroElements()
+        return (
+            np.fromiter(elements.keys(), dtype=np.uint32, count=len(elements)),
+            np.fromiter(elements.values(), dtype=np.int64, count=len(elements)),
+        )
+
+    @classmethod
+    def from_mols(cls, mols: list, radius: int = 2, map_func=map):
+        """
+        Count fingerprint bits over a reference dataset
+        :param mols: List of SMILES or RDKit Mols
+        :param radius: Morgan fingerprint radius
+        :param map_func: Map function used to compute fingerprints e.g., a multiprocessing map
+        """
+        return cls.from_mol_bits(
+            map_func(partial(cls.mol_bits, radius=radius), mols), radius=radius
+        )
+
+    @classmethod
+    def from_mol_bits(cls, mol_bits: list, radius: int = 2):
+        """
+        Count fingerprint bits from pre-computed molecule bits
+        :param mol_bits: List of (bits, counts) per molecule as returned by mol_bits, or None if invalid
+        :param radius: Morgan fingerprint radius
+        """
+        mol_bits = [b for b in mol_bits if b is not None]
+        if len(mol_bits) == 0:
+            return cls(radius=radius)
+        bits = np.concatenate([b for b, _ in mol_bits])
+        counts = np.concatenate([c for _, c in mol_bits])
+        return cls(bits, counts, radius=radius)
+
+    def lookup(self, bits: np.ndarray) -> np.ndarray:
+        """
+        Reference counts of query bits, 0 if not present
+        :param bits: Array of bit ids
+        :return: Array of counts
+        """
+        bits = np.asarray(bits, dtype=np.uint32)
+        if len(self.bits) == 0:
+            return np.zeros(len(bits), dtype=np.int64)
+        idx = np.searchsorted(self.bits, bits)
+        idx[idx == len(self.bits)] = 0
+        found = self.bits[idx] == bits
+        return np.where(found, self.counts[idx], 0)
+
+    def silly_ratios(self, mol_bits: list) -> np.ndarray:
+        """
+        Ratio of fingerprint bits not found in the reference, for a batch of molecules
+        :param mol_bits: List of (bits, counts) per molecule as returned by mol_bits, or None if invalid
+        :return: Array of ratios, NaN if invalid
+        """
+        ratios = np.full(len(mol_bits), np.nan)
+        valid = [i for i, b in enumerate(mol_bits) if b is not None]
+        if len(valid) == 0:
+            return ratios
+        n_bits = np.asarray([len(mol_bits[i][0]) for i in valid])
+        query = np.concatenate([mol_bits[i][0] for i in valid])
+        silly = self.lookup(query) == 0
+        mol_idx = np.repeat(np.arange(len(valid)), n_bits)
+        n_silly = np.bincount(mol_idx, weights=silly, minlength=len(valid))
+        ratios[valid] = np.divide(
+            n_silly, n_bits, out=np.zeros(len(valid)), where=n_bits > 0
+        )
+        return ratios
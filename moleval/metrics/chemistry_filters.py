@@ -22,32 +22,43 @@ class ChemistryFilter:
         self.target = target
         self.silly_walks = None
         if self.target:
-            # SillyWalks
-            self.ref_sillyness = SillyWalks(self.target, n_jobs=n_jobs)
-            # MolWt, LogP
-            self.ref_MW = self._compute_mean_std(self._mols2prop(self.target, "MolWt"))
-            self.ref_LogP = self._compute_mean_std(
-                self._mols2prop(self.target, "MolLogP")
-            )
-            self.target_property_filters = [
-                partial(
-                    self.property_filter,
-                    prop="MolWt",
-                    min=(self.ref_MW[0] - 4 * self.ref_MW[1]),
-                    max=(self.ref_MW[0] + 4 * self.ref_MW[1]),
-                ),
-                partial(
-                    self.property_filter,
-                    prop="MolLogP",
-                    min=(self.ref_LogP[0] - 4 * self.ref_LogP[1]),
-                    max=(self.ref_LogP[0] + 4 * self.ref_LogP[1]),
-                ),
-                partial(
-                    self.sillyness_filter,
-                    ref_sillyness=self.ref_sillyness,
-                    threshold=0.1,
+            self.set_target(
+                ref_sillyness=SillyWalks(self.target, n_jobs=n_jobs),
+                ref_MW=self._compute_mean_std(self._mols2prop(self.target, "MolWt")),
+                ref_LogP=self._compute_mean_std(
+                    self._mols2prop(self.target, "MolLogP")
                 ),
-            ]
+            )
+
+    def set_target(self, ref_sillyness, ref_MW: tuple, ref_LogP: tuple):
+        """
+        Set target filters from pre-computed reference statistics
+        :param ref_sillyness: SillyWalks instance fit on the target
+        :param ref_MW: Mean and standard deviation of target MolWt
+        :param ref_LogP: Mean and standard deviation of target MolLogP
+        """
+        self.ref_sillyness = ref_sillyness
+        self.ref_MW = ref_MW
+        self.ref_LogP = ref_LogP
+        self.target_property_filters = [
+            partial(
+                self.property_filter,
+                prop="MolWt",
+                min=(self.ref_MW[0] - 4 * self.ref_MW[1]),
+                max=(self.ref_MW[0] + 4 * self.ref_MW[1]),
+            ),
+            partial(
+                self.property_filter,
+                prop="MolLogP",
+                min=(self.ref_LogP[0] - 4 * self.ref_LogP[1]),
+                max=(self.ref_LogP[0] + 4 * self.ref_LogP[1]),
+            ),
+            partial(
+                self.sillyness_filter,
+                ref_sillyness=self.ref_sillyness,
+                threshold=0.1,
+            ),
+        ]
 
     @staticmethod
     def MolWt(x):
@@ -22,6 +22,8 @@ from moleval.metrics.SA_Score import sascorer
 from moleval.metrics.NP_Score import npscorer
 from moleval.metrics.ifg import identify_functional_groups
 from moleval.metrics.quality_filters import rd_filters
+from moleval.metrics.substructure_engine import SubstructureEngine
+from moleval.metrics.bit_count_index import BitCountIndex
 
 _base_dir = os.path.split(__file__)[0]
 _mcf = pd.read_csv(os.path.join(_base_dir, 'mcf.csv'))
@@ -31,6 +33,7 @@ _alerts_path = os.path.join(_base_dir, 'quality_filters', 'alert_collection.csv'
 _guacamol_rules_path = os.path.join(_base_dir, 'quality_filters', 'guacamol_rules.json')
 _filters = [Chem.MolFromSmarts(x) for x in
             pd.concat([_mcf, _pains], axis=0, sort=True)['smarts'].values]
+_filter_engine = SubstructureEngine([f for f in _filters if f is not None])
 
 
 def mapper(n_jobs):
@@ -490,7 +493,7 @@ def mol_passes_filters(mol,
         return False
     # MCF, PAINS filters
     if filters:
-        if any(h_mol.HasSubstructMatch(smarts) for smarts in _filters):
+        if _filter_engine.has_match(h_mol):
             return False
 
     # RDKit parse check
@@ -572,7 +575,7 @@ def MCF_PAINS_filters(mol):
         return False
     h_mol = Chem.AddHs(mol)
 
-    if any(h_mol.HasSubstructMatch(smarts) for smarts in _filters):
+    if _filter_engine.has_match(h_mol):
         return False
     else:
         return True
@@ -580,14 +583,36 @@ def MCF_PAINS_filters(mol):
 
 class SillyWalks:
     """From https://github.com/PatWalters/silly_walks"""
-    def __init__(self, reference_mols, n_jobs=1):
-        self.count_dict = defaultdict(int)
+    def __init__(self, reference_mols, n_jobs=1, index: BitCountIndex = None):
         self._n_jobs = n_jobs
-        bit_counts = mapper(self._n_jobs)(self.count_bits, reference_mols)
-        for count_dict in bit_counts:
-            for k, v in count_dict.items():
-                self.count_dict[k] += v
+        if index is None:
+            index = BitCountIndex.from_mol_bits(mapper(self._n_jobs)(self.mol_bits, reference_mols))
+        self.index = index
+
+    @classmethod
+    def from_counts(cls, bits, counts, n_jobs=1):
+        """
+        Create from pre-computed reference bit counts
+        :param bits: Morgan fingerprint bit ids
+        :param counts: Corresponding counts in the reference dataset
+        """
+        return cls([], n_jobs=n_jobs, index=BitCountIndex(bits, counts))
+
+    @property
+    def count_dict(self) -> defaultdict:
+        """Reference bit counts as a dictionary"""
+        return defaultdict(int, zip(self.index.bits.tolist(), self.index.counts.tolist()))
+
+    def bit_counts(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return reference bit counts as sorted arrays of bit ids and counts
+        """
+        return self.index.bits, self.index.counts
             
+    @staticmethod
+    def mol_bits(mol):
+        return BitCountIndex.mol_bits(get_mol(mol))
+
     @staticmethod
     def count_bits(mol):
         count_dict = {}
@@ -604,23 +629,17 @@ class SillyWalks:
         :param mol: SMILES or RDKit Mol
         :return: (Ratio of outlier FP bits, identifies bits, molecule bit information) 
         """
-        mol = get_mol(mol)
-        if mol is not None:
-            bi = {}
-            fp = AllChem.GetMorganFingerprint(mol, 2, bitInfo=bi)
-            on_bits = fp.GetNonzeroElements().keys()
-            silly_bits = [bit for bit in on_bits if self.count_dict[bit] == 0]
-            score = len(silly_bits) / len(on_bits)
-            return score, silly_bits, bi
+        return self._score(mol, self.index)
 
     @staticmethod
-    def _score(mol: Union[str, Chem.rdchem.Mol], count_dict) -> Tuple:
+    def _score(mol: Union[str, Chem.rdchem.Mol], index: BitCountIndex) -> Tuple:
         mol = get_mol(mol)
         if mol is not None:
             bi = {}
             fp = AllChem.GetMorganFingerprint(mol, 2, bitInfo=bi)
-            on_bits = fp.GetNonzeroElements().keys()
-            silly_bits = [bit for bit in on_bits if count_dict[bit] == 0]
+            on_bits = list(fp.GetNonzeroElements().keys())
+            counts = index.lookup(np.asarray(on_bits, dtype=np.uint32))
+            silly_bits = [bit for bit, count in zip(on_bits, counts) if count == 0]
             score = len(silly_bits) / len(on_bits)
             return score, silly_bits, bi
 
@@ -630,8 +649,8 @@ class SillyWalks:
         :param: List of SMILES or RDKit Mols
         :return: Average ratio of outlier FP bits
         """
-        mols = [m for m in mapper(self._n_jobs)(get_mol, mols) if m is not None]
-        scores = [s[0] for s in mapper(self._n_jobs)(partial(self._score, count_dict=self.count_dict), mols)]
+        mol_bits = [b for b in mapper(self._n_jobs)(self.mol_bits, mols) if b is not None]
+        scores = self.index.silly_ratios(mol_bits)
         if normalize:
             return np.mean(scores)
         else:
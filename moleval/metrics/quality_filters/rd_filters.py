@@ -6,6 +6,8 @@ import pandas as pd
 import os
 import json
 
+from moleval.metrics.substructure_engine import SubstructureEngine
+
 
 def read_rules(rules_file_name):
     """
@@ -93,6 +95,7 @@ class RDFilters:
         # make sure there wasn't a blank line introduced
         self.rule_df = self.rule_df.dropna()
         self.rule_list = []
+        self.engine = SubstructureEngine([])
 
     def build_rule_list(self, alert_name_list):
         """
@@ -108,6 +111,11 @@ class RDFilters:
                 self.rule_list.append([smarts_mol, max_val, desc])
             else:
                 print(f"Error parsing SMARTS for rule {rule_id}", file=sys.stderr)
+        # Compile rules once for prescreened matching
+        self.engine = SubstructureEngine(
+            [patt for patt, _, _ in self.rule_list],
+            max_matches=[max_val for _, max_val, _ in self.rule_list],
+        )
 
     def get_alert_sets(self):
         """
@@ -125,8 +133,9 @@ class RDFilters:
             return ['INVALID', -999, -999, -999, -999, -999, -999]
         desc_list = [MolWt(mol), MolLogP(mol), NumHDonors(mol), NumHAcceptors(mol), TPSA(mol),
                      CalcNumRotatableBonds(mol)]
-        for row in self.rule_list:
-            patt, max_val, desc = row
-            if len(mol.GetSubstructMatches(patt)) > max_val:
-                return [desc + " > %d" % (max_val)] + desc_list
+        # First rule (in order) with more than max_val matches
+        i = self.engine.first_match(mol)
+        if i is not None:
+            patt, max_val, desc = self.rule_list[i]
+            return [desc + " > %d" % (max_val)] + desc_list
         return ["OK"] + desc_list
\ No newline at end of file
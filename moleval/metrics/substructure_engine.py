@@ -0,0 +1,87 @@
+import numpy as np
+from rdkit import Chem, DataStructs
+
+
+class SubstructureEngine:
+    """
+    Match a fixed set of SMARTS patterns against molecules. Patterns are compiled once and prescreened
+    with pattern fingerprints, a pattern is only matched if all of its fingerprint bits are set in the molecule.
+    """
+
+    def __init__(self, patterns: list, max_matches: list = None, fp_size: int = 2048):
+        """
+        :param patterns: List of SMARTS strings or query mols, those that fail to parse are dropped
+        :param max_matches: Maximum number of allowed matches per pattern before it is a hit, default is 0
+        :param fp_size: Pattern fingerprint size
+        """
+        if max_matches is None:
+            max_matches = [0] * len(patterns)
+        assert len(max_matches) == len(
+            patterns
+        ), "max_matches must be the same length as patterns"
+        self.fp_size = fp_size
+        self.smarts = []
+        self.patterns = []
+        self.max_matches = []
+        for patt, max_match in zip(patterns, max_matches):
+            query = Chem.MolFromSmarts(patt) if isinstance(patt, str) else patt
+            if query is None:
+                continue
+            self.smarts.append(
+                patt if isinstance(patt, str) else Chem.MolToSmarts(patt)
+            )
+            self.patterns.append(query)
+            self.max_matches.append(int(max_match))
+        # Packed query fingerprints (n_patterns x fp_size / 8)
+        self.query_fps = np.zeros((len(self.patterns), fp_size // 8), dtype=np.uint8)
+        for i, query in enumerate(self.patterns):
+            self.query_fps[i] = self._packed_fp(query)
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def _packed_fp(self, mol: Chem.rdchem.Mol) -> np.ndarray:
+        fp = Chem.PatternFingerprint(mol, fpSize=self.fp_size)
+        arr = np.zeros((self.fp_size,), dtype=np.uint8)
+        DataStructs.ConvertToNumpyArray(fp, arr)
+        return np.packbits(arr)
+
+    def candidates(self, mol: Chem.rdchem.Mol) -> np.ndarray:
+        """Indexes of patterns whose fingerprint bits are all present in the molecule"""
+        mol_fp = self._packed_fp(mol)
+        missing = self.query_fps & ~mol_fp
+        return np.flatnonzero(~missing.any(axis=1))
+
+    def _is_hit(self, mol: Chem.rdchem.Mol, i: int) -> bool:
+        if self.max_matches[i] == 0:
+            return mol.HasSubstructMatch(self.patterns[i])
+        matches = mol.GetSubstructMatches(
+            self.patterns[i], maxMatches=self.max_matches[i] + 1
+        )
+        return len(matches) > self.max_matches[i]
+
+    def first_match(self, mol: Chem.rdchem.Mol):
+        """Index of the first pattern hit (in pattern order) or None, stopping at the first hit"""
+        for i in self.candidates(mol):
+            if self._is_hit(mol, i):
+                return int(i)
+        return None
+
+    def has_match(self, mol: Chem.rdchem.Mol) -> bool:
+        """Whether any pattern is hit"""
+        return self.first_match(mol) is not None
+
+    def all_match(self, mol: Chem.rdchem.Mol) -> bool:
+        """Whether every pattern is hit, stopping at the first miss"""
+        candidates = self.candidates(mol)
+        if len(candidates) < len(self.patterns):
+            return False
+        return all(self._is_hit(mol, i) for i in candidates)
+
+    def matches(self, mol: Chem.rdchem.Mol) -> list:
+        """Indexes of all patterns hit"""
+        return [int(i) for i in self.candidates(mol) if self._is_hit(mol, i)]
+
+    def matched_smarts(self, mol: Chem.rdchem.Mol) -> list:
+        """SMARTS of all patterns hit"""
+        return [self.smarts[i] for i in self.matches(mol)]
@@ -1,4 +1,5 @@
 import atexit
+import inspect
 import json
 import logging
 import os
@@ -19,6 +20,7 @@ import molscore.scoring_functions as scoring_functions
 from moleval.metrics.score_metrics import ScoreMetrics
 from molscore import resources, utils
 from molscore.gui import monitor_path
+from molscore.scoring_functions.base import ColumnarResults
 
 logger = logging.getLogger("molscore")
 logger.setLevel(logging.WARNING)
@@ -245,6 +247,20 @@ class MolScore:
         atexit.register(self.kill_monitor)
         logger.info("MolScore initiated")
 
+    def _consumed_metrics(self, fclass, parameters: dict) -> list:
+        """
+        Return metrics of a scoring function class that are used by the task (either scored or filtered)
+        :param fclass: Scoring function class
+        :param parameters: Parameters the scoring function will be initialized with
+        :return: List of return metrics without prefix, empty if none are used
+        """
+        prefix = parameters.get("prefix")
+        if prefix is None:
+            prefix = inspect.signature(fclass).parameters["prefix"].default
+        prefix = str(prefix).strip().replace(" ", "_")
+        consumed = set(metric["name"] for metric in self.cfg["scoring"]["metrics"])
+        return [m for m in fclass.return_metrics if f"{prefix}_{m}" in consumed]
+
     def _set_objective(
         self,
         task_config: str = None,
@@ -271,7 +287,23 @@ class MolScore:
             if fconfig["run"]:
                 for fclass in scoring_functions.all_scoring_functions:
                     if fclass.__name__ == fconfig["name"]:
-                        self.scoring_functions.append(fclass(**fconfig["parameters"]))
+                        parameters = dict(fconfig["parameters"])
+                        # Optional executor config e.g., {"backend": "dask", "address": ...}
+                        if "executor" in fconfig:
+                            if "executor" in inspect.signature(fclass).parameters:
+                                parameters["executor"] = fconfig["executor"]
+                            else:
+                                logger.warning(
+                                    f"{fclass.__name__} does not support an executor, ignoring"
+                                )
+                        # Only calculate the metrics consumed by the task, if supported
+                        if ("subset" not in parameters) and (
+                            "subset" in inspect.signature(fclass).parameters
+                        ):
+                            subset = self._consumed_metrics(fclass, parameters)
+                            if subset:
+                                parameters["subset"] = subset
+                        self.scoring_functions.append(fclass(**parameters))
                 if all(
                     [
                         fclass.__name__ != fconfig["name"]
@@ -448,19 +480,26 @@ class MolScore:
         :param file_names: A corresponding list of file prefixes for tracking - format={step}_{batch_idx}
         :return: self.results (a list of dictionaries with smiles and resulting scores)
         """
-        self.results_df = pd.DataFrame(smiles, columns=["smiles"])
+        results = ColumnarResults(smiles)
         for function in self.scoring_functions:
-            results = function(
+            function_results = function(
                 smiles=smiles,
                 directory=self.save_dir,
                 file_names=file_names,
                 additional_formats=additional_formats,
+                columnar=True,
             )
-            results_df = pd.DataFrame(results)
-
-            self.results_df = self.results_df.merge(
-                results_df, on="smiles", how="outer", sort=False
-            )
+            # Scoring functions that don't support columnar results return a list of dicts
+            if not isinstance(function_results, ColumnarResults):
+                function_results = ColumnarResults.from_records(
+                    function_results, smiles=smiles
+                )
+            # Assemble positionally, in the same order as smiles
+            results.update(function_results)
+            # Where time was spent e.g., by servers (only pulled if it will be logged)
+            if logger.isEnabledFor(logging.DEBUG) and hasattr(function, "log_metrics"):
+                function.log_metrics(logger)
+        self.results_df = results.to_frame()
 
         # Drop any duplicates in results
         self.results_df = self.results_df.drop_duplicates(subset="smiles")
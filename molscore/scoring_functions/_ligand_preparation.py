@@ -1,6 +1,7 @@
 import os
 import subprocess
 import warnings
+from functools import partial
 
 from rdkit.Chem import AllChem as Chem
 from rdkit.Chem.EnumerateStereoisomers import (
@@ -8,7 +9,13 @@ from rdkit.Chem.EnumerateStereoisomers import (
     StereoEnumerationOptions,
 )
 
-from molscore.scoring_functions.utils import get_mol, timedFunc2, timedSubprocess
+from molscore.scoring_functions.utils import (
+    TimeoutPool,
+    get_mol,
+    schedule_cores,
+    timedFunc2,
+    timedSubprocess,
+)
 from molscore.scoring_functions.gypsum_dl.MolContainer import MolContainer
 from molscore.scoring_functions.gypsum_dl.Parallelizer import Parallelizer
 from molscore.scoring_functions.gypsum_dl.Start import add_mol_id_props, prepare_3d, prepare_smiles
@@ -36,6 +43,15 @@ def catch_prepare_3d(contrn, params):
         return None
 
 
+def catch_prepare_step(step, contrn, params, num_threads=1):
+    """Run a single GypsumDL step on a single container, for use in a TimeoutPool"""
+    params = dict(params, num_threads=num_threads)
+    if step == "smiles":
+        return catch_prepare_smiles([contrn], params)
+    else:
+        return catch_prepare_3d([contrn], params)
+
+
 class LigandPreparation:
     """
     Class to collect ligand preparation protocols required for any Docking scoring functions
@@ -474,23 +490,27 @@ class GypsumDL(LigandPreparation):
         thoroughness: int = 1,
         enforce_tautomer: str = None,
         max_variants_per_compound: int = 8,
+        n_jobs: int = 1,
         **kwargs,
     ):
         """
         Initialize LigPrep ligand preparation
         :param dask_client: Scheduler address for dask parallelization or number of workers
-        :param timeout: Timeout for subprocess before killing, only relevant if using dask (currently ignored)
+        :param timeout: Timeout per molecule and preparation step before killing
         :param logger: Currently used logger if present
         :param pH: pH at which to protonate molecules at
         :param pHt: pH Tolerance
         :param skip_geometry_optimize: Skip geometry optimization
         :param thoroughness: How many molecules to generate per 'max_variant'
         :param enforce_tautomer: Enforce a particular tautomer by way of a well-defined SMARTS, if not present in any, don't enforce.
+        :param n_jobs: Number of cores without dask, split between molecules (processes) and 3D conformers (threads) depending on batch size
         """
         super().__init__(timeout=timeout, logger=logger)
         self.dask_client = dask_client
         self.timeout = timeout
         self.enforce_tautomer = enforce_tautomer
+        self.pool = None  # Warm worker pool for timed preparation without dask
+        self.n_jobs = n_jobs
 
         n_jobs = 1
         job_manager = "serial"
@@ -530,6 +550,28 @@ class GypsumDL(LigandPreparation):
         )
         # Can use GypsumDLDaskParallelizer(client=self.dask_client) wrapper (see below)
 
+    def _timed_prepare(self, step: str, contnrs: list, logger=None):
+        """
+        Run a GypsumDL step per container in the worker pool, keeping the original container on timeout or error
+        :param step: Preparation step [smiles, 3d]
+        :param contnrs: List of MolContainers
+        :return: List of MolContainers
+        """
+        # Use spare cores for multi-threaded conformer embedding and minimization
+        _, n_threads = schedule_cores(len(contnrs), self.pool.n_workers)
+        results = self.pool.starmap(
+            [(step, c) for c in contnrs], kwargs={"num_threads": n_threads}
+        )
+        new_contnrs = []
+        for oc, nc in zip(contnrs, results):
+            if nc:
+                new_contnrs.append(nc[0])
+            else:
+                new_contnrs.append(oc)
+                if logger:
+                    logger.debug(f"Error or timeout preparing ({step}): {oc.orig_smi}")
+        return new_contnrs
+
     def prepare(
         self,
         smiles: list,
@@ -611,10 +653,16 @@ class GypsumDL(LigandPreparation):
                 logger.debug(
                     "Preparing protonation states, tautomers and stereoisomers with Gypsum-DL"
                 )
-            contnrs = catch_prepare_smiles(contnrs, self.gypsum_params)
+            if self.pool is None:
+                self.pool = TimeoutPool(
+                    partial(catch_prepare_step, params=self.gypsum_params),
+                    n_workers=self.n_jobs,
+                    timeout=self.timeout,
+                )
+            contnrs = self._timed_prepare("smiles", contnrs, logger=logger)
             if logger:
                 logger.debug("Preparing 3D embedding with Gypsum-DL")
-            contnrs = catch_prepare_3d(contnrs, self.gypsum_params)
+            contnrs = self._timed_prepare("3d", contnrs, logger=logger)
 
         # Enforce specified tautomers
         if self.enforce_tautomer:
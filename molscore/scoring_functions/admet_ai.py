@@ -129,4 +129,5 @@ class ADMETAI(BaseServerSF):
                 "admet_ai_server.py"
             ),
             server_grace=30,
+            **kwargs,
         )
@@ -1,13 +1,20 @@
 import logging
 import os
+import time
 from functools import partial
 from typing import Tuple, Union
 
 import numpy as np
 from rdkit.Chem import AllChem as Chem
+from rdkit.Chem import rdMolDescriptors
 from rdkit.Chem.Pharm2D import Generate, Gobbi_Pharm2D
 
-from molscore.scoring_functions.utils import Pool, SimilarityMeasures
+from molscore.scoring_functions.utils import (
+    ConformerCache,
+    SimilarityMeasures,
+    TimeoutPool,
+    schedule_cores,
+)
 
 logger = logging.getLogger("align3d")
 formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
@@ -30,8 +37,13 @@ class Align3D:
         similarity_method: str = "Tanimoto",
         agg_method: str = "mean",
         max_confs: int = 100,
+        minimize_confs: bool = False,
         pharmacophore_similarity: bool = True,
+        coarse_top_k: int = None,
+        cache_conformers: bool = False,
+        cache_size_mb: float = 1024,
         n_jobs: int = 1,
+        timeout: float = None,
         **kwargs,
     ):
         """
@@ -41,19 +53,41 @@ class Align3D:
         :param similarity_method: Method for comparing similarity between between 3D molecules [Tanimoto, Tversky]
         :param agg_method: Method for aggregating score accross several reference molecules [mean, median, max, min]
         :param max_confs: Maximum number of conformers to generate when assessing alignments
+        :param minimize_confs: Whether to minimize conformers with MMFF94s after embedding
         :param pharmacophore_similarity: Whether to additionally calculate a pharamcophore fingerprint that will be added to the similarity measure
-        :param n_jobs: Number of jobs for parallelization
+        :param coarse_top_k: Coarse-to-fine alignment, rank conformers by USRCAT similarity to each reference and only align the top k with O3A (default aligns all conformers)
+        :param cache_conformers: Whether to cache generated conformers on disk by canonical SMILES, re-used across steps and runs.
+          Cached under ~/.cache/molscore/align3d_conformers (or $MOLSCORE_CACHE/align3d_conformers), one directory per conformer parameters
+        :param cache_size_mb: Maximum size of the conformer cache on disk, least recently used conformers are evicted beyond it
+        :param n_jobs: Number of cores, split between molecules (processes) and conformer embedding (threads) depending on batch size
+        :param timeout: Timeout (seconds) per molecule before the worker is killed and a score of 0.0 is returned
         """
         self.prefix = prefix.strip().replace(" ", "_")
         self.ref_smiles = ref_smiles if ref_smiles is not None else []
         self.ref_sdf = ref_sdf
         self.max_confs = max_confs
+        self.minimize_confs = minimize_confs
         assert similarity_method in ["Tanimoto", "Tversky"]
         self.similarity_method = similarity_method
         assert agg_method in ["mean", "median", "max", "min"]
         self.agg_method = getattr(np, agg_method)
         self.pharmacophore_similarity = pharmacophore_similarity
+        self.coarse_top_k = coarse_top_k
+        self.conformer_cache = (
+            ConformerCache(
+                "align3d_conformers",
+                max_confs=max_confs,
+                pruneRmsThresh=0.1,
+                minimize=minimize_confs,
+                max_size_mb=cache_size_mb,
+            )
+            if cache_conformers
+            else None
+        )
         self.n_jobs = n_jobs
+        self.timeout = timeout
+        self.pool = None  # Warm worker pool, started on first use
+        self.stage_times = {}  # Total time per stage in the last call
         self.ref_mols = []
 
         # Check input
@@ -77,7 +111,7 @@ class Align3D:
                         logger.warning(
                             f"Molecule {i} from {os.path.basename(self.ref_sdf)} has no conformation"
                         )
-                        mol = self.prepare_mol(mol)
+                        mol = self.prepare_mol(mol, num_threads=self.n_jobs)
                         to_align.append(mol)
                 else:
                     logger.warning(
@@ -112,7 +146,7 @@ class Align3D:
                 for smi in self.ref_smiles:
                     mol = Chem.MolFromSmiles(smi)
                     if mol:
-                        mol = self.prepare_mol(mol)
+                        mol = self.prepare_mol(mol, num_threads=self.n_jobs)
                         aligned_mol = self.align_to_ref_mols(mol)
                         self.ref_mols.append(aligned_mol)
                     else:
@@ -127,7 +161,7 @@ class Align3D:
                 for smi in self.ref_smiles:
                     mol = Chem.MolFromSmiles(smi)
                     if mol:
-                        mol = self.prepare_mol(mol)
+                        mol = self.prepare_mol(mol, num_threads=self.n_jobs)
                         to_align.append(mol)
                     else:
                         logger.warning(f"SMILES parsing failed: {smi}")
@@ -142,6 +176,10 @@ class Align3D:
 
         # Calculate fps
         self.ref_fps = [self.get_3D_pharmacophore_fp(mol) for mol in self.ref_mols]
+        if self.coarse_top_k:
+            self.ref_usrcats = [self.get_usrcat(mol) for mol in self.ref_mols]
+        else:
+            self.ref_usrcats = [None] * len(self.ref_mols)
 
         assert (
             len(self.ref_mols) > 0
@@ -186,28 +224,56 @@ class Align3D:
         return mol
 
     @staticmethod
-    def prepare_mol(mol: Chem.rdchem.Mol, max_confs: int = 100) -> Chem.rdchem.Mol:
-        """Prepare a mol for alignment by add hydrogens and generating conformations."""
+    def prepare_mol(
+        mol: Chem.rdchem.Mol,
+        max_confs: int = 100,
+        num_threads: int = 1,
+        minimize: bool = False,
+    ) -> Chem.rdchem.Mol:
+        """Prepare a mol for alignment by add hydrogens and generating conformations, using num_threads threads."""
         # Add Hs
         mol = Chem.AddHs(mol)
         # Generate confs
-        Chem.EmbedMultipleConfs(mol, numConfs=max_confs, pruneRmsThresh=0.1)
+        Chem.EmbedMultipleConfs(
+            mol, numConfs=max_confs, pruneRmsThresh=0.1, numThreads=num_threads
+        )
         # Minimize
-        # Chem.MMFFGetMoleculeProperties(mol, mmffVariant='MMFF94s')
-        # Chem.MMFFOptimizeMoleculeConfs(mol,  mmffVariant='MMFF94s')
+        if minimize:
+            Chem.MMFFOptimizeMoleculeConfs(
+                mol, numThreads=num_threads, mmffVariant="MMFF94s"
+            )
         return mol
 
     @staticmethod
     def align_best_conf(
-        mol: Chem.rdchem.Mol, ref_mol: Chem.rdchem.Mol, ref_conf_id: int = -1
+        mol: Chem.rdchem.Mol,
+        ref_mol: Chem.rdchem.Mol,
+        ref_conf_id: int = -1,
+        conf_ids: list = None,
     ) -> Tuple[Chem.rdchem.Mol, Tuple[int, float]]:
         """Return the conf_id and score (higher is better) of the best conformer to align to the ref."""
-        # Align all confs
-        res = Chem.GetO3AForProbeConfs(
-            prbMol=mol, refMol=ref_mol, refCid=ref_conf_id, maxIters=100
-        )
-        # Add index
-        res = list(enumerate(res))
+        if conf_ids is None:
+            # Align all confs
+            res = Chem.GetO3AForProbeConfs(
+                prbMol=mol, refMol=ref_mol, refCid=ref_conf_id, maxIters=100
+            )
+            # Add index
+            res = list(enumerate(res))
+        else:
+            # Align only a subset of confs
+            res = [
+                (
+                    cid,
+                    Chem.GetO3A(
+                        prbMol=mol,
+                        refMol=ref_mol,
+                        prbCid=cid,
+                        refCid=ref_conf_id,
+                        maxIters=100,
+                    ),
+                )
+                for cid in conf_ids
+            ]
         # Sort by highest score
         res = sorted(res, key=lambda x: x[1].Score(), reverse=True)
         # Align best conf
@@ -276,6 +342,53 @@ class Align3D:
         measure = SimilarityMeasures.get("Tanimoto")
         return measure(fp1, fp2)
 
+    @staticmethod
+    def get_usrcat(mol: Chem.rdchem.Mol, conf_id=-1):
+        """Alignment free shape and pharmacophore descriptor, None if it can't be computed (e.g., too few atoms)"""
+        try:
+            return rdMolDescriptors.GetUSRCAT(mol, confId=conf_id)
+        except (ValueError, RuntimeError):
+            return None
+
+    @staticmethod
+    def rank_conformers(mol: Chem.rdchem.Mol, ref_usrcat, top_k: int) -> list:
+        """Return the conf_id's of the top k conformers most similar to the reference by USRCAT, or None for all"""
+        conf_ids = [conf.GetId() for conf in mol.GetConformers()]
+        if (ref_usrcat is None) or (len(conf_ids) <= top_k):
+            return None
+        scores = []
+        for cid in conf_ids:
+            usrcat = Align3D.get_usrcat(mol, conf_id=cid)
+            if usrcat is None:
+                return None
+            scores.append(rdMolDescriptors.GetUSRScore(usrcat, ref_usrcat))
+        return [conf_ids[i] for i in np.argsort(scores)[::-1][:top_k]]
+
+    @staticmethod
+    def get_conformers(
+        mol: Chem.rdchem.Mol,
+        max_confs: int,
+        conformer_cache: ConformerCache = None,
+        num_threads: int = 1,
+        minimize: bool = False,
+    ) -> Chem.rdchem.Mol:
+        """Prepare a mol for alignment, loading conformers from the cache if available."""
+        pfunc = partial(
+            Align3D.prepare_mol,
+            max_confs=max_confs,
+            num_threads=num_threads,
+            minimize=minimize,
+        )
+        if conformer_cache is None:
+            return pfunc(mol)
+        smi = Chem.MolToSmiles(mol)
+        cached_mol = conformer_cache.get(smi)
+        if cached_mol is not None:
+            return cached_mol
+        mol = pfunc(mol)
+        conformer_cache.set(smi, mol)
+        return mol
+
     @staticmethod
     def score_smi(
         smi: str,
@@ -286,19 +399,52 @@ class Align3D:
         similarity_method: str,
         agg_method,
         pharmacophore: bool,
+        ref_usrcats: list = None,
+        coarse_top_k: int = None,
+        conformer_cache: ConformerCache = None,
+        minimize_confs: bool = False,
+        num_threads: int = 1,
     ):
         result = {"smiles": smi}
         mol = Chem.MolFromSmiles(smi)
         if mol:
+            timings = {}
             # Prepare confs
-            mol = Align3D.prepare_mol(mol, max_confs=max_confs)
+            t0 = time.perf_counter()
+            mol = Align3D.get_conformers(
+                mol,
+                max_confs=max_confs,
+                conformer_cache=conformer_cache,
+                num_threads=num_threads,
+                minimize=minimize_confs,
+            )
+            timings["embed"] = time.perf_counter() - t0
+            timings["coarse"] = 0.0
+            timings["align"] = 0.0
             # Align to each ref mol
             O3A_scores = []
             cids = []
             sim_scores = []
             fsim_scores = []
-            for rmol, rfp in zip(ref_mols, ref_fps):
-                mol, (cid, score) = Align3D.align_best_conf(mol, ref_mol=rmol)
+            last_aligned = {}  # conf_id: index of the reference it was last aligned to
+            if ref_usrcats is None:
+                ref_usrcats = [None] * len(ref_mols)
+            for i, (rmol, rfp, rusrcat) in enumerate(
+                zip(ref_mols, ref_fps, ref_usrcats)
+            ):
+                conf_ids = None
+                if coarse_top_k:
+                    t0 = time.perf_counter()
+                    conf_ids = Align3D.rank_conformers(
+                        mol, ref_usrcat=rusrcat, top_k=coarse_top_k
+                    )
+                    timings["coarse"] += time.perf_counter() - t0
+                t0 = time.perf_counter()
+                mol, (cid, score) = Align3D.align_best_conf(
+                    mol, ref_mol=rmol, conf_ids=conf_ids
+                )
+                timings["align"] += time.perf_counter() - t0
+                last_aligned[cid] = i
                 O3A_scores.append(score)
                 cids.append(cid)
                 sim_scores.append(
@@ -311,16 +457,19 @@ class Align3D:
                         Align3D.get_3D_pharmacophore_fp(mol, conf_id=cid), rfp
                     )
                 )
-            # Align mol to most similar rfp
+            # Align mol to most similar rfp, unless it's still aligned from above
             best_ref_idx = int(np.argmax(O3A_scores))
             best_cid_idx = cids[best_ref_idx]
-            algn = Chem.GetO3A(
-                prbMol=mol,
-                refMol=ref_mols[best_ref_idx],
-                maxIters=100,
-                prbCid=best_cid_idx,
-            )
-            algn.Align()
+            if last_aligned[best_cid_idx] != best_ref_idx:
+                t0 = time.perf_counter()
+                algn = Chem.GetO3A(
+                    prbMol=mol,
+                    refMol=ref_mols[best_ref_idx],
+                    maxIters=100,
+                    prbCid=best_cid_idx,
+                )
+                algn.Align()
+                timings["align"] += time.perf_counter() - t0
             mol = Align3D.set_conformer(mol, conf_id=best_cid_idx)
             # Aggregate scores
             result.update(
@@ -340,6 +489,8 @@ class Align3D:
                 )
             else:
                 result.update({f"{prefix}_shape_score": agg_method(sim_scores)})
+            # Per-stage timings, only logged (see score) rather than returned as metrics
+            result["_timings"] = timings
         else:
             result.update({f"{prefix}_{m}": 0.0 for m in Align3D.return_metrics})
         return result
@@ -369,10 +520,35 @@ class Align3D:
             similarity_method=self.similarity_method,
             agg_method=self.agg_method,
             pharmacophore=self.pharmacophore_similarity,
+            ref_usrcats=self.ref_usrcats,
+            coarse_top_k=self.coarse_top_k,
+            conformer_cache=self.conformer_cache,
+            minimize_confs=self.minimize_confs,
         )
         # Score individual smiles
-        with Pool(self.n_jobs) as pool:
-            results = [r for r in pool.imap(pfunc, smiles)]
+        if self.pool is None:
+            self.pool = TimeoutPool(pfunc, n_workers=self.n_jobs, timeout=self.timeout)
+        # Use spare cores for multi-threaded conformer embedding
+        _, n_threads = schedule_cores(len(smiles), self.pool.n_workers)
+        results = self.pool.map(smiles, kwargs={"num_threads": n_threads})
+        for i, (smi, r) in enumerate(zip(smiles, results)):
+            if r is None:
+                logger.warning(
+                    f"Timeout of {self.timeout} reached for {smi}, returning 0.0"
+                )
+                results[i] = {"smiles": smi}
+                results[i].update(
+                    {f"{self.prefix}_{m}": 0.0 for m in self.return_metrics}
+                )
+        # Log total time per stage
+        self.stage_times = {stage: 0.0 for stage in ["embed", "coarse", "align"]}
+        for r in results:
+            for stage, t in r.pop("_timings", {}).items():
+                self.stage_times[stage] += t
+        logger.debug(
+            "Stage times: "
+            + ", ".join(f"{k} {v:.02f}s" for k, v in self.stage_times.items())
+        )
         # Save mols
         for r, name in zip(results, file_names):
             file_path = os.path.join(directory, name + ".sdf")
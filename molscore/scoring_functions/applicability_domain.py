@@ -9,7 +9,13 @@ from rdkit.Chem import AllChem as Chem
 from rdkit.Chem.rdMolDescriptors import CalcFractionCSP3
 from rdkit.Chem.Scaffolds import MurckoScaffold
 
-from molscore.scoring_functions.utils import Fingerprints, Pool, get_mol
+from molscore.scoring_functions.base import ColumnarResults, format_results
+from molscore.scoring_functions.utils import (
+    Executor,
+    Fingerprints,
+    ReferenceCache,
+    get_mol,
+)
 
 logger = logging.getLogger("applicability_domain")
 formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
@@ -25,10 +31,10 @@ class ApplicabilityDomain:
     Maxime Langevin et al. in "Impact of applicability domains to generative artificial intelligence"
     10.26434/chemrxiv-2022-mdhwz
     Note: Use several of me to combine different similarity-feature combinations
-    Note: Only range is computed here, MolecularSimilarity can be used to compute distance to reference FPs
+    Note: By default only range is computed, alternatively the k-NN distance to the reference features can be used
     """
 
-    return_metrics = ["in_AD"]
+    return_metrics = ["in_AD", "fp_in_AD", "qed_in_AD", "physchem_in_AD", "kNN_dist"]
 
     def __init__(
         self,
@@ -37,7 +43,11 @@ class ApplicabilityDomain:
         fp: str = None,
         qed: bool = False,
         physchem: bool = True,
+        method: str = "range",
+        k: int = 5,
+        knn_z: float = 0.5,
         n_jobs: int = 1,
+        executor: dict = None,
         **kwargs,
     ):
         """
@@ -45,13 +55,23 @@ class ApplicabilityDomain:
         :param ref_smiles: A file_path to or list of reference smiles used to define the applicability domain.
         :param QED: Whether to include QED
         :param fp: Type of fingerprint used to featurize the molecule [ECFP4, ECFP4c, FCFP4, FCFP4c, ECFP6, ECFP6c, FCFP6, FCFP6c, Avalon, MACCSkeys, AP, hashAP, hashTT, RDK5, RDK6, RDK7, PHCO]
+        :param method: Definition of the applicability domain, within the range of all reference features or within a k-NN distance threshold of the reference set [range, kNN]
+        :param k: Number of nearest neighbours for the kNN method
+        :param knn_z: kNN distance threshold is the mean + knn_z * standard deviation of reference k-NN distances
         :param n_jobs: Number of python.multiprocessing jobs for multiprocessing
+        :param executor: Executor parameters e.g., {"backend": "dask", "address": "tcp://..."}, default is based on n_jobs
         """
+        assert method in ["range", "kNN"], "method must be one of [range, kNN]"
         self.prefix = prefix.replace(" ", "_")
         self.fp = fp
         self.qed = qed
         self.physchem = physchem
+        self.method = method
+        self.k = k
+        self.knn_z = knn_z
         self.n_jobs = n_jobs
+        self.executor = Executor.from_config(executor, n_jobs=n_jobs)
+        self.blocks = self.feature_blocks(fp=fp, qed=qed, physchem=physchem)
 
         # If file path provided, load smiles.
         if isinstance(ref_smiles, str):
@@ -63,19 +83,82 @@ class ApplicabilityDomain:
             ), "None list or empty list provided"
             self.ref_smiles = ref_smiles
 
-        # Calculate features
-        logger.info("Computing reference features")
-        with Pool(self.n_jobs) as pool:
-            mols = [m for m in pool.imap(get_mol, self.ref_smiles) if m is not None]
-            pfunc = partial(
-                self.compute_features, fp=self.fp, qed=self.qed, physchem=self.physchem
+        # Calculate features, loading from cache if a file path is provided
+        self.cache = None
+        if isinstance(ref_smiles, str):
+            self.cache = ReferenceCache(
+                ref_smiles,
+                name="applicability_domain",
+                fp=self.fp,
+                qed=self.qed,
+                physchem=self.physchem,
             )
-            self.ref_features = np.asarray([f for f in pool.imap(pfunc, mols)])
+            self.ref_features = self.cache.get(
+                ["features"], self._compute_ref_features
+            )["features"]
+        else:
+            self.ref_features = self._compute_ref_features()["features"]
 
         # Compound bounds
         self.ref_max = np.max(self.ref_features, axis=0)
         self.ref_min = np.min(self.ref_features, axis=0)
 
+        # k-NN index of standardized reference features and distance threshold
+        self.knn_threshold = None
+        if self.method == "kNN":
+            self.ref_mean = np.mean(self.ref_features, axis=0)
+            self.ref_std = np.std(self.ref_features, axis=0)
+            self.ref_std[self.ref_std == 0] = 1.0
+            self.ref_scaled = self._scale(self.ref_features)
+            self.ref_sq_norms = np.einsum("ij,ij->i", self.ref_scaled, self.ref_scaled)
+            if self.cache is not None:
+                ref_dists = self.cache.get(
+                    [f"kNN{self.k}_distances"], self._compute_ref_knn
+                )[f"kNN{self.k}_distances"]
+            else:
+                ref_dists = self._compute_ref_knn()[f"kNN{self.k}_distances"]
+            self.knn_threshold = float(
+                np.mean(ref_dists) + self.knn_z * np.std(ref_dists)
+            )
+            logger.info(f"k-NN distance threshold: {self.knn_threshold:.3f}")
+
+    def _compute_ref_features(self):
+        logger.info("Computing reference features")
+        valid, features = self.featurize(self.ref_smiles)
+        return {"features": features[valid]}
+
+    def _compute_ref_knn(self):
+        logger.info("Computing reference k-NN distances")
+        # Exclude each reference from its own neighbours
+        dists = self.knn_distances(self.ref_scaled, k=self.k + 1)
+        return {f"kNN{self.k}_distances": np.sort(dists, axis=1)[:, 1:].mean(axis=1)}
+
+    def _scale(self, features: np.ndarray) -> np.ndarray:
+        return (features - self.ref_mean) / self.ref_std
+
+    def knn_distances(
+        self, scaled_features: np.ndarray, k: int, batch_size: int = 1024
+    ) -> np.ndarray:
+        """
+        Euclidean distances to the k nearest reference molecules in standardized feature space
+        :param scaled_features: Standardized features (n_mols x n_features)
+        :param k: Number of nearest neighbours
+        :param batch_size: Number of molecules compared to the reference at once, to bound memory
+        :return: Array of distances (n_mols x k), unsorted
+        """
+        k = min(k, len(self.ref_scaled))
+        dists = np.empty((len(scaled_features), k))
+        for i in range(0, len(scaled_features), batch_size):
+            batch = scaled_features[i : i + batch_size]
+            sq_dists = (
+                np.einsum("ij,ij->i", batch, batch)[:, None]
+                + self.ref_sq_norms[None, :]
+                - 2 * batch @ self.ref_scaled.T
+            )
+            sq_dists = np.partition(sq_dists, k - 1, axis=1)[:, :k]
+            dists[i : i + batch_size] = np.sqrt(np.clip(sq_dists, 0, None))
+        return dists
+
     @staticmethod
     def compute_physchem(mol: Union[Chem.rdchem.Mol, str]) -> list:
         """
@@ -118,6 +201,63 @@ class ApplicabilityDomain:
         physchem_features.append(len(FindMolChiralCenters(mol, includeUnassigned=True)))
         return physchem_features
 
+    @staticmethod
+    def feature_blocks(
+        fp: str = None, qed: bool = False, physchem: bool = True
+    ) -> dict:
+        """
+        Column slices of each feature block in the feature matrix e.g., {'fp': slice(0, 1024), ...}
+        """
+        probe = Chem.MolFromSmiles("c1ccccc1C")
+        sizes = {}
+        if fp:
+            sizes["fp"] = len(
+                Fingerprints.get(probe, name=fp, nBits=1024, asarray=True)
+            )
+        if qed:
+            sizes["qed"] = 1
+        if physchem:
+            sizes["physchem"] = len(ApplicabilityDomain.compute_physchem(probe))
+        blocks = {}
+        start = 0
+        for name, size in sizes.items():
+            blocks[name] = slice(start, start + size)
+            start += size
+        return blocks
+
+    @staticmethod
+    def compute_feature_matrix(
+        mols: list,
+        fp: str = None,
+        qed: bool = False,
+        physchem: bool = True,
+    ) -> tuple:
+        """
+        Compute features for a batch of molecules as specified during initialisation
+        :param mols: List of RDKit mols or SMILES
+        :return: Boolean array of valid molecules, feature matrix (n_mols x n_features) where invalid rows are NaN
+        """
+        blocks = ApplicabilityDomain.feature_blocks(fp=fp, qed=qed, physchem=physchem)
+        n_features = max([b.stop for b in blocks.values()], default=0)
+        features = np.full((len(mols), n_features), np.nan)
+        valid = np.zeros(len(mols), dtype=bool)
+        for i, mol in enumerate(mols):
+            mol = get_mol(mol)
+            if mol is None:
+                continue
+            valid[i] = True
+            if physchem:
+                physchems = ApplicabilityDomain.compute_physchem(mol)
+                features[i, blocks["physchem"]] = physchems
+            if fp:
+                features[i, blocks["fp"]] = Fingerprints.get(
+                    mol, name=fp, nBits=1024, asarray=True
+                )
+            if qed:
+                # QED is the first physchem descriptor
+                features[i, blocks["qed"]] = physchems[0] if physchem else QED.qed(mol)
+        return valid, features
+
     @staticmethod
     def compute_features(
         mol: Union[Chem.rdchem.Mol, str],
@@ -128,78 +268,66 @@ class ApplicabilityDomain:
         """
         Compute features as specified during initialisation
         """
-        mol = get_mol(mol)
-        if mol:
-            mol_features = None
-
-            if fp:
-                fp = list(Fingerprints.get(mol, name=fp, nBits=1024, asarray=True))
-                if mol_features is None:
-                    mol_features = fp
-                else:
-                    mol_features += fp
-
-            if qed:
-                qed = QED.qed(mol)
-                if mol_features is None:
-                    mol_features = [qed]
-                else:
-                    mol_features += [qed]
-
-            if physchem:
-                physchems = ApplicabilityDomain.compute_physchem(mol)
-                if mol_features is None:
-                    mol_features = physchems
-                else:
-                    mol_features += physchems
-            return mol_features
+        valid, features = ApplicabilityDomain.compute_feature_matrix(
+            [mol], fp=fp, qed=qed, physchem=physchem
+        )
+        if valid[0]:
+            return features[0].tolist()
 
-    @staticmethod
-    def score_smi(smi, prefix, ref_max, ref_min, fp, qed, physchem):
+    def featurize(self, smiles: list) -> tuple:
         """
-        Calculate the score for a single smiles
+        Compute the feature matrix of a batch of molecules, in parallel batches if using multiple jobs
+        :param smiles: List of SMILES strings or RDKit mols
+        :return: Boolean array of valid molecules, feature matrix (n_mols x n_features)
         """
-        result = {"smiles": smi}
-        # Compute features
-        smi_features = ApplicabilityDomain.compute_features(
-            smi, fp=fp, qed=qed, physchem=physchem
+        pfunc = partial(
+            self.compute_feature_matrix,
+            fp=self.fp,
+            qed=self.qed,
+            physchem=self.physchem,
         )
-        if smi_features is not None:
-            # Check domain
-            above_min = ref_min <= smi_features
-            below_max = ref_max >= smi_features
-            in_domain = above_min & below_max
-            result.update({f"{prefix}_in_AD": float(in_domain.all())})
-        else:
-            result.update(
-                {f"{prefix}_{m}": 0.0 for m in ApplicabilityDomain.return_metrics}
-            )
-        return result
+        batches = self.executor.map_batches(pfunc, smiles)
+        valid = np.concatenate([b[0] for b in batches])
+        features = np.concatenate([b[1] for b in batches])
+        return valid, features
 
-    def score(self, smiles: list, **kwargs) -> list:
+    def score(self, smiles: list, columnar: bool = False, **kwargs):
         """
-        Calculate the binary scores representing whether smiles are within the AD (1.0) or not (0.0)
+        Calculate the binary scores representing whether smiles are within the AD (1.0) or not (0.0),
+         as well as the fraction of each feature block within the reference range and the mean k-NN distance (if used)
         :param smiles: List of SMILES strings
+        :param columnar: Return ColumnarResults instead of a list of dicts
         :return: List of dicts i.e. [{'smiles': smi, 'metric': 'value', ...}, ...]
         """
-        # Compute features
-        with Pool(self.n_jobs) as pool:
-            pfunc = partial(
-                self.score_smi,
-                prefix=self.prefix,
-                ref_max=self.ref_max,
-                ref_min=self.ref_min,
-                fp=self.fp,
-                qed=self.qed,
-                physchem=self.physchem,
-            )
-            results = [r for r in pool.imap(pfunc, smiles)]
-        return results
+        valid, features = self.featurize(smiles)
+        # Range check of all molecules and features at once
+        in_range = (features >= self.ref_min) & (features <= self.ref_max)
+        results = ColumnarResults(smiles)
+        for block in ["fp", "qed", "physchem"]:
+            if block in self.blocks:
+                values = in_range[:, self.blocks[block]].mean(axis=1)
+            else:
+                values = np.full(len(smiles), np.nan)
+            results[f"{self.prefix}_{block}_in_AD"] = np.where(valid, values, 0.0)
+        if self.method == "kNN":
+            knn_dist = np.zeros(len(smiles))
+            if valid.any():
+                knn_dist[valid] = self.knn_distances(
+                    self._scale(features[valid]), k=self.k
+                ).mean(axis=1)
+            results[f"{self.prefix}_kNN_dist"] = knn_dist
+            in_domain = valid & (knn_dist <= self.knn_threshold)
+        else:
+            results[f"{self.prefix}_kNN_dist"] = np.full(len(smiles), np.nan)
+            in_domain = valid & in_range.all(axis=1)
+        results[f"{self.prefix}_in_AD"] = in_domain.astype(float)
+        return format_results(results, smiles, columnar=columnar)
 
-    def __call__(self, smiles: list, **kwargs):
+    def __call__(self, smiles: list, columnar: bool = False, **kwargs):
         """
         Calculate the binary scores representing whether smiles are within the AD (1.0) or not (0.0)
         :param smiles: List of SMILES strings
+        :param columnar: Return ColumnarResults instead of a list of dicts
         :return: List of dicts i.e. [{'smiles': smi, 'metric': 'value', ...}, ...]
         """
-        return self.score(smiles=smiles)
+        return self.score(smiles=smiles, columnar=columnar)
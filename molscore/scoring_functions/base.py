@@ -1,17 +1,32 @@
 # This file contains templates for
 
 import atexit
+import gzip
+import json
 import logging
 import os
-import signal
 import socket
 import subprocess
+import threading
 import time
-from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Union
 
+import numpy as np
+import pandas as pd
 import requests
+import urllib3
 
-from molscore.scoring_functions.utils import check_exe, timedSubprocess
+from molscore.scoring_functions.servers.protocol import (
+    COLUMNAR_MIMETYPE,
+    decode_columnar,
+    kwargs_to_args,
+)
+from molscore.scoring_functions.utils import (
+    ServerRegistry,
+    check_exe,
+    timedSubprocess,
+)
 
 logger = logging.getLogger("base")
 formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
@@ -21,6 +36,147 @@ ch.setLevel(logging.INFO)
 logger.addHandler(ch)
 
 
+class ColumnarResults:
+    """
+    Columnar scoring function results, the order of SMILES is implied by the input and each metric is an array.
+    Avoids building a dictionary per SMILES and allows results to be assembled positionally without merging.
+    """
+
+    def __init__(self, smiles: list, columns: Dict[str, np.ndarray] = None):
+        """
+        :param smiles: List of SMILES strings in input order
+        :param columns: Dictionary of metric name (with prefix) to array of values in the same order
+        """
+        self.smiles = list(smiles)
+        self.columns = {}
+        for k, v in (columns or {}).items():
+            self[k] = v
+
+    def __len__(self):
+        return len(self.smiles)
+
+    def __contains__(self, key: str):
+        return key in self.columns
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        return self.columns[key]
+
+    def __setitem__(self, key: str, values):
+        values = np.asarray(values)
+        assert (
+            len(values) == len(self.smiles)
+        ), f"Length of {key} ({len(values)}) does not match number of SMILES ({len(self.smiles)})"
+        self.columns[key] = values
+
+    def keys(self):
+        return self.columns.keys()
+
+    def update(self, other: "ColumnarResults"):
+        """Add columns from other results for the same SMILES"""
+        assert len(other) == len(self), "Results must correspond to the same SMILES"
+        self.columns.update(other.columns)
+
+    def add_prefix(self, prefix: str) -> "ColumnarResults":
+        """Return results with prefix added to metric names"""
+        return ColumnarResults(
+            self.smiles, {f"{prefix}_{k}": v for k, v in self.columns.items()}
+        )
+
+    @classmethod
+    def from_records(
+        cls, records: List[Dict], smiles: list = None
+    ) -> "ColumnarResults":
+        """
+        Convert a list of dictionaries (the default return of scoring functions) to columnar results
+        :param records: List of dicts i.e. [{'smiles': smi, 'metric': 'value', ...}, ...]
+        :param smiles: Order of SMILES to align records to, if None the order of records is used
+        :return: ColumnarResults, missing values are NaN
+        """
+        if smiles is None:
+            smiles = [r["smiles"] for r in records]
+            rows = list(range(len(records)))
+        else:
+            # Align records by SMILES, using the first record of any duplicates
+            index = {}
+            for i, r in enumerate(records):
+                index.setdefault(r.get("smiles"), i)
+            rows = [index.get(smi) for smi in smiles]
+        keys = {}
+        for r in records:
+            keys.update(dict.fromkeys(r.keys()))
+        keys.pop("smiles", None)
+        columns = {}
+        for k in keys:
+            values = [
+                records[i].get(k, np.nan) if i is not None else np.nan for i in rows
+            ]
+            try:
+                columns[k] = np.asarray(values)
+            except ValueError:
+                # E.g., ragged sequences
+                columns[k] = None
+            if (columns[k] is None) or (
+                (columns[k].dtype.kind in "US")
+                and not all(isinstance(v, str) for v in values)
+            ):
+                # E.g., strings and missing values, which NumPy would otherwise cast to strings
+                columns[k] = np.empty(len(values), dtype=object)
+                columns[k][:] = values
+        return cls(smiles, columns)
+
+    def to_records(self) -> List[Dict]:
+        """Convert to a list of dictionaries i.e. [{'smiles': smi, 'metric': 'value', ...}, ...]"""
+        keys = list(self.columns.keys())
+        values = [self.columns[k].tolist() for k in keys]
+        return [
+            dict(smiles=smi, **{k: v[i] for k, v in zip(keys, values)})
+            for i, smi in enumerate(self.smiles)
+        ]
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({"smiles": self.smiles, **self.columns})
+
+    @classmethod
+    def concatenate(cls, results: List["ColumnarResults"]) -> "ColumnarResults":
+        """
+        Concatenate results of consecutive chunks of SMILES
+        :param results: List of ColumnarResults
+        :return: ColumnarResults, metrics missing from a chunk are NaN
+        """
+        if len(results) == 1:
+            return results[0]
+        keys = {}
+        for r in results:
+            keys.update(dict.fromkeys(r.keys()))
+        columns = {}
+        for k in keys:
+            parts = [r[k] if k in r else np.full(len(r), np.nan) for r in results]
+            if all(p.dtype.kind in "biuf" for p in parts) or (
+                len(set(p.dtype.kind for p in parts)) == 1
+            ):
+                columns[k] = np.concatenate(parts)
+            else:
+                # E.g., strings and missing values, which NumPy would otherwise cast to strings
+                columns[k] = np.concatenate([p.astype(object) for p in parts])
+        return cls([smi for r in results for smi in r.smiles], columns)
+
+
+def format_results(
+    results: Union[List[Dict], ColumnarResults], smiles: list, columnar: bool = False
+) -> Union[List[Dict], ColumnarResults]:
+    """
+    Adapter to return scoring function results in the requested format
+    :param results: List of dicts or ColumnarResults
+    :param smiles: Input SMILES in order
+    :param columnar: Whether to return ColumnarResults, otherwise a list of dicts
+    """
+    if columnar and not isinstance(results, ColumnarResults):
+        return ColumnarResults.from_records(results, smiles=smiles)
+    if not columnar and isinstance(results, ColumnarResults):
+        return results.to_records()
+    return results
+
+
 class BaseSF:
     """Description"""  # Description should be at the class level, this is passed to the config GUI
 
@@ -38,18 +194,70 @@ class BaseSF:
         )  # Prefix to seperate multiple uses of the same class
         raise NotImplementedError("This is an abstract method")
 
-    def __call__(self, smiles: list, file_names, directory, **kwargs) -> List[Dict]:
+    def __call__(
+        self, smiles: list, file_names, directory, columnar: bool = False, **kwargs
+    ) -> Union[List[Dict], ColumnarResults]:
         raise NotImplementedError("This is an abstract method")
         # Results should be a list of dictionaries. Each dictionary corresponds to an input SMILES and should 'smiles' key. Every other key should be '<prefix>_<return_metric>'
         # For example,
         # [{'smiles': 'c1ccccc1', 'prefix_docking_score': -7.8},
         #  {'smiles': 'c1ccccc1C(=O)O', 'prefix_docking_score': -9.0]
+        # Optionally, if columnar=True, results can instead be returned as ColumnarResults in input order, for example,
+        # ColumnarResults(smiles, {'prefix_docking_score': np.array([-7.8, -9.0])})
+        # format_results(results, smiles, columnar) can be used to convert to the requested format
+
+
+class UnixHTTPConnection(urllib3.connection.HTTPConnection):
+    """HTTP connection over a Unix domain socket"""
+
+    def __init__(self, *args, socket_path: str = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.socket_path = socket_path
+
+    def _new_conn(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if isinstance(self.timeout, (int, float)):
+            sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise urllib3.exceptions.NewConnectionError(
+                self, f"Failed to connect to {self.socket_path}: {e}"
+            ) from e
+        return sock
+
+
+class UnixHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = UnixHTTPConnection
+
+
+class UnixAdapter(requests.adapters.HTTPAdapter):
+    """Send all requests of a session to a server listening on a Unix domain socket"""
+
+    def __init__(self, socket_path: str, pool_maxsize: int = 10, **kwargs):
+        self.socket_path = socket_path
+        self._pool = UnixHTTPConnectionPool(
+            "localhost", maxsize=pool_maxsize, socket_path=socket_path
+        )
+        super().__init__(pool_maxsize=pool_maxsize, **kwargs)
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self._pool
+
+    def get_connection(self, url, proxies=None):
+        return self._pool
+
+    def close(self):
+        super().close()
+        self._pool.close()
 
 
 class BaseServerSF:
     """Description"""
 
     return_metrics = []  # Name of metrics returned so that they can be selected in the config GUI
+    multi_model = False  # Server can host models with different server_kwargs in one process (see servers/model_server.py)
 
     def __init__(
         self,
@@ -60,11 +268,25 @@ class BaseServerSF:
         env_path: str = None,
         server_grace: int = 60,
         server_kwargs: dict = {},
+        chunk_size: int = None,
+        max_in_flight: int = 4,
+        compress: bool = False,
+        busy_retries: int = 5,
+        share_server: bool = True,
+        keep_alive: bool = False,
+        transport: str = "tcp",
         **kwargs,
     ):
         """
         :param prefix: Prefix to identify scoring function instance
         :param env_engine: Environment engine [conda, mamba]
+        :param chunk_size: Number of SMILES sent per request, by default all SMILES are sent in one request
+        :param max_in_flight: Maximum number of chunks sent to the server concurrently
+        :param compress: Gzip requests and responses (useful for large batches to a remote server)
+        :param busy_retries: Number of times to retry a request rejected by a busy server (503)
+        :param share_server: Attach to a running server launched with the same command, e.g., by other tasks or processes
+        :param keep_alive: Keep a shared server running after the last user exits so that later sessions can attach to it (or set MOLSCORE_KEEP_SERVERS)
+        :param transport: Connect to the server over TCP on localhost, or a Unix domain socket which has less overhead per request and needs no free port [tcp, unix]
         """
         self.prefix = prefix.replace(" ", "_")
         self.server_subprocess = None
@@ -73,6 +295,22 @@ class BaseServerSF:
         self.env_path = env_path  # Resource path to environment
         self.server_grace = server_grace  # Time to wait for server to launch
         self.server_path = server_path  # Resource path to server executable
+        self.chunk_size = chunk_size
+        self.max_in_flight = max(1, max_in_flight)
+        self.compress = compress
+        self.busy_retries = busy_retries
+        self.share_server = share_server
+        self.keep_alive = keep_alive or ("MOLSCORE_KEEP_SERVERS" in os.environ.keys())
+        self.server_key = None
+        self.model_url = None
+        assert transport in ["tcp", "unix"], f"Unknown transport {transport}"
+        self.transport = transport
+        self.unix_socket = None
+        self._session = None
+        self._pool = None
+        self.timings = {}  # Where time was spent in the last call, see send_smiles_to_server
+        self._timings_lock = threading.Lock()
+        self.server_metrics = {}  # Last metrics pulled from the server, see log_metrics
 
         # Check engine
         if (env_engine == "mamba") and check_exe("mamba"):
@@ -106,6 +344,33 @@ class BaseServerSF:
         self._launch_server()
         atexit.register(self._kill_server)
 
+    @property
+    def session(self) -> requests.Session:
+        """Persistent HTTP session so that connections to the server are kept alive"""
+        if self._session is None:
+            self._session = requests.Session()
+            if self.unix_socket:
+                adapter = UnixAdapter(self.unix_socket, pool_maxsize=self.max_in_flight)
+            else:
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1, pool_maxsize=self.max_in_flight
+                )
+            self._session.mount("http://", adapter)
+            self._session.mount("https://", adapter)
+        return self._session
+
+    def __getstate__(self):
+        # Sessions, pools and locks can't be pickled, they are recreated
+        state = self.__dict__.copy()
+        state["_session"] = None
+        state["_pool"] = None
+        state["_timings_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._timings_lock = threading.Lock()
+
     def _check_env(self):
         cmd = f"{self.engine} info --envs"
         out = subprocess.run(cmd, stdout=subprocess.PIPE, shell=True)
@@ -127,22 +392,35 @@ class BaseServerSF:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             return s.connect_ex(("localhost", port)) == 0
 
-    def _launch_server(self):
-        port = 8000
-        while self._check_port(port):
-            port += 1
+    def _server_command(self, address: str) -> str:
         kwargs = " ".join([f"--{k} {v}" for k, v in self.server_kwargs.items()])
-        self.server_cmd = f"{self.engine} run -n {self.env_name} python {self.server_path} --port {port} {kwargs}"
-        self.server_url = f"http://localhost:{port}"
+        return f"{self.engine} run -n {self.env_name} python {self.server_path} {address} {kwargs}"
+
+    def _start_server(self, log_path: str = os.devnull, socket_path: str = None):
+        if self.transport == "unix":
+            self.unix_socket = socket_path or ServerRegistry().socket_path(
+                f"{os.getpid()}_{id(self)}"
+            )
+            address = f"--unix_socket {self.unix_socket}"
+            self.server_url = "http://localhost"
+        else:
+            port = 8000
+            while self._check_port(port):
+                port += 1
+            address = f"--port {port}"
+            self.server_url = f"http://localhost:{port}"
+        self.server_cmd = self._server_command(address)
         logger.info(f"Launching server: {self.server_cmd}")
         try:
-            self.server_subprocess = subprocess.Popen(
-                self.server_cmd,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                preexec_fn=os.setsid,
-            )
+            # Log to a file rather than a pipe, so the server never blocks on output and can outlive this process
+            with open(log_path, "ab") as log:
+                self.server_subprocess = subprocess.Popen(
+                    self.server_cmd,
+                    shell=True,
+                    stdout=log,
+                    stderr=subprocess.STDOUT,
+                    preexec_fn=os.setsid,
+                )
             self._wait_for_server()
         except subprocess.CalledProcessError as e:
             logger.error(
@@ -150,11 +428,86 @@ class BaseServerSF:
             )
             raise e
 
+    def _launch_server(self):
+        if not self.share_server:
+            self._start_server()
+            return
+
+        # Attach to a running server launched with the same command on this host, otherwise launch and register one
+        registry = ServerRegistry()
+        server_params = {
+            "host": registry.hostname,
+            "engine": self.engine,
+            "env_name": self.env_name,
+            "server_path": self.server_path,
+            "transport": self.transport,
+        }
+        if not self.multi_model:
+            server_params["server_kwargs"] = self.server_kwargs
+        self.server_key = registry.key(**server_params)
+        # Only launches of this server wait for each other, the registry itself is locked briefly
+        with registry.lock(self.server_key):
+            with registry.edit() as servers:
+                server = servers.get(self.server_key)
+            if server is not None:
+                self.unix_socket = server.get("unix_socket")
+                if not self._check_server(server["url"]):
+                    logger.warning(
+                        f"Server at {server['unix_socket'] or server['url']} is not responding, relaunching"
+                    )
+                    registry.terminate(server["pgid"])
+                    server = None
+            if server is None:
+                self._start_server(
+                    log_path=registry.log_path(self.server_key),
+                    socket_path=registry.socket_path(self.server_key),
+                )
+            with registry.edit() as servers:
+                if server is None:
+                    servers[self.server_key] = {
+                        "host": registry.hostname,
+                        "url": self.server_url,
+                        "unix_socket": self.unix_socket,
+                        "pgid": self.server_subprocess.pid,
+                        "cmd": self.server_cmd,
+                        "users": [os.getpid()],
+                        "keep_alive": self.keep_alive,
+                    }
+                else:
+                    server = servers[self.server_key]
+                    self.server_cmd = server["cmd"]
+                    self.server_url = server["url"]
+                    server["users"].append(os.getpid())
+                    server["keep_alive"] = server["keep_alive"] or self.keep_alive
+                    logger.info(
+                        f"Attaching to running server at {self.server_url} ({len(server['users'])} users)"
+                    )
+        if self.multi_model:
+            self._load_model()
+
+    def _load_model(self):
+        """Load the model for these server_kwargs into a server hosting multiple models (by each worker on demand)"""
+        model_name = ServerRegistry.key(server_kwargs=self.server_kwargs)
+        response = self.session.post(
+            f"{self.server_url}/load",
+            json={"name": model_name, "args": kwargs_to_args(self.server_kwargs)},
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"Failed to load model on server: {response.text}")
+        self.model_url = f"{self.server_url}/model/{model_name}"
+
+    def _check_server(self, server_url: str = None) -> bool:
+        try:
+            url = server_url or self.server_url
+            return self.session.options(url, timeout=5).status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
     def _wait_for_server(self):
         start_time = time.time()
         while True:
             try:
-                response = requests.options(self.server_url)
+                response = self.session.options(self.server_url)
                 if response.status_code == 200:
                     return
             except requests.exceptions.ConnectionError:
@@ -166,16 +519,64 @@ class BaseServerSF:
             time.sleep(1)
 
     def _kill_server(self):
-        if self.server_subprocess is not None:
-            os.killpg(os.getpgid(self.server_subprocess.pid), signal.SIGTERM)
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+        if self.server_key is not None:
+            # Detach from the shared server, and shut it down if this was the last user (unless it's being attached to)
+            registry = ServerRegistry()
+            with registry.lock(self.server_key), registry.edit() as servers:
+                server = servers.get(self.server_key)
+                if server is not None:
+                    if os.getpid() in server["users"]:
+                        server["users"].remove(os.getpid())
+                    if not server["users"] and not server["keep_alive"]:
+                        registry.terminate(server["pgid"], server.get("unix_socket"))
+                        del servers[self.server_key]
+                        logger.info("Server killed")
+            self.server_key = None
+            self.server_subprocess = None
+        elif self.server_subprocess is not None:
+            ServerRegistry.terminate(
+                os.getpgid(self.server_subprocess.pid), self.unix_socket
+            )
             self.server_subprocess = None
             logger.info("Server killed")
 
-    def send_smiles_to_server(self, smiles):
-        payload = {"smiles": smiles}
-        #logger.debug(f"Sending payload to server: {payload}")
+    def _post_chunk(self, smiles: list) -> ColumnarResults:
+        """Send one chunk of SMILES to the server and return unprefixed results"""
+        start = time.perf_counter()
+        data = json.dumps({"smiles": smiles, "format": "columnar"}).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.compress:
+            data = gzip.compress(data, compresslevel=1)
+            headers["Content-Encoding"] = "gzip"
+        # logger.debug(f"Sending payload to server: {smiles}")
         try:
-            response = requests.post(self.server_url + "/", json=payload)
+            # Retry with backoff while the server applies backpressure (503)
+            attempt = 0
+            reloaded = False
+            while True:
+                response = self.session.post(
+                    self.model_url or (self.server_url + "/"),
+                    data=data,
+                    headers=headers,
+                )
+                if (response.status_code == 404) and self.model_url and not reloaded:
+                    # Another worker of the server hasn't loaded this model yet, load it and resend once
+                    #  without using up a busy retry
+                    self._load_model()
+                    reloaded = True
+                    continue
+                if (response.status_code != 503) or (attempt >= self.busy_retries):
+                    break
+                delay = float(response.headers.get("Retry-After", 2**attempt))
+                logger.debug(f"Server busy, retrying in {delay}s")
+                time.sleep(delay)
+                attempt += 1
         except requests.exceptions.ConnectionError as e:
             logger.error(
                 f"{e}: "
@@ -186,23 +587,99 @@ class BaseServerSF:
                 f"\n\tAre you sure it loaded within {self.server_grace} seconds?\n\n"
             )
             raise e
-        if response.status_code == 200:
-            results = response.json()
-            # Add prefix to metrics
-            results = [
-                {f"{self.prefix}_{k}" if k != "smiles" else k: v for k, v in r.items()}
-                for r in results
+        self._record_timings(time.perf_counter() - start, response)
+        if response.status_code != 200:
+            logger.error(f"Error {response.status_code}: {response.text}")
+            return ColumnarResults(
+                smiles, {m: np.zeros(len(smiles)) for m in self.return_metrics}
+            )
+        if response.headers.get("Content-Type", "").startswith(COLUMNAR_MIMETYPE):
+            _, columns = decode_columnar(response.content)
+            return ColumnarResults(smiles, columns)
+        # Server doesn't support columnar responses, so one dictionary per SMILES
+        records = response.json()
+        # logger.debug(f"Result from server: {records}")
+        if len(records) == len(smiles):
+            return ColumnarResults(
+                smiles, ColumnarResults.from_records(records).columns
+            )
+        return ColumnarResults.from_records(records, smiles=smiles)
+
+    def _record_timings(self, round_trip: float, response: requests.Response):
+        """Separate client-side HTTP overhead of a request from the server's queue wait and model time"""
+        queue_time = float(response.headers.get("X-Queue-Time", 0.0))
+        model_time = float(response.headers.get("X-Model-Time", 0.0))
+        with self._timings_lock:
+            self.timings["requests"] = self.timings.get("requests", 0) + 1
+            self.timings["http"] = self.timings.get("http", 0.0) + max(
+                0.0, round_trip - queue_time - model_time
+            )
+            self.timings["server_queue"] = (
+                self.timings.get("server_queue", 0.0) + queue_time
+            )
+            self.timings["server_model"] = (
+                self.timings.get("server_model", 0.0) + model_time
+            )
+
+    def metrics(self) -> dict:
+        """Metrics of the server (see servers/model_server.py), empty if the server doesn't provide them"""
+        try:
+            response = self.session.get(self.server_url + "/metrics", timeout=5)
+        except requests.exceptions.RequestException:
+            return {}
+        if response.status_code != 200:
+            return {}
+        return response.json()
+
+    def log_metrics(self, log: logging.Logger = logger):
+        """
+        Log where time was spent in the last call and a summary of the server's metrics (pulled from the server)
+        :param log: Logger to log to at debug level e.g., MolScore's step logging
+        """
+        timings = ", ".join(
+            f"{k} {v:.02f}s" for k, v in self.timings.items() if k != "requests"
+        )
+        log.debug(
+            f"    {self.prefix}: {self.timings.get('requests', 0)} requests, {timings}"
+        )
+        self.server_metrics = self.metrics()
+        for name, model in self.server_metrics.get("models", {}).items():
+            summary = [f"{model['smiles']} SMILES in {model['batches']} batches"]
+            if model["model_latency"]:
+                summary.append(f"model p50 {model['model_latency']['p50']:.03f}s")
+            if model["queue_wait"]:
+                summary.append(f"queue p50 {model['queue_wait']['p50']:.03f}s")
+            if "cache" in model:
+                summary.append(f"cache hit rate {model['cache']['hit_rate']:.02f}")
+            log.debug(f"    {self.prefix} server {name}: {', '.join(summary)}")
+        if "memory" in self.server_metrics:
+            memory = self.server_metrics["memory"]
+            log.debug(
+                f"    {self.prefix} server memory: {memory.get('rss_mb', memory['peak_rss_mb']):.0f} MB"
+            )
+
+    def send_smiles_to_server(self, smiles, columnar: bool = False):
+        smiles = list(smiles)
+        start = time.perf_counter()
+        self.timings = {}
+        if self.chunk_size and (len(smiles) > self.chunk_size):
+            chunks = [
+                smiles[i : i + self.chunk_size]
+                for i in range(0, len(smiles), self.chunk_size)
             ]
-            #logger.debug(f"Result from server: {results}")
+            # Pipeline chunks with up to max_in_flight concurrent requests
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_in_flight)
+            results = ColumnarResults.concatenate(
+                list(self._pool.map(self._post_chunk, chunks))
+            )
         else:
-            results = [{"smiles": smi} for smi in smiles]
-            _ = [
-                r.update({f"{self.prefix}_{m}": 0.0 for m in self.return_metrics})
-                for r in results
-            ]
-            logger.error(f"Error {response.status_code}: {response.text}")
-        return results
+            results = self._post_chunk(smiles)
+        self.timings["total"] = time.perf_counter() - start
+        # Add prefix to metrics
+        results = results.add_prefix(self.prefix)
+        return format_results(results, smiles, columnar=columnar)
 
-    def __call__(self, smiles: list, **kwargs):
-        results = self.send_smiles_to_server(smiles)
+    def __call__(self, smiles: list, columnar: bool = False, **kwargs):
+        results = self.send_smiles_to_server(smiles, columnar=columnar)
         return results
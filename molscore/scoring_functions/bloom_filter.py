@@ -1,11 +1,20 @@
+import json
 import logging
 import os
+import shutil
+from functools import partial
 from typing import Union
 
 import molbloom
 import numpy as np
+from rdkit.Chem import AllChem as Chem
 
-from molscore.scoring_functions.utils import Pool, canonize_smiles, read_smiles
+from molscore.scoring_functions.utils import (
+    Executor,
+    canonize_smiles,
+    get_mol,
+    iter_smiles,
+)
 
 logger = logging.getLogger("bloom_filter")
 formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
@@ -15,6 +24,110 @@ ch.setLevel(logging.INFO)
 logger.addHandler(ch)
 
 
+def molbloom_canon(smiles_or_mol):
+    """Canonicalize the same way as MolBloom presets (kekulized SMILES)"""
+    mol = get_mol(smiles_or_mol)
+    if mol is None:
+        return None
+    return Chem.MolToSmiles(mol, canonical=True, isomericSmiles=True, kekuleSmiles=True)
+
+
+def query_smiles(smiles_or_mol, canon_func=None):
+    """
+    Convert a query to the SMILES to look up in the filter
+    :param smiles_or_mol: SMILES or RDKit Mol
+    :param canon_func: Canonicalization function, if None strings are used as is
+    :return: SMILES or None if invalid
+    """
+    if canon_func is not None:
+        return canon_func(smiles_or_mol)
+    if isinstance(smiles_or_mol, Chem.rdchem.Mol):
+        return Chem.MolToSmiles(smiles_or_mol)
+    return smiles_or_mol
+
+
+def build_bloom_filter(
+    smiles_path: Union[str, os.PathLike],
+    bloom_path: Union[str, os.PathLike],
+    fpr: float = 0.01,
+    canonize: bool = True,
+    name: str = "custom",
+    executor: Executor = None,
+    chunk_size: int = 1000000,
+    resume: bool = True,
+):
+    """
+    Build a MolBloom filter from a (gzipped) SMILES file by streaming it in chunks, so memory is bounded by chunk_size
+     rather than the size of the file. Canonical SMILES are checkpointed per chunk in {bloom_path}.parts so that an
+     interrupted build can be resumed, the filter is then sized from the final count and filled chunk by chunk.
+    :param smiles_path: Path to SMILES file
+    :param bloom_path: Output path of the filter (.bloom)
+    :param fpr: False positive rate
+    :param canonize: Canonicalize SMILES before adding, invalid SMILES are skipped
+    :param name: Name of the filter
+    :param executor: Executor used to canonicalize each chunk
+    :param chunk_size: Number of SMILES read, canonicalized and checkpointed at once
+    :param resume: Re-use checkpointed chunks from a previous (interrupted) build of the same file
+    :return: molbloom.CustomFilter
+    """
+    executor = executor or Executor()
+    parts_dir = str(bloom_path) + ".parts"
+    progress_path = os.path.join(parts_dir, "progress.json")
+    stat = os.stat(smiles_path)
+    source = {
+        "smiles_path": os.path.abspath(smiles_path),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "canonize": canonize,
+        "chunk_size": chunk_size,
+    }
+    progress = {"source": source, "counts": []}
+    if resume and os.path.exists(progress_path):
+        with open(progress_path, "rt") as f:
+            previous = json.load(f)
+        if previous["source"] == source:
+            progress = previous
+            logger.info(
+                f"Resuming bloom filter build from chunk {len(progress['counts'])}"
+            )
+    if progress["counts"] == [] and os.path.exists(parts_dir):
+        shutil.rmtree(parts_dir)
+    os.makedirs(parts_dir, exist_ok=True)
+
+    # Canonicalize and checkpoint chunk by chunk
+    n_done = sum(progress["counts"])
+    for i, chunk in enumerate(iter_smiles(smiles_path, chunk_size=chunk_size)):
+        if i < len(progress["counts"]):
+            continue
+        if canonize:
+            chunk = [smi for smi in executor.map(canonize_smiles, chunk) if smi]
+        part_path = os.path.join(parts_dir, f"{i:06d}.smi")
+        with open(part_path + ".tmp", "wt") as f:
+            f.write("\n".join(chunk) + "\n")
+        os.replace(part_path + ".tmp", part_path)
+        progress["counts"].append(len(chunk))
+        with open(progress_path + ".tmp", "wt") as f:
+            json.dump(progress, f)
+        os.replace(progress_path + ".tmp", progress_path)
+        n_done += len(chunk)
+        logger.info(f"Bloom filter: processed {n_done:,} SMILES ({i + 1} chunks)")
+
+    # Set up bloom filter parameters based on False Positive Rate and fill it
+    n = max(1, sum(progress["counts"]))
+    M_bits = -(n * np.log(fpr)) / (np.log(2) ** 2)
+    bloom = molbloom.CustomFilter(M_bits, n, name)
+    for i in range(len(progress["counts"])):
+        for chunk in iter_smiles(
+            os.path.join(parts_dir, f"{i:06d}.smi"), chunk_size=chunk_size
+        ):
+            for smi in chunk:
+                bloom.add(smi)
+    logger.info(f"Saving filter to {bloom_path}")
+    bloom.save(str(bloom_path))
+    shutil.rmtree(parts_dir)
+    return bloom
+
+
 class BloomFilter:
     """Using MolBloom to estimate presence in a database"""
 
@@ -32,6 +145,9 @@ class BloomFilter:
         canonize=True,
         fpr: float = 0.01,
         n_jobs: int = 1,
+        executor: dict = None,
+        chunk_size: int = 1000000,
+        resume: bool = True,
         **kwargs,
     ):
         """
@@ -39,8 +155,12 @@ class BloomFilter:
         :param preset: Download a preset from MolBloom [zinc20, zinc-instock, zinc-instock-mini, surechembl]
         :param bloom_path: Path to saved the MolBloom database file (with .bloom extension)
         :param smiles_path: Path to a SMILES file to create a new bloom filter
-        :param canonize: Canonicalize SMILES if creating molbloom database
+        :param canonize: Canonicalize SMILES if creating molbloom database, and canonicalize queries
         :param fpr: False positive rate for MolBloom if creating molbloom database
+        :param n_jobs: Number of jobs for multiprocessing
+        :param executor: Executor parameters e.g., {"backend": "dask", "address": "tcp://..."}, default is based on n_jobs
+        :param chunk_size: Number of SMILES processed at once if creating molbloom database
+        :param resume: Resume an interrupted build of the molbloom database
         """
         self.prefix = prefix.strip().replace(" ", "_")
         self.preset = preset
@@ -49,7 +169,10 @@ class BloomFilter:
         self.canonize = canonize
         self.fpr = fpr
         self.n_jobs = n_jobs
+        self.executor = Executor.from_config(executor, n_jobs=n_jobs)
         self.filter = None
+        # Queries are canonicalized the same way as the filter was built
+        self.canon_func = canonize_smiles if self.canonize else None
 
         parameters_provided = sum(
             [p is not None for p in [self.preset, self.smiles_path, self.bloom_path]]
@@ -66,27 +189,24 @@ class BloomFilter:
             ), f"Preset {self.preset} not found in MolBloom catalog"
             molbloom._load_filter(self.preset)
             self.filter = molbloom._filters[self.preset]
+            if self.canonize:
+                self.canon_func = molbloom_canon
 
         elif self.bloom_path:
             assert os.path.exists(self.bloom_path), "Bloom path does not exist"
             self.filter = molbloom.BloomFilter(os.path.abspath(self.bloom_path))
 
         elif self.smiles_path:
-            # Load
-            smiles_list = read_smiles(os.path.abspath(self.smiles_path))
-            # Canonize
-            if self.canonize:
-                with Pool(self.n_jobs) as pool:
-                    smiles_list = [s for s in pool.map(canonize_smiles, smiles_list)]
-            # Set up bloom filter parameters based on False Positive Rate
-            M_bits = -(len(smiles_list) * np.log(self.fpr)) / (np.log(2) ** 2)
-            self.filter = molbloom.CustomFilter(M_bits, len(smiles_list), self.prefix)
-            # Add to filter or create filter
-            for smi in smiles_list:
-                self.filter.add(smi)
-            # Save filter
-            logger.info(f"Saving filter to {self.smiles_path.rsplit('.', 1)[0]}.bloom")
-            self.filter.save(self.smiles_path.rsplit(".", 1)[0] + ".bloom")
+            self.filter = build_bloom_filter(
+                smiles_path=self.smiles_path,
+                bloom_path=self.smiles_path.rsplit(".", 1)[0] + ".bloom",
+                fpr=self.fpr,
+                canonize=self.canonize,
+                name=self.prefix,
+                executor=self.executor,
+                chunk_size=chunk_size,
+                resume=resume,
+            )
 
         else:
             raise ValueError(
@@ -94,14 +214,25 @@ class BloomFilter:
             )
 
     def __call__(self, smiles: list, **kwargs):
-        results = []
-        for smi in smiles:
-            inside = int(smi in self.filter)
-            results.append(
-                {
-                    "smiles": smi,
-                    f"{self.prefix}_inside": inside,
-                    f"{self.prefix}_outside": 1 - inside,
-                }
-            )
-        return results
+        """
+        :param smiles: List of SMILES or RDKit Mols
+        """
+        # Canonicalize the whole batch at once, then check membership
+        queries = self.executor.map(
+            partial(query_smiles, canon_func=self.canon_func), smiles
+        )
+        inside = np.fromiter(
+            (q is not None and q in self.filter for q in queries),
+            dtype=int,
+            count=len(queries),
+        )
+        return [
+            {
+                "smiles": smi
+                if not isinstance(smi, Chem.rdchem.Mol)
+                else Chem.MolToSmiles(smi),
+                f"{self.prefix}_inside": int(i),
+                f"{self.prefix}_outside": 1 - int(i),
+            }
+            for smi, i in zip(smiles, inside)
+        ]
@@ -2,8 +2,11 @@ import logging
 import os
 from typing import Dict, List, Union
 
-from molscore.scoring_functions.utils import read_smiles
+import numpy as np
+
+from molscore.scoring_functions.utils import ReferenceCache, read_smiles
 from moleval.metrics.chemistry_filters import ChemistryFilter as CF
+from moleval.metrics.metrics_utils import SillyWalks
 
 logger = logging.getLogger("chemistry_filter")
 formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
@@ -37,9 +40,36 @@ class ChemistryFilter:
                 len(ref_smiles) > 0
             ), "None list or empty list provided"
             self.ref_smiles = ref_smiles
-        # Preprocess filters
+        self.n_jobs = n_jobs
+        # Preprocess filters, loading target statistics from cache if a file path is provided
+        if isinstance(ref_smiles, str):
+            cache = ReferenceCache(ref_smiles, name="chemistry_filter")
+            ref = cache.get(
+                ["silly_bits", "silly_counts", "MolWt", "MolLogP"],
+                self._compute_target_statistics,
+            )
+            self.filter = CF(target=None, n_jobs=n_jobs)
+            self.filter.set_target(
+                ref_sillyness=SillyWalks.from_counts(
+                    ref["silly_bits"], ref["silly_counts"], n_jobs=n_jobs
+                ),
+                ref_MW=tuple(ref["MolWt"].tolist()),
+                ref_LogP=tuple(ref["MolLogP"].tolist()),
+            )
+        else:
+            logger.info("Pre-processing Chemistry Filters, this may take a few minutes")
+            self.filter = CF(target=self.ref_smiles, n_jobs=n_jobs)
+
+    def _compute_target_statistics(self):
         logger.info("Pre-processing Chemistry Filters, this may take a few minutes")
-        self.filter = CF(target=self.ref_smiles, n_jobs=n_jobs)
+        cf = CF(target=self.ref_smiles, n_jobs=self.n_jobs)
+        silly_bits, silly_counts = cf.ref_sillyness.bit_counts()
+        return {
+            "silly_bits": silly_bits,
+            "silly_counts": silly_counts,
+            "MolWt": np.asarray(cf.ref_MW),
+            "MolLogP": np.asarray(cf.ref_LogP),
+        }
 
     def __call__(self, smiles: list, **kwargs) -> List[Dict]:
         """
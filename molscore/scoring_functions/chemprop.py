@@ -11,6 +11,7 @@ class ChemPropModel(BaseServerSF):
     """
 
     # How to handle return metrics
+    multi_model = True
     return_metrics = [
         "mean_pred",
         "max_pred",
@@ -45,4 +46,5 @@ class ChemPropModel(BaseServerSF):
             ),
             server_grace=30,
             server_kwargs={"model_dir": os.path.abspath(model_dir)},
+            **kwargs,
         )
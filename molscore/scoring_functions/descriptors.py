@@ -5,8 +5,9 @@ from typing import Union
 from rdkit.Chem import QED, Crippen, Descriptors, GetDistanceMatrix, GraphDescriptors
 from rdkit.Chem import AllChem as Chem
 
+from molscore.scoring_functions.base import ColumnarResults
 from molscore.scoring_functions.SA_Score import sascorer
-from molscore.scoring_functions.utils import Pool, get_mol
+from molscore.scoring_functions.utils import Executor, get_mol
 
 
 class MolecularDescriptors:
@@ -37,22 +38,48 @@ class MolecularDescriptors:
         "FlourineCount",
     ]
 
-    def __init__(self, prefix: str = "desc", n_jobs: int = 1, **kwargs):
+    def __init__(
+        self,
+        prefix: str = "desc",
+        n_jobs: int = 1,
+        executor: dict = None,
+        subset: list = None,
+        **kwargs,
+    ):
         """
         :param prefix: Prefix to identify scoring function instance (e.g., desc)
         :param n_jobs: Number of cores for multiprocessing
+        :param executor: Executor parameters e.g., {"backend": "dask", "address": "tcp://..."}, default is based on n_jobs
+        :param subset: Only calculate these descriptors, default is all return metrics (set automatically by MolScore to those used by the task)
         :param kwargs:
         """
         self.prefix = prefix.strip().replace(" ", "_")
         self.results = None
         self.n_jobs = n_jobs
+        self.executor = Executor.from_config(executor, n_jobs=n_jobs)
+        self.subset = (
+            [m for m in subset if m in self.return_metrics] if subset else None
+        )
 
     @staticmethod
     def calculate_descriptors(smi, prefix, subset=None):
+        # Intermediate values shared between descriptors of the same molecule
+        shared = {}
+
+        def _shared(name, func):
+            def wrapper(mol):
+                if name not in shared:
+                    shared[name] = func(mol)
+                return shared[name]
+
+            return wrapper
+
+        sa_score = _shared("SAscore", sascorer.calculateScore)
+        log_p = _shared("CLogP", Crippen.MolLogP)
         descriptors = {
             "QED": QED.qed,
-            "SAscore": sascorer.calculateScore,
-            "CLogP": Crippen.MolLogP,
+            "SAscore": sa_score,
+            "CLogP": log_p,
             "MolWt": Descriptors.MolWt,
             "HeavyAtomCount": Descriptors.HeavyAtomCount,
             "HeavyAtomMolWt": Descriptors.HeavyAtomMolWt,
@@ -64,7 +91,9 @@ class MolecularDescriptors:
             "NumAliphaticRings": Descriptors.NumAliphaticRings,
             "RingCount": Descriptors.RingCount,
             "TPSA": Descriptors.TPSA,
-            "PenLogP": MolecularDescriptors.penalized_logp,
+            "PenLogP": lambda mol: MolecularDescriptors.penalized_logp(
+                mol, log_p=log_p(mol), sa_score=sa_score(mol)
+            ),
             "FormalCharge": Chem.GetFormalCharge,
             "MolecularFormula": Descriptors.rdMolDescriptors.CalcMolFormula,
             "Bertz": GraphDescriptors.BertzCT,
@@ -92,7 +121,9 @@ class MolecularDescriptors:
         return result
 
     @staticmethod
-    def penalized_logp(mol: Chem.rdchem.Mol):
+    def penalized_logp(
+        mol: Chem.rdchem.Mol, log_p: float = None, sa_score: float = None
+    ):
         """Calculates the penalized logP of a molecule.
         Refactored from
         https://github.com/wengong-jin/icml18-jtnn/blob/master/bo/run_bo.py
@@ -108,6 +139,8 @@ class MolecularDescriptors:
          cycle(m) is the largest ring size minus by six in the molecule.
 
          :param mol: rdkit mol
+         :param log_p: Precomputed logP, otherwise calculated
+         :param sa_score: Precomputed SA score, otherwise calculated
          :return Penalized LogP
         """
         # Get largest cycle length
@@ -117,8 +150,10 @@ class MolecularDescriptors:
         else:
             cycle_length = 0
 
-        log_p = Descriptors.MolLogP(mol)
-        sa_score = sascorer.calculateScore(mol)
+        if log_p is None:
+            log_p = Descriptors.MolLogP(mol)
+        if sa_score is None:
+            sa_score = sascorer.calculateScore(mol)
         cycle_score = max(cycle_length - 6, 0)
         return log_p - sa_score - cycle_score
 
@@ -257,21 +292,24 @@ class MolecularDescriptors:
         """
         return sum(1 for a in mol.GetAtoms() if a.GetSymbol() == "F")
 
-    def __call__(self, smiles: list, **kwargs):
+    def __call__(self, smiles: list, columnar: bool = False, **kwargs):
         """
         Calculate the scores for RDKitDescriptors
         :param smiles: List of SMILES strings
+        :param columnar: Return ColumnarResults instead of a list of dicts
         :param kwargs: Ignored
         :return: List of dicts i.e. [{'smiles': smi, 'metric': 'value', ...}, ...]
         """
-        with Pool(self.n_jobs) as pool:
-            pcalculate_descriptors = partial(
-                self.calculate_descriptors,
-                prefix=self.prefix,
-                subset=self.return_metrics,
-            )
-            results = [result for result in pool.imap(pcalculate_descriptors, smiles)]
+        pcalculate_descriptors = partial(
+            self.calculate_descriptors,
+            prefix=self.prefix,
+            subset=self.subset or self.return_metrics,
+        )
+        results = self.executor.map(pcalculate_descriptors, smiles)
 
+        if columnar:
+            # Results are in input order
+            return ColumnarResults.from_records(results)
         return results
 
 
@@ -299,14 +337,22 @@ class LinkerDescriptors(MolecularDescriptors):
         "MaxConsecutiveRotatableBonds",
     ]
 
-    def __init__(self, prefix: str = "linker_desc", n_jobs: int = 1, **kwargs):
+    def __init__(
+        self,
+        prefix: str = "linker_desc",
+        n_jobs: int = 1,
+        executor: dict = None,
+        **kwargs,
+    ):
         """
         :param prefix: Prefix to identify scoring function instance (e.g., desc)
         :param n_jobs: Number of cores for multiprocessing
+        :param executor: Executor parameters e.g., {"backend": "dask", "address": "tcp://..."}, default is based on n_jobs
         :param kwargs:
         """
         self.prefix = prefix.strip().replace(" ", "_")
         self.n_jobs = n_jobs
+        self.executor = Executor.from_config(executor, n_jobs=n_jobs)
 
     @staticmethod
     def _strip_attachment_points(smiles: str):
@@ -431,10 +477,9 @@ class LinkerDescriptors(MolecularDescriptors):
         ]
 
         # Compute descriptors in parallel
-        with Pool(self.n_jobs) as pool:
-            descs = [r for r in pool.imap(self._score, additional_formats["linker"])]
-            # Add prefix
-            descs = [{f"{self.prefix}_{k}": v for k, v in ds.items()} for ds in descs]
+        descs = self.executor.map(self._score, additional_formats["linker"])
+        # Add prefix
+        descs = [{f"{self.prefix}_{k}": v for k, v in ds.items()} for ds in descs]
 
         for r, d in zip(results, descs):
             r.update(d)
@@ -448,10 +493,21 @@ class RDKitDescriptors(MolecularDescriptors):
     Calculate a suite of molecular descriptors
     """
 
-    def __init__(self, prefix: str = "desc", n_jobs: int = 1, **kwargs):
+    def __init__(
+        self,
+        prefix: str = "desc",
+        n_jobs: int = 1,
+        executor: dict = None,
+        subset: list = None,
+        **kwargs,
+    ):
         """
         :param prefix: Prefix to identify scoring function instance (e.g., desc)
         :param n_jobs: Number of cores for multiprocessing
+        :param executor: Executor parameters e.g., {"backend": "dask", "address": "tcp://..."}, default is based on n_jobs
+        :param subset: Only calculate these descriptors, default is all return metrics (set automatically by MolScore to those used by the task)
         :param kwargs:
         """
-        super().__init__(prefix=prefix, n_jobs=n_jobs, **kwargs)
+        super().__init__(
+            prefix=prefix, n_jobs=n_jobs, executor=executor, subset=subset, **kwargs
+        )
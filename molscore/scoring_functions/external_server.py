@@ -1,8 +1,11 @@
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
 
 import requests
 from rdkit.Chem import AllChem as Chem
+from urllib3.util.retry import Retry
 
 from molscore.scoring_functions.utils import get_mol
 
@@ -20,19 +23,64 @@ class POSTServer:
     return_metrics = ["server_value"]
 
     def __init__(
-        self, prefix, server_address: str, input_format: str, output_value: str
+        self,
+        prefix,
+        server_address: str,
+        input_format: str,
+        output_value: str,
+        chunk_size: int = 500,
+        max_in_flight: int = 4,
+        retries: int = 3,
+        timeout: float = 600,
     ):
         """
         :param prefix: Prefix to identify scoring function instance (e.g., DRD2)
         :param server_address: Server address used to run a scoring function
         :param input_format: How to prepare data to be sent to server [smi, sdf]
         :param output_value: The name of output metric to be used (assumes JSON output format of a list of dictionaries)
+        :param chunk_size: Number of molecules sent per request, 0 to send all molecules in one request
+        :param max_in_flight: Maximum number of chunks sent to the server concurrently
+        :param retries: Number of times to retry a chunk after a connection error or server error (429, 5xx), with exponential backoff
+        :param timeout: Seconds to wait for the server to respond to a chunk
         :param kwargs:
         """
         self.prefix = prefix.replace(" ", "_")
         self.server_address = server_address
         self.input_format = input_format
         self.output_value = output_value
+        self.chunk_size = chunk_size
+        self.max_in_flight = max(1, max_in_flight)
+        self.retries = retries
+        self.timeout = timeout
+        self._session = None
+        self._pool = None
+
+    @property
+    def session(self) -> requests.Session:
+        """Persistent HTTP session so that connections to the server are kept alive, retrying chunks with backoff"""
+        if self._session is None:
+            # Scoring a chunk is idempotent, so POST requests can be retried
+            retry = Retry(
+                total=self.retries,
+                backoff_factor=0.5,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=None,
+                raise_on_status=False,
+            )
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=self.max_in_flight, max_retries=retry
+            )
+            self._session = requests.Session()
+            self._session.mount("http://", adapter)
+            self._session.mount("https://", adapter)
+        return self._session
+
+    def __getstate__(self):
+        # Sessions and pools can't be pickled, they are recreated lazily
+        state = self.__dict__.copy()
+        state["_session"] = None
+        state["_pool"] = None
+        return state
 
     def prepare_input(self, smiles, names):
         """Write input file in specified format."""
@@ -54,6 +102,45 @@ class POSTServer:
         sio.close()
         return output
 
+    def iter_input(self, smiles, names):
+        """
+        Lazily prepare input for each chunk, so that only chunks being sent are held in memory
+        :return: Generator of (chunk indices, chunk input)
+        """
+        chunk_size = self.chunk_size or max(1, len(smiles))
+        for i in range(0, len(smiles), chunk_size):
+            idxs = list(range(i, min(i + chunk_size, len(smiles))))
+            yield (
+                idxs,
+                self.prepare_input(
+                    smiles=[smiles[j] for j in idxs], names=[names[j] for j in idxs]
+                ),
+            )
+
+    def post_chunk(self, input_data: str, n: int) -> list:
+        """
+        Send one chunk to the server
+        :param input_data: Chunk input
+        :param n: Number of molecules in the chunk
+        :return: List of output dictionaries, empty if the server failed
+        """
+        try:
+            res = self.session.post(
+                self.server_address, data={"sdf": input_data}, timeout=self.timeout
+            )
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Failed to score {n} molecules at {self.server_address}: {e}")
+            return []
+        if res.status_code != 200:
+            logger.error(f"Error {res.status_code}: {res.text}")
+            return []
+        output_data = res.json()["data"]
+        if len(output_data) != n:
+            logger.warning(
+                f"Server returned {len(output_data)} outputs for {n} molecules"
+            )
+        return output_data
+
     def score(self, smiles: list, file_names: list, **kwargs):
         """
         Calculate scores for Tanimoto given a list of SMILES.
@@ -64,32 +151,46 @@ class POSTServer:
         results = [{"smiles": smi} for smi in smiles]
         # Only submit valid smiles
         valid_smiles = [i for i, smi in enumerate(smiles) if get_mol(smi)]
-        # Prepare input
-        input_data = self.prepare_input(
+        # Submit chunks, with up to max_in_flight being prepared or sent concurrently
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_in_flight)
+        chunks = self.iter_input(
             smiles=[smiles[i] for i in valid_smiles],
             names=[file_names[i] for i in valid_smiles],
         )
-        # Submit
-        res = requests.post(self.server_address, data={"sdf": input_data})
-        output_data = res.json()["data"]
+        in_flight = deque()
+        outputs = []
+        for idxs, input_data in chunks:
+            if len(in_flight) >= self.max_in_flight:
+                done_idxs, future = in_flight.popleft()
+                outputs.append((done_idxs, future.result()))
+            in_flight.append(
+                (idxs, self._pool.submit(self.post_chunk, input_data, len(idxs)))
+            )
+        outputs.extend((idxs, future.result()) for idxs, future in in_flight)
+
         all_keys = set()  # Keep record of keys
-        for i, out in zip(
-            valid_smiles, output_data
-        ):  # Ensure input and output are equal length
-            for k in out:
-                all_keys.add(k)
-                value = out[k] if out[k] else 0.0
-                results[i].update({f"{self.prefix}_{k}": value})
-                # Record named value twice as this is the name used
-                if k == self.output_value:
-                    results[i].update(
-                        {f"{self.prefix}_{self.return_metrics[0]}": value}
-                    )
-
-        # Add keys as 0.0 for invalid molecules
-        for i, res in enumerate(results):
-            if i not in valid_smiles:
-                res.update({f"{self.prefix}_{k}": 0.0 for k in all_keys})
+        for idxs, output_data in outputs:
+            for j, out in zip(
+                idxs, output_data
+            ):  # Ensure input and output are equal length
+                i = valid_smiles[j]
+                for k in out:
+                    all_keys.add(k)
+                    value = out[k] if out[k] else 0.0
+                    results[i].update({f"{self.prefix}_{k}": value})
+                    # Record named value twice as this is the name used
+                    if k == self.output_value:
+                        results[i].update(
+                            {f"{self.prefix}_{self.return_metrics[0]}": value}
+                        )
+
+        # Add keys as 0.0 for invalid molecules and any the server failed to score, even if it failed all of them
+        all_keys.add(self.output_value)
+        for res in results:
+            for k in all_keys:
+                res.setdefault(f"{self.prefix}_{k}", 0.0)
+            res.setdefault(f"{self.prefix}_{self.return_metrics[0]}", 0.0)
 
         return results
 
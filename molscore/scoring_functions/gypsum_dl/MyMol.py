@@ -573,7 +573,7 @@ class MyMol:
         self.set_rdkit_mol_prop("Genealogy", genealogy)
         self.set_rdkit_mol_prop("_Name", self.name)
 
-    def add_conformers(self, num, rmsd_cutoff=0.1, minimize=True):
+    def add_conformers(self, num, rmsd_cutoff=0.1, minimize=True, num_threads=1):
         """Add conformers to this molecule.
 
         :param num: The total number of conformers to generate, including ones
@@ -585,26 +585,44 @@ class MyMol:
         :param minimize: Whether or not to minimize the geometry of all these
            conformers. Defaults to True.
         :param minimize: bool, optional
+        :param num_threads: The number of threads used to embed and minimize
+           conformers. Defaults to 1.
+        :param num_threads: int, optional
         """
 
         # First, do you need to add new conformers? Some might have already
         # been added. Just add enough to meet the requested amount.
         num_new_confs = max(0, num - len(self.conformers))
-        for i in range(num_new_confs):
+        if num_threads > 1 and num_new_confs > 1:
             if len(self.conformers) == 0:
                 # For the first one, don't start from random coordinates.
                 new_conf = MyConformer(self)
-            else:
-                # For all subsequent ones, do start from random coordinates.
-                new_conf = MyConformer(self, None, False, True)
+                if new_conf.mol is not False:
+                    self.conformers.append(new_conf)
+                num_new_confs = num_new_confs - 1
+
+            # Embed all subsequent ones from random coordinates at once,
+            # across threads.
+            for conf in self.embed_random_conformers(num_new_confs, num_threads):
+                new_conf = MyConformer(self, conf)
+                if new_conf.mol is not False:
+                    self.conformers.append(new_conf)
+        else:
+            for i in range(num_new_confs):
+                if len(self.conformers) == 0:
+                    # For the first one, don't start from random coordinates.
+                    new_conf = MyConformer(self)
+                else:
+                    # For all subsequent ones, do start from random coordinates.
+                    new_conf = MyConformer(self, None, False, True)
 
-            if new_conf.mol is not False:
-                self.conformers.append(new_conf)
+                if new_conf.mol is not False:
+                    self.conformers.append(new_conf)
 
         # Are the current ones minimized if necessary?
-        if minimize == True:
-            for conf in self.conformers:
-                conf.minimize()  # Won't reminimize if it's already been done.
+        if minimize:
+            # Won't reminimize if it's already been done.
+            self.minimize_conformers(num_threads)
 
         # Automatically sort by the energy.
         self.conformers.sort(key=operator.attrgetter("energy"))
@@ -612,6 +630,61 @@ class MyMol:
         # Remove ones that are very structurally similar.
         #self.eliminate_structurally_similar_conformers(rmsd_cutoff)
 
+    def embed_random_conformers(self, num, num_threads=1):
+        """Embed several conformers starting from random coordinates in a
+           single multi-threaded call.
+
+        :param num: The number of conformers to generate.
+        :type num: int
+        :param num_threads: The number of threads to use. Defaults to 1.
+        :param num_threads: int, optional
+        :return: A list of rdkit.Conformer objects. May be fewer than num if
+           some fail to embed.
+        :rtype: list
+        """
+
+        mol = copy.deepcopy(self.rdkit_mol)
+        mol.RemoveAllConformers()
+        params = AllChem.ETKDGv2()
+        params.useRandomCoords = True
+        params.numThreads = num_threads
+        AllChem.EmbedMultipleConfs(mol, num, params)
+        return [Chem.Conformer(conf) for conf in mol.GetConformers()]
+
+    def minimize_conformers(self, num_threads=1):
+        """Minimize the geometries of all conformers that haven't already been
+           minimized, in a single multi-threaded call if num_threads > 1.
+
+        :param num_threads: The number of threads to use. Defaults to 1.
+        :param num_threads: int, optional
+        """
+
+        to_minimize = [conf for conf in self.conformers if not conf.minimized]
+        if num_threads <= 1 or len(to_minimize) <= 1:
+            for conf in to_minimize:
+                conf.minimize()
+            return
+
+        # Put all conformers into a single molecule to optimize them together.
+        mol = Chem.Mol(to_minimize[0].mol)
+        mol.RemoveAllConformers()
+        for conf in to_minimize:
+            mol.AddConformer(conf.conformer(), assignId=True)
+        try:
+            results = AllChem.UFFOptimizeMoleculeConfs(mol, numThreads=num_threads)
+        except Exception:
+            # Fall back to one at a time, which handles errors per conformer.
+            for conf in to_minimize:
+                conf.minimize()
+            return
+
+        for conf, new_conf, (not_converged, energy) in zip(
+            to_minimize, mol.GetConformers(), results
+        ):
+            conf.conformer(Chem.Conformer(new_conf))
+            conf.energy = energy
+            conf.minimized = True
+
     def eliminate_structurally_similar_conformers(self, rmsd_cutoff=0.1):
         """Eliminates conformers that are very geometrically similar.
 
@@ -767,7 +840,7 @@ class MyConformer:
             try:
                 ff = AllChem.UFFGetMoleculeForceField(self.mol)
                 self.energy = ff.CalcEnergy()
-            except:
+            except Exception:
                 Utils.log(
                     "Warning: Could not calculate energy for molecule "
                     + Chem.MolToSmiles(self.mol)
@@ -801,7 +874,7 @@ class MyConformer:
         """Minimize (optimize) the geometry of the current conformer if it
            hasn't already been optimized."""
 
-        if self.minimized == True:
+        if self.minimized:
             # Already minimized. Don't do it again.
             return
 
@@ -810,7 +883,7 @@ class MyConformer:
             ff = AllChem.UFFGetMoleculeForceField(self.mol)
             ff.Minimize()
             self.energy = ff.CalcEnergy()
-        except:
+        except Exception:
             Utils.log(
                 "Warning: Could not calculate energy for molecule "
                 + Chem.MolToSmiles(self.mol)
@@ -53,6 +53,7 @@ def generate_alternate_3d_nonaromatic_ring_confs(
     second_embed,
     job_manager,
     parallelizer_obj,
+    num_threads=1,
 ):
     """Docking programs like Vina rotate chemical moieties around their
        rotatable bonds, so it's not necessary to generate a larger rotomer
@@ -86,6 +87,9 @@ def generate_alternate_3d_nonaromatic_ring_confs(
     :type job_manager: string
     :param parallelizer_obj: The Parallelizer object.
     :type parallelizer_obj: Parallelizer.Parallelizer
+    :param num_threads: The number of threads used to embed and minimize the
+       conformers of each molecule. Defaults to 1.
+    :type num_threads: int, optional
     :return: Returns None if no ring conformers are generated
     :rtype: None
     """
@@ -105,7 +109,15 @@ def generate_alternate_3d_nonaromatic_ring_confs(
             ones_with_nonaro_rngs.add(contnr_idx)
             for mol in contnr.mols:
                 params.append(
-                    tuple([mol, max_variants_per_compound, thoroughness, second_embed])
+                    tuple(
+                        [
+                            mol,
+                            max_variants_per_compound,
+                            thoroughness,
+                            second_embed,
+                            num_threads,
+                        ]
+                    )
                 )
     params = tuple(params)
 
@@ -121,7 +133,7 @@ def generate_alternate_3d_nonaromatic_ring_confs(
         )
     else:
         for i in params:
-            tmp.append(parallel_get_ring_confs(i[0], i[1], i[2], i[3]))
+            tmp.append(parallel_get_ring_confs(*i))
 
     # Flatten the results.
     results = Parallelizer.flatten_list(tmp)
@@ -168,7 +180,9 @@ def generate_alternate_3d_nonaromatic_ring_confs(
                 )
 
 
-def parallel_get_ring_confs(mol, max_variants_per_compound, thoroughness, second_embed):
+def parallel_get_ring_confs(
+    mol, max_variants_per_compound, thoroughness, second_embed, num_threads=1
+):
     """Gets alternate ring conformations. Meant to run with the parallelizer class.
 
     :param mol: The molecule to process (with non-aromatic ring(s)).
@@ -190,6 +204,9 @@ def parallel_get_ring_confs(mol, max_variants_per_compound, thoroughness, second
         run time, but sometimes converts certain molecules that would
         otherwise fail.
     :type second_embed: bool
+    :param num_threads: The number of threads used to embed and minimize
+       conformers. Defaults to 1.
+    :type num_threads: int, optional
     :return: A list of MyMol.MyMol objects, with alternate ring conformations.
     :rtype: list
     """
@@ -226,7 +243,7 @@ def parallel_get_ring_confs(mol, max_variants_per_compound, thoroughness, second
 
     # Generate a bunch of conformations, ordered from best energy to worst.
     # Note that this is cached. Minimizing too.
-    mol.add_conformers(thoroughness * max_variants_per_compound, 0.1, True)
+    mol.add_conformers(thoroughness * max_variants_per_compound, 0.1, True, num_threads)
 
     if len(mol.conformers) > 0:
         # Sometimes there are no conformers if it's an impossible structure.
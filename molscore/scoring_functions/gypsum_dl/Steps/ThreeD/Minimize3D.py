@@ -35,6 +35,7 @@ def minimize_3d(
     second_embed,
     job_manager,
     parallelizer_obj,
+    num_threads=1,
 ):
     """This function minimizes a 3D molecular conformation. In an attempt to
        not get trapped in a local minimum, it actually generates a number of
@@ -66,6 +67,9 @@ def minimize_3d(
     :type job_manager: string
     :param parallelizer_obj: The Parallelizer object.
     :type parallelizer_obj: Parallelizer.Parallelizer
+    :param num_threads: The number of threads used to embed and minimize the
+       conformers of each molecule. Defaults to 1.
+    :type num_threads: int, optional
     """
 
     # Let the user know you're on this step.
@@ -81,7 +85,15 @@ def minimize_3d(
         for mol in contnr.mols:
             ones_without_nonaro_rngs.add(mol.contnr_idx)
             params.append(
-                tuple([mol, max_variants_per_compound, thoroughness, second_embed])
+                tuple(
+                    [
+                        mol,
+                        max_variants_per_compound,
+                        thoroughness,
+                        second_embed,
+                        num_threads,
+                    ]
+                )
             )
     params = tuple(params)
 
@@ -91,7 +103,7 @@ def minimize_3d(
         tmp = parallelizer_obj.run(params, parallel_minit, num_procs, job_manager)
     else:
         for i in params:
-            tmp.append(parallel_minit(i[0], i[1], i[2], i[3]))
+            tmp.append(parallel_minit(*i))
 
     # Save energy into MyMol object, and get a list of just those objects.
     contnr_list_not_empty = set([])  # To keep track of which container lists
@@ -127,7 +139,9 @@ def minimize_3d(
                 mol.conformers = []
 
 
-def parallel_minit(mol, max_variants_per_compound, thoroughness, second_embed):
+def parallel_minit(
+    mol, max_variants_per_compound, thoroughness, second_embed, num_threads=1
+):
     """Minimizes the geometries of a MyMol.MyMol object. Meant to be run
     within parallelizer.
 
@@ -150,12 +164,17 @@ def parallel_minit(mol, max_variants_per_compound, thoroughness, second_embed):
         run time, but sometimes converts certain molecules that would
         otherwise fail.
     :type second_embed: bool
+    :param num_threads: The number of threads used to embed and minimize
+       conformers. Defaults to 1.
+    :type num_threads: int, optional
     :return: A molecule with the minimized conformers inside it.
     :rtype: MyMol.MyMol
     """
 
     # Not minimizing. Just adding the conformers.
-    mol.add_conformers(thoroughness * max_variants_per_compound, 0.01, False)
+    mol.add_conformers(
+        thoroughness * max_variants_per_compound, 0.01, False, num_threads
+    )
 
     if len(mol.conformers) > 0:
         # Because it is possible to find a molecule that has no
@@ -168,8 +187,7 @@ def parallel_minit(mol, max_variants_per_compound, thoroughness, second_embed):
         # MCT: 20/03/24: This should be controlled by thoroughness not max_vars_per_cmpd
         # MCT: max_vars_per_cmpd = max_variants_per_compound
         # MCT: for i in range(len(mol.conformers[:max_vars_per_cmpd])):
-        for i in range(len(mol.conformers)): # MCT
-            mol.conformers[i].minimize()
+        mol.minimize_conformers(num_threads)  # MCT
 
         # Remove similar conformers
         # mol.eliminate_structurally_similar_conformers()
@@ -41,6 +41,7 @@ def prepare_3d(contnrs, params):
     num_procs = params["num_processors"]
     job_manager = params["job_manager"]
     parallelizer_obj = params["Parallelizer"]
+    num_threads = params.get("num_threads", 1)
 
     # Do the 2d to 3d conversionl, if requested.
     if not params["2d_output_only"]:
@@ -64,6 +65,7 @@ def prepare_3d(contnrs, params):
                 second_embed,
                 job_manager,
                 parallelizer_obj,
+                num_threads,
             )
 
         # Minimize the molecules, if requested.
@@ -76,6 +78,7 @@ def prepare_3d(contnrs, params):
                 second_embed,
                 job_manager,
                 parallelizer_obj,
+                num_threads,
             )
             
     return contnrs
@@ -16,6 +16,7 @@ class LegacyQSAR(BaseServerSF):
     Run published QSAR models in a stand alone environment to avoid conflict dependencies.
     """
 
+    multi_model = True
     return_metrics = ["pred_proba"]
     # Directory of env-name, and resource path to relevant dir, model name & server name
     model_dictionary = {
@@ -102,4 +103,5 @@ class LegacyQSAR(BaseServerSF):
             server_path=server_path,
             server_grace=60,
             server_kwargs={"model_path": model_path, "fp": fp, "nBits": nBits},
+            **kwargs,
         )
@@ -41,4 +41,5 @@ class MolSkill(BaseServerSF):
                 "molskill_server.py"
             ),
             server_grace=server_grace,
+            **kwargs,
         )
@@ -19,6 +19,7 @@ class PIDGIN(BaseServerSF):
     Download and run PIDGIN classification models (~11GB) via Zenodo to return the positive predictions, atleast one uniprot must be specified.
     """
 
+    multi_model = True
     return_metrics = ["pred_proba"]
 
     @classmethod
@@ -134,4 +135,5 @@ class PIDGIN(BaseServerSF):
             ),
             server_grace=600,
             server_kwargs=server_kwargs,
+            **kwargs,
         )
@@ -16,6 +16,7 @@ class RAScore_XGB(BaseServerSF):
     Predicted synthetic feasibility according to solveability by AiZynthFinder https://doi.org/10.1039/d0sc05401a
     """
 
+    multi_model = True
     return_metrics = ["pred_proba"]
     model_dictionary = {
         "ChEMBL": resources.files("molscore.data.models.RAScore").joinpath(
@@ -58,4 +59,5 @@ class RAScore_XGB(BaseServerSF):
                 "rascore_server.py"
             ),
             server_kwargs={"model_path": model_path},
+            **kwargs,
         )
@@ -1,10 +1,12 @@
 import logging
 import re
+import threading
+from collections import OrderedDict
 
 import numpy as np
 from rdkit.Chem import AllChem as Chem
 
-from molscore.scoring_functions.utils import Pool, get_mol
+from molscore.scoring_functions.utils import Executor, get_mol
 
 logger = logging.getLogger("reaction_filter")
 formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
@@ -14,6 +16,101 @@ ch.setLevel(logging.INFO)
 logger.addHandler(ch)
 
 
+# Per-process state, reactions are compiled once and disconnections memoized per worker instead of per task
+_compiled_reactions = {}
+_disconnection_cache = OrderedDict()
+# Shared by threads of the thread backend, so lookups and evictions must not interleave
+_disconnection_cache_lock = threading.Lock()
+DISCONNECTION_CACHE_SIZE = 100000
+# Canonicalizing the key costs about as much as applying one reaction, so only memoize larger reaction sets
+MIN_CACHED_REACTIONS = 4
+
+
+def compile_reactions(smirks: tuple) -> list:
+    """
+    Compile reaction SMIRKS, once per process
+    :param smirks: Tuple of reaction SMIRKS
+    :return: List of initialized RDKit ChemicalReactions
+    """
+    if smirks not in _compiled_reactions:
+        reactions = []
+        for s in smirks:
+            reaction = Chem.ReactionFromSmarts(s)
+            reaction.Initialize()
+            reactions.append(reaction)
+        _compiled_reactions[smirks] = reactions
+    return _compiled_reactions[smirks]
+
+
+def bond_key(molecule, new_bond: tuple) -> str:
+    """
+    Canonical key of a molecule split at a new bond i.e., the (scaffold side, decoration) pair with labelled dummy atoms
+    :param molecule: RDKit Mol
+    :param new_bond: (scaffold atom idx, decoration atom idx)
+    :return: Canonical SMILES
+    """
+    bond = molecule.GetBondBetweenAtoms(*new_bond)
+    fragments = Chem.FragmentOnBonds(
+        molecule, [bond.GetIdx()], addDummies=True, dummyLabels=[(1, 1)]
+    )
+    return Chem.MolToSmiles(fragments)
+
+
+def synthons_disconnect(synthons: list, new_bond: tuple) -> bool:
+    """Check to see if any synthons involved disconnecting the new bond"""
+    aidx1, aidx2 = new_bond
+    for synth1, synth2 in synthons:
+        synth1_idxs = set(
+            [
+                int(atom.GetProp("react_atom_idx"))
+                for atom in synth1.GetAtoms()
+                if atom.HasProp("react_atom_idx")
+            ]
+        )
+        synth2_idxs = set(
+            [
+                int(atom.GetProp("react_atom_idx"))
+                for atom in synth2.GetAtoms()
+                if atom.HasProp("react_atom_idx")
+            ]
+        )
+        # Stop as soon as we find a possible disconnection
+        if (aidx1 in synth1_idxs) and (aidx2 in synth2_idxs):
+            return True
+        elif (aidx1 in synth2_idxs) and (aidx2 in synth1_idxs):
+            return True
+    return False
+
+
+def bond_disconnectable(molecule, new_bond: tuple, smirks: tuple) -> bool:
+    """
+    Check whether any reaction disconnects a new bond, memoized by the canonical (scaffold side, decoration) pair
+    :param molecule: RDKit Mol
+    :param new_bond: (scaffold atom idx, decoration atom idx)
+    :param smirks: Tuple of reaction SMIRKS
+    """
+    key = None
+    if len(smirks) >= MIN_CACHED_REACTIONS:
+        key = (smirks, bond_key(molecule, new_bond))
+        with _disconnection_cache_lock:
+            if key in _disconnection_cache:
+                _disconnection_cache.move_to_end(key)
+                return _disconnection_cache[key]
+    # Stop at the first reaction that disconnects the bond
+    disconnectable = False
+    for reaction in compile_reactions(smirks):
+        synthons = reaction.RunReactant(molecule, 0)
+        if synthons_disconnect(synthons, new_bond):
+            disconnectable = True
+            break
+    if key is not None:
+        with _disconnection_cache_lock:
+            _disconnection_cache[key] = disconnectable
+            if len(_disconnection_cache) > DISCONNECTION_CACHE_SIZE:
+                _disconnection_cache.popitem(last=False)
+    return disconnectable
+
+
 class DecoratedReactionFilter:
     """Score molecules based on whether scaffold decorations adhere to a set of reaction filters"""
 
@@ -67,6 +164,7 @@ class DecoratedReactionFilter:
         custom_reactions: list = None,
         libinvent_reactions: bool = True,
         n_jobs: int = 1,
+        executor: dict = None,
         **kwargs,
     ):
         """
@@ -75,9 +173,11 @@ class DecoratedReactionFilter:
         :param custom_reactions: Provide a custom list of SMIRKS
         :param libinvent_reactions: Run pre-defined reaction filters from LibINVENT
         :param n_jobs: Number of parallel jobs to run
+        :param executor: Executor parameters e.g., {"backend": "dask", "address": "tcp://..."}, default is based on n_jobs
         """
         self.prefix = prefix.replace(" ", "_")
         self.n_jobs = n_jobs
+        self.executor = Executor.from_config(executor, n_jobs=n_jobs)
         self.reaction_smirks = []
         self.scaffold = get_mol(scaffold)
         assert self.scaffold, f"Error parsing scaffold {scaffold}"
@@ -85,8 +185,13 @@ class DecoratedReactionFilter:
             self.reaction_smirks.extend(custom_reactions)
         if libinvent_reactions:
             self.reaction_smirks.extend(self.LibINVENT_reactions)
+        self.reaction_smirks = tuple(self.reaction_smirks)
+        # Compile here to catch invalid SMIRKS, workers compile their own once
+        compile_reactions(self.reaction_smirks)
 
-        self.reactions = [Chem.ReactionFromSmarts(s) for s in self.reaction_smirks]
+    @property
+    def reactions(self):
+        return compile_reactions(self.reaction_smirks)
 
     def _identify_new_bonds(self, molecule):
         """Identify attachment points in scaffold"""
@@ -101,49 +206,6 @@ class DecoratedReactionFilter:
                     attachment_points.append((idx, nidx))
         return attachment_points
 
-    def _get_synthons(self, molecule, reaction):
-        """Apply a single reaction"""
-        synthons = reaction.RunReactant(molecule, 0)
-        return list(synthons)
-
-    def _get_all_possible_synthons(self, molecule):
-        """Apply all reactions"""
-        synthons = []
-        for reaction in self.reactions:
-            synthons.extend(self._get_synthons(molecule, reaction))
-        return synthons
-
-    def _analyze_synthons(self, synthons, new_bonds):
-        """Check to see if any synthons involved disconnecting the new bonds"""
-        available_disconnections = [False] * len(new_bonds)
-
-        for i, (aidx1, aidx2) in enumerate(new_bonds):
-            for synth1, synth2 in synthons:
-                synth1_idxs = set(
-                    [
-                        int(atom.GetProp("react_atom_idx"))
-                        for atom in synth1.GetAtoms()
-                        if atom.HasProp("react_atom_idx")
-                    ]
-                )
-                synth2_idxs = set(
-                    [
-                        int(atom.GetProp("react_atom_idx"))
-                        for atom in synth2.GetAtoms()
-                        if atom.HasProp("react_atom_idx")
-                    ]
-                )
-                # Stop as soon as we find a possible disconnection
-                if (aidx1 in synth1_idxs) and (aidx2 in synth2_idxs):
-                    available_disconnections[i] = True
-                    break
-                elif (aidx1 in synth2_idxs) and (aidx2 in synth1_idxs):
-                    available_disconnections[i] = True
-                    break
-                else:
-                    pass
-        return available_disconnections
-
     def _score_smiles(self, smiles: str):
         """Score a single SMILES string"""
         molecule = get_mol(smiles)
@@ -151,8 +213,10 @@ class DecoratedReactionFilter:
             new_bonds = self._identify_new_bonds(molecule)
             if not new_bonds:
                 return 0.0
-            synthons = self._get_all_possible_synthons(molecule)
-            available_disconnections = self._analyze_synthons(synthons, new_bonds)
+            available_disconnections = [
+                bond_disconnectable(molecule, bond, self.reaction_smirks)
+                for bond in new_bonds
+            ]
             return np.sum(available_disconnections) / len(available_disconnections)
         else:
             return 0.0
@@ -160,8 +224,7 @@ class DecoratedReactionFilter:
     def __call__(self, smiles, **kwargs):
         """Score a list of SMILES strings"""
         results = []
-        with Pool(self.n_jobs) as pool:
-            scores = [score for score in pool.imap(self._score_smiles, smiles)]
+        scores = self.executor.map(self._score_smiles, smiles)
         for smi, score in zip(smiles, scores):
             results.append({"smiles": smi, f"{self.prefix}_score": score})
         return results
@@ -174,6 +237,7 @@ class SelectiveDecoratedReactionFilter(DecoratedReactionFilter):
         scaffold: str,
         allowed_reactions: dict = {},
         n_jobs: int = 1,
+        executor: dict = None,
         **kwargs,
     ):
         """
@@ -181,10 +245,11 @@ class SelectiveDecoratedReactionFilter(DecoratedReactionFilter):
         :param scaffold: Assumes de novo molecule generation is decorative from this scaffold with labeled attachment points
         :param allowed_reactions: A dictionary mapping attachment points to a list of allowed reactions e.g., {0: list(reaction)}}
         :param n_jobs: Number of parallel jobs to run
+        :param executor: Executor parameters e.g., {"backend": "dask", "address": "tcp://..."}, default is based on n_jobs
         """
         self.prefix = prefix.replace(" ", "_")
         self.n_jobs = n_jobs
-        self.reaction_smirks = []
+        self.executor = Executor.from_config(executor, n_jobs=n_jobs)
         self.scaffold = get_mol(scaffold)
         assert self.scaffold, f"Error parsing scaffold {scaffold}"
         assert (
@@ -193,10 +258,11 @@ class SelectiveDecoratedReactionFilter(DecoratedReactionFilter):
         assert all(
             [isinstance(reactions, list) for reactions in allowed_reactions.values()]
         ), "Reactions provided must be a list per reaction vector"
-        self.reactions = {
-            int(idx): [Chem.ReactionFromSmarts(s) for s in smirks]
-            for idx, smirks in allowed_reactions.items()
+        self.reaction_smirks = {
+            int(idx): tuple(smirks) for idx, smirks in allowed_reactions.items()
         }
+        for smirks in self.reaction_smirks.values():
+            compile_reactions(smirks)
 
         # RDKit GetSubstructureMatch doesn't work with atom mapped molecules, so we need to remove the atom mapping and keep a record
         self.scaffidx_to_vector = {}
@@ -231,43 +297,12 @@ class SelectiveDecoratedReactionFilter(DecoratedReactionFilter):
                     attachment_points[molidx_to_vector[idx]] = (idx, nidx)
         return attachment_points
 
-    def _get_all_possible_synthons(self, molecule, vidx):
-        """Apply all reactions"""
-        synthons = []
-        for reaction in self.reactions[vidx]:
-            synthons.extend(self._get_synthons(molecule, reaction))
-        return synthons
-
-    def _analyze_synthons(self, synthons, new_bond):
-        """Check to see if any synthons involved disconnecting the new bonds"""
-        available_disconnections = False
-        aidx1, aidx2 = new_bond
-
-        for synth1, synth2 in synthons:
-            synth1_idxs = set(
-                [
-                    int(atom.GetProp("react_atom_idx"))
-                    for atom in synth1.GetAtoms()
-                    if atom.HasProp("react_atom_idx")
-                ]
-            )
-            synth2_idxs = set(
-                [
-                    int(atom.GetProp("react_atom_idx"))
-                    for atom in synth2.GetAtoms()
-                    if atom.HasProp("react_atom_idx")
-                ]
-            )
-            # Stop as soon as we find a possible disconnection
-            if (aidx1 in synth1_idxs) and (aidx2 in synth2_idxs):
-                available_disconnections = True
-                break
-            elif (aidx1 in synth2_idxs) and (aidx2 in synth1_idxs):
-                available_disconnections = True
-                break
-            else:
-                pass
-        return available_disconnections
+    @property
+    def reactions(self):
+        return {
+            vidx: compile_reactions(smirks)
+            for vidx, smirks in self.reaction_smirks.items()
+        }
 
     def _score_smiles(self, smiles: str):
         """Score a single SMILES string"""
@@ -276,12 +311,11 @@ class SelectiveDecoratedReactionFilter(DecoratedReactionFilter):
             new_bonds = self._identify_new_bonds(molecule)
             if not new_bonds:
                 return 0.0
-            available_disconnections = []
-            for vidx, bond in new_bonds.items():
-                # Get specified synthons per attachment point
-                synthons = self._get_all_possible_synthons(molecule, vidx)
-                # Get available disconnections per attachment points
-                available_disconnections.append(self._analyze_synthons(synthons, bond))
+            # Get available disconnections per attachment point using the specified reactions
+            available_disconnections = [
+                bond_disconnectable(molecule, bond, self.reaction_smirks[vidx])
+                for vidx, bond in new_bonds.items()
+            ]
             return np.sum(available_disconnections) / len(available_disconnections)
         else:
             return 0.0
@@ -10,7 +10,13 @@ import os
 import numpy as np
 from rdkit import Chem, rdBase
 from rdkit.Chem import AllChem
-from sklearn.externals import joblib
+
+from molscore.scoring_functions.sklearn_model import (
+    feature_matrix,
+    load_model,
+    predict_proba,
+)
+from molscore.scoring_functions.utils import Executor
 
 rdBase.DisableLog("rdApp.error")
 
@@ -23,15 +29,28 @@ class ActivityModel:
 
     return_metrics = ["pred_proba"]
 
-    def __init__(self, prefix: str, model_path: os.PathLike, **kwargs):
+    def __init__(
+        self,
+        prefix: str,
+        model_path: os.PathLike,
+        n_jobs: int = 1,
+        executor: dict = None,
+        chunk_size: int = 10000,
+        **kwargs,
+    ):
         """
         :param prefix: Prefix to identify scoring function instance (e.g., DRD2)
         :param model_path: Path to pre-trained model (specifically clf.pkl in REINVENT publication)
+        :param n_jobs: Number of python.multiprocessing jobs for multiprocessing of fps
+        :param executor: Executor parameters e.g., {"backend": "dask", "address": "tcp://..."}, default is based on n_jobs
+        :param chunk_size: Maximum number of molecules passed to the model at once
         :param kwargs:
         """
         self.clf_path = model_path
         self.prefix = prefix.replace(" ", "_")
-        self.clf = joblib.load(self.clf_path)
+        self.clf = load_model(self.clf_path)
+        self.executor = Executor.from_config(executor, n_jobs=n_jobs)
+        self.chunk_size = chunk_size
 
     def __call__(self, smiles, **kwargs):
         """
@@ -54,26 +73,20 @@ class ActivityModel:
             return results
 
         elif isinstance(smiles, list):
-            results = []
-            valid = []
-            fps = []
-
-            # Calculate fingerprints
-            for i, smi in enumerate(smiles):
-                result = {"smiles": smi}
-                mol = Chem.MolFromSmiles(smi)
-                if mol:
-                    fp = ActivityModel.fingerprints_from_mol(mol)
-                    fps.append(fp.reshape(-1))
-                    valid.append(i)
-                else:
-                    result.update({f"{self.prefix}_pred_proba": 0.0})
-                results.append(result)
+            results = [
+                {"smiles": smi, f"{self.prefix}_pred_proba": 0.0} for smi in smiles
+            ]
+
+            # Calculate fingerprints as one matrix
+            valid, X = feature_matrix(
+                smiles, ActivityModel.fingerprints_from_smiles, executor=self.executor
+            )
 
             # Grab prediction
-            y_prob = self.clf.predict_proba(np.asarray(fps))[:, 1]
-            for i, prob in zip(valid, y_prob):
-                results[i].update({f"{self.prefix}_pred_proba": prob})
+            if len(valid) != 0:
+                y_prob = predict_proba(self.clf, X, self.chunk_size)
+                for i, prob in zip(valid, y_prob):
+                    results[i].update({f"{self.prefix}_pred_proba": prob})
 
             return results
 
@@ -81,6 +94,17 @@ class ActivityModel:
             print("smiles not provided in correct format")
             raise
 
+    @classmethod
+    def fingerprints_from_smiles(cls, smiles: str):
+        """
+        Calculate folded bit fingerprint from SMILES
+        :param smiles: SMILES string
+        :return: fp (ndarray) or None if invalid
+        """
+        mol = Chem.MolFromSmiles(smiles)
+        if mol:
+            return cls.fingerprints_from_mol(mol).reshape(-1)
+
     @classmethod
     def fingerprints_from_mol(cls, mol: Chem.rdchem.Mol):
         """
@@ -16,6 +16,7 @@ class SCScore(BaseServerSF):
     Predicted synthetic complexity according to https://doi.org/10.1021/acs.jcim.7b00622
     """
 
+    multi_model = True
     return_metrics = ["score"]
     model_dictionary = {
         "1024bool": resources.files("molscore.data.models.SCScore").joinpath(
@@ -59,4 +60,5 @@ class SCScore(BaseServerSF):
             ),
             server_grace=server_grace,
             server_kwargs={"model_path": model_path},
+            **kwargs,
         )
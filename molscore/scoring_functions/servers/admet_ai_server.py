@@ -1,8 +1,14 @@
 import argparse
 import logging
-from flask import Flask, request, jsonify
+import threading
 
+import numpy as np
 from admet_ai import ADMETModel
+from chemprop.data.data import SMILES_TO_GRAPH, SMILES_TO_MOL
+from model_server import add_server_args, serve
+from protocol import columns_to_records
+from rdkit import Chem
+from utils import get_mol, lru_touch, lru_trim
 
 logger = logging.getLogger("admet_ai_server")
 formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
@@ -11,7 +17,8 @@ ch = logging.StreamHandler()
 ch.setLevel(logging.INFO)
 logger.addHandler(ch)
 
-app = Flask(__name__)
+# Featurization caches are global to chemprop, so models predict one at a time
+CHEMPROP_LOCK = threading.Lock()
 
 
 class AdmetAI:
@@ -19,47 +26,80 @@ class AdmetAI:
     This particular class uses the QSAR model from Lib-INVENT in a stand alone environment to avoid conflict dependencies.
     """
 
-    def __init__(self, **kwargs):
+    def __init__(self, num_workers: int = 0, mol_cache_size: int = 100000, **kwargs):
         """
         :param prefix: Prefix to identify scoring function instance (e.g., DRD2)
+        :param num_workers: Number of data loader workers, 0 is usually fastest for CPU inference
+        :param mol_cache_size: Number of featurized molecules kept in memory, by canonical SMILES
         """
-        self.ADMETModel = ADMETModel(include_physchem=False, cache_molecules=False)
+        self.ADMETModel = ADMETModel(
+            include_physchem=False, num_workers=num_workers, cache_molecules=True
+        )
+        self.mol_cache_size = mol_cache_size
+        self.columns = []
 
+        # Warm up, so that the first request doesn't pay for lazy initialization
+        self.columns = list(self.predict(["c1ccccc1"]).keys())
 
-@app.route("/", methods=["POST"])
-def compute():
-    # Get smiles from request
-    logger.debug("POST request received")
-    smiles = request.get_json().get("smiles", [])
+    def predict(self, smiles: list) -> dict:
+        """
+        Predict each unique valid molecule once
+        :param smiles: List of SMILES
+        :return: Dictionary of metric name to array in SMILES order, 0.0 for invalid SMILES
+        """
+        mols = [get_mol(smi) for smi in smiles]
+        canonical = [Chem.MolToSmiles(mol) if mol else None for mol in mols]
+        unique = list(dict.fromkeys(smi for smi in canonical if smi is not None))
+        unique_idxs = {smi: i for i, smi in enumerate(unique)}
+        # Invalid SMILES index the 0.0 appended to each column
+        idxs = [unique_idxs.get(smi, len(unique)) for smi in canonical]
+
+        if not unique:
+            return {name: np.zeros(len(smiles)) for name in self.columns}
+
+        with CHEMPROP_LOCK:
+            preds = self.ADMETModel.predict(smiles=unique)
+            # Bound chemprop's caches to the most recently used molecules
+            for cache in (SMILES_TO_GRAPH, SMILES_TO_MOL):
+                lru_touch(cache, unique)
+                lru_trim(cache, self.mol_cache_size)
+
+        # Admet_AI removes invalids, so we need to check they're all returned
+        assert len(unique) == len(preds)
+        return {
+            name: np.append(preds[name].to_numpy(), 0.0)[idxs] for name in preds.columns
+        }
+
+
+def predict(model, smiles: list) -> list:
     logger.debug(f"Read SMILES:\n\t{smiles}")
 
     # Make predictions
     logger.debug("Making predictions")
-    preds = model.ADMETModel.predict(smiles=smiles)
-    preds = preds.to_dict("records")
-    logger.debug(f"Predictions received:\n\t{preds}")
-
-    # Admet_AI removes invalids, so we need to check they're all returned
-    assert len(smiles) == len(preds)
-
-    # Update dictionary
-    results = []
-    for smiles, pred in zip(smiles, preds):
-        r = {"smiles": smiles}
-        r.update(pred)
-        results.append(r)
+    columns = model.predict(smiles)
+    logger.debug(f"Predictions received:\n\t{columns}")
 
     # Return results
-    return jsonify(results)
+    return columns_to_records(smiles, columns)
 
 
-def get_args():
+def get_parser():
     parser = argparse.ArgumentParser(description="Run a scoring function server")
-    parser.add_argument("--port", type=int, default=8000, help="Port to run server on")
-    return parser.parse_args()
+    add_server_args(parser)
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=0,
+        help="Number of data loader workers, 0 is usually fastest for CPU inference",
+    )
+    parser.add_argument(
+        "--mol_cache_size",
+        type=int,
+        default=100000,
+        help="Number of featurized molecules kept in memory, by canonical SMILES",
+    )
+    return parser
 
 
 if __name__ == "__main__":
-    args = get_args()
-    model = AdmetAI(**args.__dict__)
-    app.run(port=args.port)
+    serve(predict, get_parser(), name="admet_ai", load=AdmetAI)
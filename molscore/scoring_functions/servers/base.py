@@ -1,8 +1,6 @@
 import argparse
-from flask import Flask, request, jsonify
 
-
-app = Flask(__name__)
+from model_server import add_server_args, serve
 
 
 class Model:
@@ -15,33 +13,26 @@ class Model:
         # TODO Load a model and anything necessary attributes here
 
 
-@app.route("/", methods=["POST"])
-def compute():
-    # Get smiles from request
-    smiles = request.get_json().get("smiles", [])
-
+def predict(model, smiles: list) -> list:
+    """Predict a list of SMILES with a loaded Model, concurrent requests are merged into one call by the ModelServer"""
     # TODO Make predictions
     preds = model.predict(smiles=smiles)
 
     # TODO Update dictionary
     results = []
-    for smiles, pred in zip(smiles, preds):
-        r = {"smiles": smiles}
+    for smi, pred in zip(smiles, preds):
+        r = {"smiles": smi}
         r.update(pred)
         results.append(r)
-
-    # Return results
-    return jsonify(results)
+    return results
 
 
-def get_args():
+def get_parser():
     parser = argparse.ArgumentParser(description="Run a scoring function server")
-    parser.add_argument("--port", type=int, default=8000, help="Port to run server on")
+    add_server_args(parser)
     # TODO Add more arguments here
-    return parser.parse_args()
+    return parser
 
 
 if __name__ == "__main__":
-    args = get_args()
-    model = Model(**args.__dict__)
-    app.run(port=args.port)
+    serve(predict, get_parser(), load=Model)
@@ -1,10 +1,16 @@
-import os
 import argparse
 import logging
-import numpy as np
-from flask import Flask, request, jsonify
+import os
+import threading
 
 import chemprop
+import numpy as np
+from chemprop.data import set_cache_graph, set_cache_mol
+from chemprop.data.data import SMILES_TO_GRAPH, SMILES_TO_MOL
+from chemprop.train.make_predictions import load_data, predict_and_save, set_features
+from model_server import add_server_args, serve
+from protocol import columns_to_records
+from utils import canonize_smiles, lru_touch, lru_trim
 
 logger = logging.getLogger("chemprop_server")
 formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
@@ -13,7 +19,8 @@ ch = logging.StreamHandler()
 ch.setLevel(logging.INFO)
 logger.addHandler(ch)
 
-app = Flask(__name__)
+# Featurization parameters and caches are global to chemprop, so models predict one at a time
+CHEMPROP_LOCK = threading.Lock()
 
 
 class Model:
@@ -21,10 +28,20 @@ class Model:
     This particular class uses the QSAR model from Lib-INVENT in a stand alone environment to avoid conflict dependencies.
     """
 
-    def __init__(self, model_dir: os.PathLike, **kwargs):
+    def __init__(
+        self,
+        model_dir: os.PathLike,
+        batch_size: int = 50,
+        num_workers: int = 0,
+        graph_cache_size: int = 100000,
+        **kwargs,
+    ):
         """
         :param prefix: Prefix to identify scoring function instance (e.g., DRD2)
         :param model_path: Path to pre-trained model (specifically clf.pkl)
+        :param batch_size: Number of molecules per forward pass
+        :param num_workers: Number of data loader workers, 0 is usually fastest for CPU inference
+        :param graph_cache_size: Number of featurized molecules kept in memory, by canonical SMILES
         """
         predict_arguments = [
             "--test_path",
@@ -33,79 +50,125 @@ class Model:
             "/dev/null",
             "--checkpoint_dir",
             model_dir,
+            "--batch_size",
+            str(batch_size),
+            "--num_workers",
+            str(num_workers),
         ]
         self.predict_args = chemprop.args.PredictArgs().parse_args(predict_arguments)
+        self.graph_cache_size = graph_cache_size
 
         logger.debug(f"Loading model from {model_dir}")
         self.model_objects = chemprop.train.load_model(args=self.predict_args)
         logger.debug(f"Model loaded: {self.model_objects}")
 
+        # Featurized molecules are cached by chemprop, shared by all models in this process
+        set_cache_graph(True)
+        set_cache_mol(True)
+
+        # Warm up, so that the first request doesn't pay for lazy initialization
+        self.predict(["c1ccccc1"])
+
+    def predict(self, smiles: list):
+        """
+        Predict SMILES with the loaded models, without the overhead of chemprop.train.make_predictions
+        :param smiles: List of SMILES
+        :return: (predictions, uncertainties) arrays of shape (SMILES, tasks), NaN for invalid SMILES
+        """
+        args, train_args, models, scalers, num_tasks, task_names = self.model_objects
+        # Featurize each unique molecule once
+        canonical = [canonize_smiles(smi) for smi in smiles]
+        unique = list(dict.fromkeys(canonical))
+        unique_idxs = {smi: i for i, smi in enumerate(unique)}
+        preds = np.full((len(unique), num_tasks), np.nan)
+        uncs = np.full((len(unique), num_tasks), np.nan)
+
+        with CHEMPROP_LOCK:
+            set_features(args, train_args)
+            full_data, test_data, test_data_loader, full_to_valid_indices = load_data(
+                args, [[smi] for smi in unique]
+            )
+            if len(test_data) > 0:
+                valid_preds, valid_uncs = predict_and_save(
+                    args=args,
+                    train_args=train_args,
+                    test_data=test_data,
+                    task_names=task_names,
+                    num_tasks=num_tasks,
+                    test_data_loader=test_data_loader,
+                    full_data=full_data,
+                    full_to_valid_indices=full_to_valid_indices,
+                    models=models,
+                    scalers=scalers,
+                    num_models=len(args.checkpoint_paths),
+                    return_invalid_smiles=False,
+                    save_results=False,
+                )
+                valid_idxs = list(full_to_valid_indices.keys())
+                preds[valid_idxs] = np.asarray(valid_preds, dtype=float).reshape(
+                    len(valid_idxs), -1
+                )
+                uncs[valid_idxs] = np.asarray(valid_uncs, dtype=float).reshape(
+                    len(valid_idxs), -1
+                )
+            # Bound chemprop's caches to the most recently used molecules
+            for cache in (SMILES_TO_GRAPH, SMILES_TO_MOL):
+                lru_touch(cache, unique)
+                lru_trim(cache, self.graph_cache_size)
+
+        idxs = [unique_idxs[smi] for smi in canonical]
+        return preds[idxs], uncs[idxs]
+
 
-@app.route("/", methods=["POST"])
-def compute():
-    # Get smiles from request
-    logger.debug("POST request received")
-    smiles = request.get_json().get("smiles", [])
+def predict(model, smiles: list) -> list:
     logger.debug(f"Reading SMILES:\n\t{smiles}")
 
-    # Make predictions
-    # Preds & uncs are -> {idx: pred, idx2: pred2}
-    # while individual pred/uncd is shape(tasks)
-    preds, uncs = chemprop.train.make_predictions(
-        args=model.predict_args,
-        smiles=[[smi] for smi in smiles],
-        model_objects=model.model_objects,
-        return_invalid_smiles=True,
-        return_index_dict=True,
-        return_uncertainty=True,
-    )
-    # Returns format (molidx: [avg_endpoint1, avg_endpoint2, ...]) If invalid, returens ['Invalid SMILES']
-    # Preds = {0: [3.3227710232816094], 1: [2.9169101045436707], 2: [3.6473884211186487], 3: [1.9292660002520876], 4: [3.1925854582522613]}
-    # Uncs = {0: array([nan]), 1: array([nan]), 2: array([nan]), 3: array([nan]), 4: array([nan])}
-    results = []
-    for i, smi in enumerate(smiles):
-        r = {"smiles": smi}
-        r.update(
-            {
-                f"pred{pi+1}": 0.0 if p == "Invalid SMILES" else p
-                for pi, p in enumerate(preds[i])
-            }
-        )
-        r.update(
-            {
-                "mean_pred": np.mean([p for p in preds[i] if p != "Invalid SMILES"]),
-                "max_pred": np.max([p for p in preds[i] if p != "Invalid SMILES"]),
-                "min_pred": np.min([p for p in preds[i] if p != "Invalid SMILES"]),
-            }
-        )
-        r.update(
-            {
-                f"unc{ui+1}": 0.0 if u == "Invalid SMILES" else u
-                for ui, u in enumerate(uncs[i])
-            }
-        )
-        r.update(
-            {
-                "mean_unc": np.mean([u for u in uncs[i] if u != "Invalid SMILES"]),
-                "max_unc": np.max([u for u in uncs[i] if u != "Invalid SMILES"]),
-                "min_unc": np.min([u for u in uncs[i] if u != "Invalid SMILES"]),
-            }
-        )
-        results.append(r)
-
-    return jsonify(results)
-
-
-def get_args():
+    # Make predictions, arrays of shape (SMILES, tasks)
+    preds, uncs = model.predict(smiles)
+    invalid = np.isnan(preds).all(axis=1, keepdims=True)
+
+    # Aggregate per column, invalid SMILES return 0.0 per task and NaN aggregates
+    columns = {}
+    for pi in range(preds.shape[1]):
+        columns[f"pred{pi+1}"] = np.where(invalid[:, 0], 0.0, preds[:, pi])
+    columns["mean_pred"] = preds.mean(axis=1)
+    columns["max_pred"] = preds.max(axis=1)
+    columns["min_pred"] = preds.min(axis=1)
+    for ui in range(uncs.shape[1]):
+        columns[f"unc{ui+1}"] = np.where(invalid[:, 0], 0.0, uncs[:, ui])
+    columns["mean_unc"] = uncs.mean(axis=1)
+    columns["max_unc"] = uncs.max(axis=1)
+    columns["min_unc"] = uncs.min(axis=1)
+
+    return columns_to_records(smiles, columns)
+
+
+def get_parser():
     parser = argparse.ArgumentParser(description="Run a scoring function server")
-    parser.add_argument("--port", type=int, default=8000, help="Port to run server on")
+    add_server_args(parser)
     parser.add_argument(
         "--model_dir", type=str, help="Path to pre-trained model (e.g., clf.pkl)"
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=50,
+        help="Number of molecules per forward pass",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=0,
+        help="Number of data loader workers, 0 is usually fastest for CPU inference",
+    )
+    parser.add_argument(
+        "--graph_cache_size",
+        type=int,
+        default=100000,
+        help="Number of featurized molecules kept in memory, by canonical SMILES",
+    )
+    return parser
 
 
 if __name__ == "__main__":
-    args = get_args()
-    model = Model(**args.__dict__)
-    app.run(port=args.port)
+    serve(predict, get_parser(), name="chemprop", load=Model)
@@ -4,7 +4,7 @@ import os
 import pickle as pkl
 
 import numpy as np
-from flask import Flask, jsonify, request
+from model_server import add_server_args, serve
 from utils import Fingerprints
 
 logger = logging.getLogger("legacy_qsar_server")
@@ -14,8 +14,6 @@ ch = logging.StreamHandler()
 ch.setLevel(logging.INFO)
 logger.addHandler(ch)
 
-app = Flask(__name__)
-
 
 class LegacyQSAR:
     """
@@ -35,11 +33,7 @@ class LegacyQSAR:
         self.nBits = nBits
 
 
-@app.route("/", methods=["POST"])
-def compute():
-    # Get smiles from request
-    logger.debug("POST request received")
-    smiles = request.get_json().get("smiles", [])
+def predict(model, smiles: list) -> list:
     results = [{"smiles": smi, "pred_proba": 0.0} for smi in smiles]
     # Compute fingerprints
     fps = [
@@ -57,12 +51,12 @@ def compute():
         y_probs = []
     for i, prob in zip(valid, y_probs):
         results[i].update({"pred_proba": float(prob)})
-    return jsonify(results)
+    return results
 
 
-def get_args():
+def get_parser():
     parser = argparse.ArgumentParser(description="Run a scoring function server")
-    parser.add_argument("--port", type=int, default=8000, help="Port to run server on")
+    add_server_args(parser)
     parser.add_argument(
         "--model_path", type=str, help="Path to pre-trained model (e.g., clf.pkl)"
     )
@@ -70,10 +64,8 @@ def get_args():
     parser.add_argument(
         "--nBits", type=int, default=2048, help="Number of bits for fingerprint"
     )
-    return parser.parse_args()
+    return parser
 
 
 if __name__ == "__main__":
-    args = get_args()
-    model = LegacyQSAR(**args.__dict__)
-    app.run(port=args.port)
+    serve(predict, get_parser(), name="legacy_qsar", load=LegacyQSAR)
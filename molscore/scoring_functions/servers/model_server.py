@@ -0,0 +1,702 @@
+"""
+Shared runtime for model servers (see base.py for a template). A server defines a function that
+ predicts a list of SMILES and returns one dictionary per SMILES, which ModelServer serves on POST / with:
+  - Several named models hosted by one process on POST /model/<name>, declared at launch (--models) or loaded by
+    arguments on POST /load (by each worker), models with the same arguments are only loaded once
+  - A multi-threaded server, optionally with several pre-forked worker processes sharing the port and model memory
+  - Micro-batching, concurrent requests arriving within batch_window seconds are merged into one model call
+  - Backpressure, requests wait while more than max_pending SMILES are queued and are rejected (503) after queue_timeout
+  - An LRU cache of predictions keyed by canonical SMILES and model parameters, optionally persisted to SQLite so that
+    it's shared between workers and server restarts, with hit/miss counts on GET /stats
+  - Request counts, batch sizes, queue wait and model latency percentiles, cache hit rates and memory on GET /metrics,
+    with the queue wait and model time of each request in its X-Queue-Time and X-Model-Time response headers
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from functools import partial
+from typing import Callable
+
+import numpy as np
+from flask import Flask, Response, jsonify, request
+from protocol import get_payload, kwargs_to_args, respond
+
+try:
+    from utils import canonize_smiles
+except ImportError:  # RDKit isn't installed in this environment, cache by SMILES as is
+    canonize_smiles = None
+
+logger = logging.getLogger("model_server")
+formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+logger.setLevel(logging.DEBUG)
+ch = logging.StreamHandler()
+ch.setLevel(logging.INFO)
+logger.addHandler(ch)
+
+
+class ServerBusy(Exception):
+    pass
+
+
+class PredictionCache:
+    """LRU cache of predictions (without SMILES) per canonical SMILES, optionally backed by an SQLite file"""
+
+    def __init__(self, model_key: str, maxsize: int = 10000, path: str = None):
+        """
+        :param model_key: Identity of the model and its parameters, so that a persisted cache can be shared
+        :param maxsize: Maximum number of predictions kept in memory
+        :param path: Path to an SQLite file to persist predictions to (unbounded)
+        """
+        self.model_key = model_key
+        self.maxsize = maxsize
+        self.path = os.path.abspath(path) if path else None
+        self.hits = 0
+        self.misses = 0
+        self._lru = OrderedDict()
+        self._db = None
+
+    @property
+    def db(self):
+        # Connect lazily, so that each worker process has its own connection
+        if (self._db is None) and self.path:
+            self._db = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS predictions "
+                "(model TEXT, smiles TEXT, value TEXT, PRIMARY KEY (model, smiles))"
+            )
+            self._db.commit()
+        return self._db
+
+    @staticmethod
+    def key(smiles: str) -> str:
+        return canonize_smiles(smiles) if canonize_smiles else smiles
+
+    def _remember(self, key: str, value: dict):
+        self._lru[key] = value
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+
+    def get_many(self, keys: list) -> dict:
+        """
+        Look up predictions in memory, then in the SQLite file
+        :param keys: Canonical SMILES
+        :return: Dictionary of canonical SMILES to prediction for those found
+        """
+        found = {}
+        for key in keys:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                found[key] = self._lru[key]
+        missing = list({key: None for key in keys if key not in found})
+        if missing and (self.db is not None):
+            for i in range(0, len(missing), 500):
+                chunk = missing[i : i + 500]
+                rows = self.db.execute(
+                    "SELECT smiles, value FROM predictions WHERE model = ? "
+                    f"AND smiles IN ({','.join('?' * len(chunk))})",
+                    [self.model_key, *chunk],
+                )
+                for key, value in rows:
+                    found[key] = json.loads(value)
+                    self._remember(key, found[key])
+        n_hits = sum(key in found for key in keys)
+        self.hits += n_hits
+        self.misses += len(keys) - n_hits
+        return found
+
+    def put_many(self, predictions: dict):
+        """
+        :param predictions: Dictionary of canonical SMILES to prediction
+        """
+        for key, value in predictions.items():
+            self._remember(key, value)
+        if predictions and (self.db is not None):
+            self.db.executemany(
+                "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?)",
+                [
+                    (self.model_key, key, json.dumps(value, default=_json_default))
+                    for key, value in predictions.items()
+                ],
+            )
+            self.db.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._lru),
+            "maxsize": self.maxsize,
+            "path": self.path,
+        }
+
+
+class Metrics:
+    """Request counts, batch sizes and latencies of a hosted model, with percentiles over recent samples"""
+
+    def __init__(self, window: int = 1000):
+        """
+        :param window: Number of recent samples to compute percentiles over
+        """
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.smiles = 0
+        self.batches = 0
+        self.errors = 0
+        self.batch_sizes = {}  # Upper bound (power of 2) to number of batches
+        self.queue_wait = deque(maxlen=window)  # Seconds per request
+        self.model_latency = deque(maxlen=window)  # Seconds per model call
+
+    def record_batch(self, n_smiles: int, queue_waits: list, error: bool = False):
+        with self._lock:
+            self.requests += len(queue_waits)
+            self.smiles += n_smiles
+            self.batches += 1
+            self.errors += int(error)
+            size = str(1 << max(0, n_smiles - 1).bit_length())
+            self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+            self.queue_wait.extend(queue_waits)
+
+    def record_latency(self, seconds: float):
+        with self._lock:
+            self.model_latency.append(seconds)
+
+    @staticmethod
+    def percentiles(samples) -> dict:
+        if not samples:
+            return {}
+        p50, p90, p99 = np.percentile(list(samples), [50, 90, 99]).tolist()
+        return {"p50": p50, "p90": p90, "p99": p99, "max": max(samples)}
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "smiles": self.smiles,
+                "batches": self.batches,
+                "errors": self.errors,
+                "batch_size_histogram": dict(
+                    sorted(self.batch_sizes.items(), key=lambda x: int(x[0]))
+                ),
+                "queue_wait": self.percentiles(self.queue_wait),
+                "model_latency": self.percentiles(self.model_latency),
+            }
+
+
+def memory_usage() -> dict:
+    """Resident memory of this process in MB, current (Linux only) and peak"""
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    memory = {"peak_rss_mb": peak / (1024**2 if sys.platform == "darwin" else 1024)}
+    try:
+        with open("/proc/self/statm", "rt") as f:
+            pages = int(f.read().split()[1])
+        memory["rss_mb"] = pages * os.sysconf("SC_PAGE_SIZE") / 1024**2
+    except (OSError, ValueError):
+        pass
+    return memory
+
+
+def _json_default(obj):
+    # NumPy scalars returned by predict functions
+    if hasattr(obj, "item"):
+        return obj.item()
+    raise TypeError(f"{type(obj)} is not JSON serializable")
+
+
+def model_key(name: str, args: argparse.Namespace) -> str:
+    """Identify a model by the server name and arguments, excluding those that don't affect predictions"""
+    parameters = {k: v for k, v in sorted(vars(args).items()) if k not in RUNTIME_ARGS}
+    parameters = json.dumps(parameters, sort_keys=True, default=str)
+    return f"{name}:{hashlib.sha1(parameters.encode()).hexdigest()}"
+
+
+class HostedModel:
+    """A predict function with its own micro-batching queue, backpressure and cache"""
+
+    def __init__(
+        self,
+        predict: Callable,
+        name: str = "model",
+        max_batch_size: int = 1024,
+        batch_window: float = 0.005,
+        max_pending: int = 100000,
+        queue_timeout: float = 30,
+        cache_size: int = 10000,
+        cache_path: str = None,
+        model_key: str = None,
+        **kwargs,
+    ):
+        """
+        :param predict: Function taking a list of SMILES and returning a list of dicts i.e. [{'smiles': smi, 'metric': 'value', ...}, ...]
+        :param name: Name of the model
+        :param max_batch_size: Maximum number of SMILES merged into one model call (larger requests are not split)
+        :param batch_window: Seconds to wait for other requests to merge with, 0 to disable micro-batching
+        :param max_pending: Maximum number of SMILES queued or being predicted before requests have to wait
+        :param queue_timeout: Seconds a request waits for the queue before being rejected with 503
+        :param cache_size: Number of predictions cached in memory, 0 to disable caching
+        :param cache_path: Path to an SQLite file to persist cached predictions to
+        :param model_key: Identity of the model and its parameters, by default the name
+        """
+        self.predict = predict
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._queue = deque()  # (smiles, future) per request
+        self._queued = 0  # Number of SMILES in the queue
+        self._pending = 0  # Number of SMILES queued or being predicted
+        self._batcher = None
+        self.metrics = Metrics()
+        self.cache = None
+        if cache_size or cache_path:
+            self.cache = PredictionCache(
+                model_key=model_key or name, maxsize=cache_size, path=cache_path
+            )
+
+    def submit(self, smiles: list) -> Future:
+        """
+        Queue SMILES to be predicted in the next batch
+        :param smiles: List of SMILES
+        :return: Future of list of dicts
+        """
+        future = Future()
+        with self._cond:
+            # Start the batcher lazily, so that it is started in each worker process after forking
+            if self._batcher is None:
+                self._batcher = threading.Thread(target=self._batch_loop, daemon=True)
+                self._batcher.start()
+            # Backpressure, but always accept a request if nothing is pending
+            deadline = time.monotonic() + self.queue_timeout
+            while (self._pending > 0) and (
+                self._pending + len(smiles) > self.max_pending
+            ):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ServerBusy(f"{self._pending} SMILES pending")
+                self._cond.wait(remaining)
+            self._pending += len(smiles)
+            self._queued += len(smiles)
+            self._queue.append((smiles, future, time.monotonic()))
+            self._cond.notify_all()
+        return future
+
+    def _next_batch(self) -> list:
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            # Wait for other requests within the latency window, unless the batch is already full
+            deadline = time.monotonic() + self.batch_window
+            while self._queued < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = []
+            n = 0
+            while self._queue and (
+                (n == 0) or (n + len(self._queue[0][0]) <= self.max_batch_size)
+            ):
+                smiles, future, submitted = self._queue.popleft()
+                future.queue_time = time.monotonic() - submitted
+                batch.append((smiles, future))
+                n += len(smiles)
+            self._queued -= n
+        return batch
+
+    def _batch_loop(self):
+        while True:
+            batch = self._next_batch()
+            smiles = [smi for s, _ in batch for smi in s]
+            start = time.monotonic()
+            error = False
+            try:
+                results = self._predict(smiles) if smiles else []
+                model_time = time.monotonic() - start
+                i = 0
+                for s, future in batch:
+                    future.model_time = model_time
+                    future.set_result(results[i : i + len(s)])
+                    i += len(s)
+            except Exception as e:
+                error = True
+                logger.error(f"Prediction failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+            finally:
+                self.metrics.record_batch(
+                    len(smiles), [future.queue_time for _, future in batch], error
+                )
+                with self._cond:
+                    self._pending -= len(smiles)
+                    self._cond.notify_all()
+
+    def _predict(self, smiles: list) -> list:
+        """Predict SMILES not found in the cache, each unique molecule once"""
+        if self.cache is None:
+            results = self._timed_predict(smiles)
+            self._check_results(results, smiles)
+            return results
+        keys = [self.cache.key(smi) for smi in smiles]
+        found = self.cache.get_many(keys)
+        # SMILES to predict, the first of each missing canonical SMILES
+        missing = {}
+        for smi, key in zip(smiles, keys):
+            if key not in found:
+                missing.setdefault(key, smi)
+        if missing:
+            preds = self._timed_predict(list(missing.values()))
+            self._check_results(preds, missing)
+            new = {
+                key: {k: v for k, v in r.items() if k != "smiles"}
+                for key, r in zip(missing.keys(), preds)
+            }
+            self.cache.put_many(new)
+            found.update(new)
+        return [{"smiles": smi, **found[key]} for smi, key in zip(smiles, keys)]
+
+    def _timed_predict(self, smiles: list) -> list:
+        start = time.monotonic()
+        results = self.predict(smiles)
+        self.metrics.record_latency(time.monotonic() - start)
+        return results
+
+    @staticmethod
+    def _check_results(results: list, smiles):
+        assert len(results) == len(
+            smiles
+        ), f"Predicted {len(results)} results for {len(smiles)} SMILES"
+
+    def stats(self) -> dict:
+        stats = {"pending": self._pending}
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        # Any statistics reported by the model itself
+        if hasattr(self.predict, "stats"):
+            stats["model"] = self.predict.stats()
+        return stats
+
+    def metrics_dict(self) -> dict:
+        metrics = self.metrics.to_dict()
+        metrics["pending"] = self._pending
+        if self.cache is not None:
+            cache = self.cache.stats()
+            metrics["cache"] = {
+                k: cache[k] for k in ["hits", "misses", "hit_rate", "size"]
+            }
+        return metrics
+
+
+class ModelServer:
+    """Serve one or more named models over HTTP"""
+
+    def __init__(
+        self,
+        predict: Callable = None,
+        name: str = "model",
+        parser: argparse.ArgumentParser = None,
+        load: Callable = None,
+        **kwargs,
+    ):
+        """
+        :param predict: Function taking a list of SMILES and returning a list of dicts, served as the default model
+        :param name: Name of the server and its default model served on POST /
+        :param parser: Argument parser of model arguments, needed to load models by arguments
+        :param load: Function taking parsed model arguments and returning a predict function
+        :param kwargs: Micro-batching and caching parameters of each model (see HostedModel)
+        """
+        self.name = name
+        self.parser = parser
+        self.load = load
+        self.options = kwargs
+        self.models = {}  # Name to model
+        self._loaded = {}  # Model key to model
+        self._load_lock = threading.Lock()
+        if predict is not None:
+            self.add_model(name, predict)
+        self.app = Flask(name)
+        self.app.add_url_rule("/", "compute", self.compute, methods=["POST"])
+        self.app.add_url_rule(
+            "/model/<name>", "compute_model", self.compute, methods=["POST"]
+        )
+        self.app.add_url_rule("/load", "load", self.load_endpoint, methods=["POST"])
+        self.app.add_url_rule("/models", "models", self.list_models, methods=["GET"])
+        self.app.add_url_rule("/stats", "stats", self.stats, methods=["GET"])
+        self.app.add_url_rule("/metrics", "metrics", self.metrics, methods=["GET"])
+        self.started = time.time()
+
+    def add_model(self, name: str, predict: Callable, model_key: str = None):
+        """
+        Host a predict function under a name, or alias a model already hosted with the same key
+        :param name: Name of the model
+        :param predict: Function taking a list of SMILES and returning a list of dicts
+        :param model_key: Identity of the model and its parameters, by default the name
+        """
+        model_key = model_key or name
+        if model_key not in self._loaded:
+            self._loaded[model_key] = HostedModel(
+                predict, name=name, model_key=model_key, **self.options
+            )
+        self.models[name] = self._loaded[model_key]
+        return self.models[name]
+
+    def load_model(self, name: str, args: list) -> str:
+        """
+        Load a model from command line arguments, as if the server was launched with them
+        :param name: Name of the model
+        :param args: Command line arguments e.g., ['--model_path', 'clf.pkl']
+        :return: Model key
+        """
+        if (self.parser is None) or (self.load is None):
+            raise ValueError(f"{self.name} server can't load models by arguments")
+        with self._load_lock:
+            try:
+                model_args = self.parser.parse_args(args)
+            except SystemExit:
+                raise ValueError(f"Invalid model arguments: {args}")
+            key = model_key(self.name, model_args)
+            if key not in self._loaded:
+                logger.info(f"Loading model {name}: {' '.join(args)}")
+                self.add_model(name, self.load(model_args), model_key=key)
+            else:
+                self.models[name] = self._loaded[key]
+        return key
+
+    def compute(self, name: str = None):
+        name = name or self.name
+        if name not in self.models:
+            return Response(f"Model {name} not loaded", status=404)
+        payload = get_payload(request)
+        smiles = payload.get("smiles", [])
+        try:
+            future = self.models[name].submit(smiles)
+        except ServerBusy as e:
+            return Response(
+                f"Server busy: {e}", status=503, headers={"Retry-After": "1"}
+            )
+        results = future.result()
+        response = respond(results, payload, request)
+        response.headers["X-Queue-Time"] = f"{future.queue_time:.6f}"
+        response.headers["X-Model-Time"] = f"{future.model_time:.6f}"
+        return response
+
+    def load_endpoint(self):
+        payload = get_payload(request)
+        try:
+            key = self.load_model(payload["name"], payload.get("args", []))
+        except (KeyError, ValueError) as e:
+            return Response(f"Failed to load model: {e}", status=400)
+        return jsonify({"name": payload["name"], "model_key": key})
+
+    def list_models(self):
+        return jsonify(list(self.models.keys()))
+
+    def stats(self):
+        return jsonify(
+            {
+                "name": self.name,
+                "pid": os.getpid(),
+                "models": {name: model.stats() for name, model in self.models.items()},
+            }
+        )
+
+    def metrics(self):
+        # Each worker process reports its own metrics
+        models = {}
+        for name, model in self.models.items():
+            models[name] = model.metrics_dict()
+        return jsonify(
+            {
+                "name": self.name,
+                "pid": os.getpid(),
+                "uptime": time.time() - self.started,
+                "memory": memory_usage(),
+                "models": models,
+            }
+        )
+
+    def run(
+        self,
+        port: int = 8000,
+        host: str = "localhost",
+        workers: int = 1,
+        unix_socket: str = None,
+        **kwargs,
+    ):
+        """
+        Run a multi-threaded server
+        :param port: Port to run server on
+        :param host: Host to run server on
+        :param workers: Number of worker processes, forked after the model is loaded so that memory is shared (Linux/macOS)
+        :param unix_socket: Path of a Unix domain socket to listen on instead of a port
+        """
+        from werkzeug.serving import make_server
+
+        address = unix_socket or f"{host}:{port}"
+        if unix_socket:
+            host = f"unix://{unix_socket}"
+
+        if (workers <= 1) or (not hasattr(os, "fork")):
+            logger.info(f"Serving {self.name} on {address}")
+            make_server(host, port, self.app, threaded=True).serve_forever()
+            return
+
+        # Pre-fork workers accepting connections from the same socket
+        if unix_socket:
+            if os.path.exists(unix_socket):
+                os.remove(unix_socket)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(unix_socket)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((host, port))
+        sock.listen(128)
+        sock.set_inheritable(True)
+        children = []
+        for _ in range(workers):
+            pid = os.fork()
+            if pid == 0:
+                make_server(
+                    host, port, self.app, threaded=True, fd=sock.fileno()
+                ).serve_forever()
+                os._exit(0)
+            children.append(pid)
+        logger.info(f"Serving {self.name} on {address} with {workers} workers")
+
+        def terminate(signum, frame):
+            for pid in children:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            sys.exit(0)
+
+        signal.signal(signal.SIGTERM, terminate)
+        signal.signal(signal.SIGINT, terminate)
+        for pid in children:
+            os.waitpid(pid, 0)
+
+
+# Arguments of the runtime rather than the model
+RUNTIME_ARGS = [
+    "port",
+    "unix_socket",
+    "workers",
+    "max_batch_size",
+    "batch_window",
+    "max_pending",
+    "queue_timeout",
+    "cache_size",
+    "cache_path",
+    "models",
+    "n_jobs",
+]
+
+
+def add_server_args(parser: argparse.ArgumentParser):
+    """Add ModelServer arguments to a server's argument parser"""
+    parser.add_argument("--port", type=int, default=8000, help="Port to run server on")
+    parser.add_argument(
+        "--unix_socket",
+        type=str,
+        default=None,
+        help="Path of a Unix domain socket to listen on instead of a port",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes"
+    )
+    parser.add_argument(
+        "--max_batch_size",
+        type=int,
+        default=1024,
+        help="Maximum number of SMILES per model call",
+    )
+    parser.add_argument(
+        "--batch_window",
+        type=float,
+        default=0.005,
+        help="Seconds to wait for concurrent requests to merge into one model call",
+    )
+    parser.add_argument(
+        "--max_pending",
+        type=int,
+        default=100000,
+        help="Maximum number of SMILES pending before requests wait",
+    )
+    parser.add_argument(
+        "--queue_timeout",
+        type=float,
+        default=30,
+        help="Seconds a request waits before being rejected as busy",
+    )
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=10000,
+        help="Number of predictions cached in memory per worker, 0 to disable",
+    )
+    parser.add_argument(
+        "--cache_path",
+        type=str,
+        default=None,
+        help="SQLite file to persist cached predictions to, shared between workers",
+    )
+    parser.add_argument(
+        "--models",
+        type=str,
+        default=None,
+        help="JSON file of additional models to host by name e.g., {name: {argument: value}}",
+    )
+    return parser
+
+
+def serve(
+    predict: Callable,
+    parser: argparse.ArgumentParser,
+    name: str = "model",
+    load: Callable = None,
+):
+    """
+    Parse arguments, load the default model and any declared with --models, and run a ModelServer
+    :param predict: Function predicting a list of SMILES, called as predict(model, smiles) if load is provided
+    :param parser: Argument parser including add_server_args
+    :param name: Name of the server and its default model
+    :param load: Function loading a model from keyword arguments e.g., a Model class, any model.stats() are reported on GET /stats
+    """
+    args = parser.parse_args()
+
+    def load_predict(model_args):
+        if load is None:
+            return predict
+        model = load(**vars(model_args))
+        model_predict = partial(predict, model)
+        if hasattr(model, "stats"):
+            model_predict.stats = model.stats
+        return model_predict
+
+    server = ModelServer(name=name, parser=parser, load=load_predict, **vars(args))
+    server.load_model(name, sys.argv[1:])
+    if args.models:
+        with open(args.models, "rt") as f:
+            for model_name, kwargs in json.load(f).items():
+                server.load_model(model_name, kwargs_to_args(kwargs))
+    server.run(**vars(args))
@@ -1,7 +1,7 @@
 import argparse
 import logging
 
-from flask import Flask, jsonify, request
+from model_server import add_server_args, serve
 from molskill.scorer import MolSkillScorer
 from utils import get_mol
 
@@ -12,8 +12,6 @@ ch = logging.StreamHandler()
 ch.setLevel(logging.INFO)
 logger.addHandler(ch)
 
-app = Flask(__name__)
-
 
 class Model:
     """
@@ -25,11 +23,7 @@ class Model:
         self.scorer = MolSkillScorer(num_workers=0)
 
 
-@app.route("/", methods=["POST"])
-def compute():
-    # Get smiles from request
-    smiles = request.get_json().get("smiles", [])
-
+def predict(model, smiles: list) -> list:
     # Handle invalid as this is not handled by MolSkill
     valids = []
     for i, smi in enumerate(smiles):
@@ -45,17 +39,15 @@ def compute():
         results[i].update({"score": float(score)})
 
     # Return results
-    return jsonify(results)
+    return results
 
 
-def get_args():
+def get_parser():
     parser = argparse.ArgumentParser(description="Run a scoring function server")
-    parser.add_argument("--port", type=int, default=8000, help="Port to run server on")
+    add_server_args(parser)
     # TODO Add more arguments here
-    return parser.parse_args()
+    return parser
 
 
 if __name__ == "__main__":
-    args = get_args()
-    model = Model(**args.__dict__)
-    app.run(port=args.port)
+    serve(predict, get_parser(), name="molskill", load=Model)
@@ -1,15 +1,13 @@
 import argparse
-import gzip
-import json
 import logging
-import pickle as pkl
 import re
-import zipfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 import numpy as np
-from flask import Flask, jsonify, request
-from pidgin_utils import Zenodo
+from model_server import add_server_args, serve
+from pidgin_utils import ModelStore, Zenodo
 from utils import Fingerprints, Pool
 
 logger = logging.getLogger("pidgin_server")
@@ -20,9 +18,6 @@ ch.setLevel(logging.INFO)
 logger.addHandler(ch)
 
 
-app = Flask(__name__)
-
-
 class Model:
     """
     Create a Model object that loads models once, for example.
@@ -52,34 +47,37 @@ class Model:
         self.ghost_thresholds = []
         self.models = []
         self.model_names = []
+        self.timings = {}  # Model name to total prediction time and number of SMILES
+        self._pool = None
+        self._threads = None
 
-        # Load models
+        # Load models, memory-mapped from a store converted once from the archive
         pidgin_path = self.zenodo.download(
             record_id=self.pidgin_record_id, name="trained_models.zip"
         )
-        with zipfile.ZipFile(pidgin_path, "r") as zip_file:
-            for uni in self.uniprots:
-                try:
-                    # Load .json to get ghost thresh
-                    with zip_file.open(f"{uni}.json") as meta_file:
-                        metadata = json.load(meta_file)
-                        # reformart thresh back
-                        opt_thresh = metadata[self.full_thresh]["train"]["params"][
-                            "opt_threshold"
-                        ]
-                        self.ghost_thresholds.append(opt_thresh)
-                    # Load classifier
-                    with zip_file.open(f"{uni}_{self.thresh}.pkl.gz") as model_file:
-                        with gzip.open(model_file, "rb") as f:
-                            clf = pkl.load(f)
-                            self.models.append(clf)
-                            self.model_names.append(f"{uni}@{self.thresh}")
-                except (FileNotFoundError, KeyError):
-                    logger.warning(f"{uni} model at {thresh} not found, omitting")
-                    continue
+        store = ModelStore(pidgin_path)
+        missing = [
+            uni
+            for uni in self.uniprots
+            if not store.converted(uni, self.thresh, self.full_thresh)
+        ]
+        if missing:
+            store.convert(missing, self.thresh)
+        for uni in self.uniprots:
+            try:
+                opt_thresh, clf = store.load(uni, self.thresh, self.full_thresh)
+            except (FileNotFoundError, KeyError):
+                logger.warning(f"{uni} model at {thresh} not found, omitting")
+                continue
+            # Models are predicted concurrently instead
+            if hasattr(clf, "n_jobs"):
+                clf.n_jobs = 1
+            self.ghost_thresholds.append(opt_thresh)
+            self.models.append(clf)
+            self.model_names.append(f"{uni}@{self.thresh}")
 
         # Run some checks
-        if len(self.models) != 0:
+        if len(self.models) == 0:
             logger.warning("No models were found")
         if self.binarise:
             logger.info("Running with binarise=True so setting method=mean")
@@ -88,43 +86,91 @@ class Model:
                 self.models
             ), "Mismatch between models and thresholds"
 
-
-@app.route("/", methods=["POST"])
-def compute():
-    # Get smiles from request
-    smiles = request.get_json().get("smiles", [])
-
+    @property
+    def pool(self):
+        # Created on first use, so that it belongs to the process serving requests (i.e., after forking workers)
+        if (self._pool is None) and (self.n_jobs > 1):
+            self._pool = Pool(self.n_jobs)
+        return self._pool
+
+    @property
+    def threads(self):
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(max_workers=max(1, self.n_jobs))
+        return self._threads
+
+    def fingerprints(self, smiles: list):
+        """
+        Calculate fingerprints as one matrix in float32, which classifiers predict on without copying
+        :return: (Indexes of valid SMILES, fingerprint matrix of valid SMILES)
+        """
+        pcalculate_fp = partial(
+            Fingerprints.get, name=self.fp, nBits=self.nBits, asarray=True
+        )
+        if self.pool is not None:
+            chunksize = max(1, len(smiles) // (self.n_jobs * 4))
+            fps = self.pool.imap(pcalculate_fp, smiles, chunksize=chunksize)
+        else:
+            fps = map(pcalculate_fp, smiles)
+        valid = []
+        X = np.empty((len(smiles), self.nBits), dtype=np.float32)
+        for i, fp in enumerate(fps):
+            if fp is not None:
+                X[len(valid)] = fp
+                valid.append(i)
+        return valid, X[: len(valid)]
+
+    def _predict_model(self, j: int, X: np.ndarray):
+        t0 = time.perf_counter()
+        prediction = self.models[j].predict_proba(X)[:, 1]
+        return prediction, time.perf_counter() - t0
+
+    def predict_proba(self, X: np.ndarray):
+        """
+        Predict with all classifiers concurrently
+        :param X: Fingerprint matrix (smiles, bits)
+        :return: Positive probabilities (smiles, models)
+        """
+        predictions = np.zeros((len(self.models), len(X)), dtype=np.float64)
+        for j, (prediction, t) in enumerate(
+            self.threads.map(partial(self._predict_model, X=X), range(len(self.models)))
+        ):
+            predictions[j] = prediction
+            timing = self.timings.setdefault(self.model_names[j], [0.0, 0])
+            timing[0] += t
+            timing[1] += len(X)
+        return predictions.transpose()
+
+    def stats(self):
+        """Total prediction time per model, slowest first"""
+        return {
+            name: {"seconds": round(t, 4), "smiles": n}
+            for name, (t, n) in sorted(
+                self.timings.items(), key=lambda x: x[1][0], reverse=True
+            )
+        }
+
+
+def predict(model, smiles: list) -> list:
     results = [{"smiles": smi, "pred_proba": 0.0} for smi in smiles]
-    valid = []
-    fps = []
-    predictions = []
     aggregated_predictions = []
 
     # Calculate fingerprints
-    with Pool(model.n_jobs) as pool:
-        pcalculate_fp = partial(
-            Fingerprints.get, name=model.fp, nBits=model.nBits, asarray=True
-        )
-        [
-            (valid.append(i), fps.append(fp))
-            for i, fp in enumerate(pool.imap(pcalculate_fp, smiles))
-            if fp is not None
-        ]
+    valid, fps = model.fingerprints(smiles)
 
     # Return early if there's no results
     if len(fps) == 0:
         for r in results:
             r.update({"{name}": 0.0 for name in model.model_names})
             r.update({"pred_proba": 0.0})
-        return jsonify(results)
+        return results
 
     # Predict
-    for clf in model.models:
-        prediction = clf.predict_proba(np.asarray(fps).reshape(len(fps), -1))[
-            :, 1
-        ]  # Input (smiles, bits)
-        predictions.append(prediction)
-    predictions = np.asarray(predictions).transpose()  # Reshape to (smiles, models)
+    t0 = time.perf_counter()
+    predictions = model.predict_proba(fps)  # Shape (smiles, models)
+    logger.debug(
+        f"Predicted {len(fps)} SMILES with {len(model.models)} models in {time.perf_counter() - t0:.2f}s"
+    )
 
     # Binarise
     if model.binarise:
@@ -136,24 +182,21 @@ def compute():
         for j, name in enumerate(model.model_names):
             results[i].update({f"{name}": float(row[j])})
 
-    # Aggregate
-    try:
+    # Aggregate, if any models exist
+    if len(model.models):
         aggregated_predictions = model.agg(predictions, axis=1)
-    except np.AxisError:
-        # If no models exist and cannot be aggregated
-        aggregated_predictions = []
 
     # Update results
     for i, prob in zip(valid, aggregated_predictions):
         results[i].update({"pred_proba": float(prob)})
 
     # Return results
-    return jsonify(results)
+    return results
 
 
-def get_args():
+def get_parser():
     parser = argparse.ArgumentParser(description="Run a scoring function server")
-    parser.add_argument("--port", type=int, default=8000, help="Port to run server on")
+    add_server_args(parser)
     parser.add_argument(
         "--thresh",
         type=str,
@@ -173,10 +216,8 @@ def get_args():
         action="store_true",
         help="Binarise predicted probability and return ratio of actives based on optimal predictive thresholds (GHOST)",
     )
-    return parser.parse_args()
+    return parser
 
 
 if __name__ == "__main__":
-    args = get_args()
-    model = Model(**args.__dict__)
-    app.run(port=args.port, debug=False)
+    serve(predict, get_parser(), name="pidgin", load=Model)
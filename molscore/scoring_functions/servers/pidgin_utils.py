@@ -1,7 +1,13 @@
+import argparse
+import gzip
+import json
 import os
+import pickle as pkl
+import zipfile
 from pathlib import Path
 from typing import Callable, Sequence, Union
 
+import joblib
 import pystow
 from zenodo_client import Zenodo as ZenodoBase
 
@@ -93,3 +99,144 @@ class Zenodo(ZenodoBase):
         elif callable(parts):
             parts = parts(concept_record_id, str(record_id), version)
         return pystow.ensure(*parts, name=name, url=url, force=force)
+
+
+class ModelStore:
+    """
+    PIDGIN models extracted from trained_models.zip, converted once per UniProt into uncompressed joblib files that
+     later launches memory-map instead of decompressing and unpickling from the archive. GHOST thresholds of converted
+     UniProts are kept in a JSON index, and files are written atomically so concurrent servers can share the store.
+    """
+
+    def __init__(self, zip_path: os.PathLike, store_dir: os.PathLike = None):
+        """
+        :param zip_path: Path to trained_models.zip
+        :param store_dir: Directory of the store, by default next to the archive
+        """
+        self.zip_path = str(zip_path)
+        self.directory = str(
+            store_dir or os.path.join(os.path.dirname(self.zip_path), "trained_models")
+        )
+        self.index_path = os.path.join(self.directory, "index.json")
+        os.makedirs(self.directory, exist_ok=True)
+        self.index = self._read_index()
+
+    def _read_index(self) -> dict:
+        try:
+            with open(self.index_path, "rt") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _update_index(self, thresholds: dict):
+        import fcntl
+
+        with open(self.index_path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                index = self._read_index()
+                index.update(thresholds)
+                tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wt") as f:
+                    json.dump(index, f)
+                os.replace(tmp_path, self.index_path)
+                self.index = index
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def model_path(self, uniprot: str, thresh: str) -> str:
+        return os.path.join(self.directory, f"{uniprot}_{thresh}.joblib")
+
+    def converted(self, uniprot: str, thresh: str, full_thresh: str) -> bool:
+        """Whether a model is in the store, or known not to be in the archive"""
+        if uniprot not in self.index:
+            return False
+        if full_thresh not in self.index[uniprot]:
+            return True
+        return os.path.exists(self.model_path(uniprot, thresh))
+
+    def convert(self, uniprots: list = None, thresh: str = None):
+        """
+        Convert models from the archive that aren't in the store yet
+        :param uniprots: UniProts to convert, by default all in the archive
+        :param thresh: Concentration threshold to convert e.g., 10uM, by default all
+        """
+        thresholds = {}
+        with zipfile.ZipFile(self.zip_path, "r") as zip_file:
+            members = set(zip_file.namelist())
+            if uniprots is None:
+                uniprots = sorted(m[:-5] for m in members if m.endswith(".json"))
+            for uni in uniprots:
+                # GHOST thresholds for each concentration threshold
+                if uni not in self.index:
+                    thresholds[uni] = {}
+                    if f"{uni}.json" in members:
+                        with zip_file.open(f"{uni}.json") as meta_file:
+                            metadata = json.load(meta_file)
+                        for full_thresh, meta in metadata.items():
+                            try:
+                                thresholds[uni][full_thresh] = meta["train"]["params"][
+                                    "opt_threshold"
+                                ]
+                            except (KeyError, TypeError):
+                                continue
+                # Classifiers
+                for member in members:
+                    if not (
+                        member.startswith(f"{uni}_") and member.endswith(".pkl.gz")
+                    ):
+                        continue
+                    member_thresh = member[len(uni) + 1 : -len(".pkl.gz")]
+                    if (thresh is not None) and (member_thresh != thresh):
+                        continue
+                    path = self.model_path(uni, member_thresh)
+                    if os.path.exists(path):
+                        continue
+                    with zip_file.open(member) as model_file:
+                        with gzip.open(model_file, "rb") as f:
+                            clf = pkl.load(f)
+                    tmp_path = f"{path}.{os.getpid()}.tmp"
+                    joblib.dump(clf, tmp_path)
+                    os.replace(tmp_path, path)
+        if thresholds:
+            self._update_index(thresholds)
+
+    def load(self, uniprot: str, thresh: str, full_thresh: str):
+        """
+        Load a classifier memory-mapped from the store (copy-on-write), converting it first if necessary
+        :param uniprot: UniProt
+        :param thresh: Concentration threshold e.g., 10uM
+        :param full_thresh: Concentration threshold as in the metadata e.g., 10 uM
+        :return: (GHOST threshold, classifier), raises KeyError or FileNotFoundError if not available
+        """
+        if not self.converted(uniprot, thresh, full_thresh):
+            self.convert([uniprot], thresh)
+        opt_thresh = self.index[uniprot][full_thresh]
+        clf = joblib.load(self.model_path(uniprot, thresh), mmap_mode="c")
+        return opt_thresh, clf
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert PIDGIN models into a memory-mappable model store"
+    )
+    parser.add_argument("zip_path", type=str, help="Path to trained_models.zip")
+    parser.add_argument(
+        "--store_dir", type=str, default=None, help="Directory of the store"
+    )
+    parser.add_argument(
+        "--uniprots",
+        nargs="+",
+        default=None,
+        help="UniProts to convert, by default all",
+    )
+    parser.add_argument(
+        "--thresh",
+        type=str,
+        default=None,
+        help="Concentration threshold to convert, by default all",
+    )
+    args = parser.parse_args()
+    ModelStore(args.zip_path, store_dir=args.store_dir).convert(
+        args.uniprots, args.thresh
+    )
@@ -0,0 +1,105 @@
+"""
+Request/response encoding shared by the model servers and BaseServerSF. The default contract is a JSON request
+ {"smiles": [...]} and a JSON response with one dictionary per SMILES. Optionally, clients can gzip the request
+ (Content-Encoding: gzip), in which case the response is also gzipped, and request {"format": "columnar"} to receive
+ NumPy arrays per metric in SMILES order (.npz) instead. This module should only depend on the standard library,
+ NumPy and Flask so that it can be imported by any server environment.
+"""
+
+import gzip
+import io
+import json
+import shlex
+
+import numpy as np
+
+COLUMNAR_MIMETYPE = "application/x-npz"
+
+
+def encode_columnar(results: list):
+    """
+    Encode a list of dicts as an .npz of SMILES, metric names and one array per metric
+    :param results: List of dicts i.e. [{'smiles': smi, 'metric': 'value', ...}, ...]
+    :return: Bytes or None if any metric can't be represented as a numeric, boolean or string array
+    """
+    names = []
+    for r in results:
+        names.extend(k for k in r.keys() if (k != "smiles") and (k not in names))
+    arrays = {
+        "smiles": np.asarray([r["smiles"] for r in results], dtype=str),
+        "names": np.asarray(names, dtype=str),
+    }
+    for i, name in enumerate(names):
+        records = [r.get(name, np.nan) for r in results]
+        try:
+            values = np.asarray(records)
+        except ValueError:
+            return None
+        if values.dtype.kind not in "biufU":
+            return None
+        # Missing or numeric values would be coerced to strings e.g., 'nan'
+        if (values.dtype.kind == "U") and not all(isinstance(v, str) for v in records):
+            return None
+        arrays[f"c{i}"] = values
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def decode_columnar(content: bytes):
+    """
+    Decode an .npz encoded by encode_columnar
+    :return: (List of SMILES, dictionary of metric name to array)
+    """
+    with np.load(io.BytesIO(content), allow_pickle=False) as data:
+        smiles = data["smiles"].tolist()
+        columns = {name: data[f"c{i}"] for i, name in enumerate(data["names"].tolist())}
+    return smiles, columns
+
+
+def columns_to_records(smiles: list, columns: dict) -> list:
+    """
+    Convert metric arrays in SMILES order to a list of dicts, as returned by predict functions
+    :param smiles: List of SMILES
+    :param columns: Dictionary of metric name to array
+    :return: List of dicts i.e. [{'smiles': smi, 'metric': 'value', ...}, ...]
+    """
+    names = list(columns.keys())
+    values = [np.asarray(columns[name]).tolist() for name in names]
+    rows = zip(*values) if values else [()] * len(smiles)
+    return [{"smiles": smi, **dict(zip(names, row))} for smi, row in zip(smiles, rows)]
+
+
+def kwargs_to_args(kwargs: dict) -> list:
+    """Convert server keyword arguments to command line arguments, as when launching a server with them"""
+    return shlex.split(" ".join([f"--{k} {v}" for k, v in kwargs.items()]))
+
+
+def get_payload(request) -> dict:
+    """Read the JSON payload of a Flask request, decompressing it if gzipped"""
+    if request.headers.get("Content-Encoding") == "gzip":
+        return json.loads(gzip.decompress(request.get_data()))
+    return request.get_json()
+
+
+def respond(results: list, payload: dict, request):
+    """
+    Create a Flask response in the format requested by the client
+    :param results: List of dicts i.e. [{'smiles': smi, 'metric': 'value', ...}, ...]
+    :param payload: Request payload
+    :param request: Flask request
+    """
+    from flask import Response, jsonify
+
+    response = None
+    if payload.get("format") == "columnar":
+        content = encode_columnar(results)
+        if content is not None:
+            response = Response(content, mimetype=COLUMNAR_MIMETYPE)
+    if response is None:
+        response = jsonify(results)
+    # Compress the response if the client compressed the request
+    if request.headers.get("Content-Encoding") == "gzip":
+        response.set_data(gzip.compress(response.get_data(), compresslevel=1))
+        response.headers["Content-Encoding"] = "gzip"
+    return response
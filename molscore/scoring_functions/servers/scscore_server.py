@@ -2,7 +2,7 @@ import argparse
 import logging
 import os
 
-from flask import Flask, jsonify, request
+from model_server import add_server_args, serve
 from scscore.standalone_model_numpy import SCScorer
 from utils import get_mol
 
@@ -13,8 +13,6 @@ ch = logging.StreamHandler()
 ch.setLevel(logging.INFO)
 logger.addHandler(ch)
 
-app = Flask(__name__)
-
 
 class Model:
     """
@@ -29,11 +27,7 @@ class Model:
         self.scorer.restore(model_path)  # todo: support other models
 
 
-@app.route("/", methods=["POST"])
-def compute():
-    # Get smiles from request
-    smiles = request.get_json().get("smiles", [])
-
+def predict(model, smiles: list) -> list:
     # Handle invalid as this is not handled by MolSkill
     valids = []
     for i, smi in enumerate(smiles):
@@ -49,22 +43,19 @@ def compute():
         results[i].update({"score": float(score)})
 
     # Return results
-    return jsonify(results)
+    return results
 
 
-def get_args():
+def get_parser():
     parser = argparse.ArgumentParser(description="Run a scoring function server")
-    parser.add_argument("--port", type=int, default=8000, help="Port to run server on")
+    add_server_args(parser)
     parser.add_argument(
         "--model_path",
         type=str,
         help="Path to pre-trained model",
     )
-    return parser.parse_args()
+    return parser
 
 
 if __name__ == "__main__":
-    args = get_args()
-    model = Model(**args.__dict__)
-    app.debug = False
-    app.run(port=args.port)
+    serve(predict, get_parser(), name="scscore", load=Model)
@@ -37,6 +37,39 @@ def get_mol(mol: Union[str, Chem.rdchem.Mol]):
     return mol
 
 
+def canonize_smiles(smiles: str):
+    """
+    Canonicalize SMILES
+    :param smiles: SMILES
+    :return: Canonical SMILES or the input if invalid
+    """
+    mol = get_mol(smiles)
+    if mol is None:
+        return smiles
+    return Chem.MolToSmiles(mol)
+
+
+def lru_touch(cache: dict, keys: list):
+    """
+    Mark keys of an insertion ordered dictionary as recently used, by moving them to the end
+    :param cache: Dictionary cache e.g., SMILES to featurized molecule
+    :param keys: Keys used
+    """
+    for key in keys:
+        if key in cache:
+            cache[key] = cache.pop(key)
+
+
+def lru_trim(cache: dict, maxsize: int):
+    """
+    Evict the least recently used keys of an insertion ordered dictionary (see lru_touch)
+    :param cache: Dictionary cache e.g., SMILES to featurized molecule
+    :param maxsize: Maximum number of keys to keep
+    """
+    while len(cache) > maxsize:
+        del cache[next(iter(cache))]
+
+
 def read_mol(mol_path: os.PathLike, i=0):
     if mol_path.endswith(".mol2") or mol_path.endswith(".mol"):
         mol = Chem.MolFromMolFile(mol_path, sanitize=False, strictParsing=False)
@@ -1,12 +1,17 @@
 import logging
 import os
 from collections import defaultdict
-from functools import partial
-from typing import Union
 
-from rdkit.Chem import AllChem as Chem
+import numpy as np
 
-from molscore.scoring_functions.utils import Pool, get_mol, read_smiles
+from moleval.metrics.bit_count_index import BitCountIndex
+from molscore.scoring_functions.base import ColumnarResults
+from molscore.scoring_functions.utils import (
+    Executor,
+    ReferenceCache,
+    get_mol,
+    read_smiles,
+)
 
 logger = logging.getLogger("silly_bits")
 formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
@@ -27,6 +32,7 @@ class SillyBits:
         reference_smiles: os.PathLike,
         radius: int = 2,
         n_jobs=1,
+        executor: dict = None,
         **kwargs,
     ):
         """
@@ -34,51 +40,48 @@ class SillyBits:
         :param reference_mols: List of SMILES or RDKit Mols
         :param radius: Morgan fingerprint radius
         :param n_jobs: Number of jobs for multiprocessing
+        :param executor: Executor parameters e.g., {"backend": "dask", "address": "tcp://..."}, default is based on n_jobs
         """
         self.prefix = prefix.replace(" ", "_")
-        self.count_dict = defaultdict(int)
         self.radius = radius
         self.n_jobs = n_jobs
-        # Load reference dataset
-        reference_mols = read_smiles(reference_smiles)
+        self.executor = Executor.from_config(executor, n_jobs=n_jobs)
+        # Load reference bit counts from cache, or compute them from the reference dataset
+        cache = ReferenceCache(reference_smiles, name="silly_bits", radius=2)
+        counts = cache.get(
+            ["bits", "counts"], self._count_reference_bits, smiles_path=reference_smiles
+        )
+        self.index = BitCountIndex(counts["bits"], counts["counts"], radius=2)
+
+    @property
+    def count_dict(self) -> defaultdict:
+        """Reference bit counts as a dictionary"""
+        return defaultdict(
+            int, zip(self.index.bits.tolist(), self.index.counts.tolist())
+        )
+
+    def _count_reference_bits(self, smiles_path: os.PathLike):
+        reference_mols = read_smiles(smiles_path)
         # Convert to mols from reference dataset and count fp bits
         logger.info("Pre-processing SillyBits reference dataset")
-        with Pool(self.n_jobs) as pool:
-            bit_counts = [bits for bits in pool.imap(self.count_bits, reference_mols)]
-        for count_dict in bit_counts:
-            for k, v in count_dict.items():
-                self.count_dict[k] += v
-
-    @staticmethod
-    def count_bits(mol):
-        count_dict = {}
-        mol = get_mol(mol)
-        if mol is not None:
-            fp = Chem.GetMorganFingerprint(mol, 2)
-            for k, v in fp.GetNonzeroElements().items():
-                count_dict[k] = v
-        return count_dict
+        index = BitCountIndex.from_mol_bits(
+            self.executor.map(self.mol_bits, reference_mols)
+        )
+        return {"bits": index.bits, "counts": index.counts}
 
     @staticmethod
-    def _score(mol: Union[str, Chem.rdchem.Mol], count_dict):
-        mol = get_mol(mol)
-        if mol is not None:
-            bi = {}
-            fp = Chem.GetMorganFingerprint(mol, 2, bitInfo=bi)
-            on_bits = fp.GetNonzeroElements().keys()
-            silly_bits = [bit for bit in on_bits if count_dict[bit] == 0]
-            score = len(silly_bits) / len(on_bits)
-            return score, silly_bits, bi
+    def mol_bits(mol):
+        return BitCountIndex.mol_bits(get_mol(mol))
 
-    def __call__(self, smiles, **kwargs):
-        results = []
-        with Pool(self.n_jobs) as pool:
-            pfunc = partial(self._score, count_dict=self.count_dict)
-            scores = [s for s in pool.imap(pfunc, smiles)]
-        for smi, score in zip(smiles, scores):
-            if score is not None:
-                results.append({"smiles": smi, f"{self.prefix}_silly_ratio": score[0]})
-            else:
-                # Going to provide one because invalid molecules are very silly
-                results.append({"smiles": smi, f"{self.prefix}_silly_ratio": 1.0})
-        return results
+    def __call__(self, smiles, columnar: bool = False, **kwargs):
+        # Fingerprints are computed by the executor, bits are looked up in the index for the whole batch
+        mol_bits = self.executor.map(self.mol_bits, smiles)
+        ratios = self.index.silly_ratios(mol_bits)
+        # Going to provide one because invalid molecules are very silly
+        ratios[np.isnan(ratios)] = 1.0
+        if columnar:
+            return ColumnarResults(smiles, {f"{self.prefix}_silly_ratio": ratios})
+        return [
+            {"smiles": smi, f"{self.prefix}_silly_ratio": ratio}
+            for smi, ratio in zip(smiles, ratios.tolist())
+        ]
@@ -6,13 +6,23 @@ from typing import Union
 import numpy as np
 from Levenshtein import distance as levenshtein
 
+try:
+    from rapidfuzz import process as rf_process
+    from rapidfuzz.distance import Levenshtein as rf_levenshtein
+except ImportError:
+    rf_process = None
+
+from molscore.scoring_functions.base import ColumnarResults, format_results
 from molscore.scoring_functions.utils import (
     Fingerprints,
-    Pool,
+    ReferenceCache,
     SimilarityMeasures,
+    TimeoutPool,
     canonize_smiles,
     get_mol,
+    pack_fps,
     timedFunc2,
+    unpack_fps,
 )
 
 logger = logging.getLogger("tanimoto")
@@ -52,7 +62,7 @@ class MolecularSimilarity:
         :param thresh: If provided check if similarity is above threshold, binarising the similarity coefficients
         :param method: 'mean' or 'max' ('max' is equiv. singler nearest neighbour) [mean, max]
         :param n_jobs: Number of python.multiprocessing jobs for multiprocessing
-        :param timeout: Timeout for the scoring to cease and return a score of 0.0
+        :param timeout: Timeout for the scoring to cease and return a score of 0.0 (per molecule if n_jobs > 1)
         :param kwargs:
         """
         self.prefix = prefix.replace(" ", "_")
@@ -64,6 +74,7 @@ class MolecularSimilarity:
         self.nBits = bits
         self.n_jobs = n_jobs
         self.timeout = timeout
+        self.pool = None  # Warm worker pool, started on first use
 
         # If file path provided, load smiles.
         if isinstance(ref_smiles, str):
@@ -75,19 +86,33 @@ class MolecularSimilarity:
             ), "None list or empty list provided"
             self.ref_smiles = ref_smiles
 
+        # Convert ref smiles to ref fps, loading from cache if a file path is provided
+        if isinstance(ref_smiles, str):
+            cache = ReferenceCache(ref_smiles, name="fps", fp=self.fp, nBits=self.nBits)
+            if cache.exists("fps", "n_bits"):
+                cached = cache.load("fps", "n_bits")
+                self.ref_fps = unpack_fps(cached["fps"], int(cached["n_bits"][0]))
+            else:
+                self.ref_fps = self._compute_ref_fps()
+                # Only bit vector fingerprints can be cached as a bit matrix
+                packed = pack_fps(self.ref_fps)
+                if packed is not None:
+                    cache.save(fps=packed[0], n_bits=np.asarray([packed[1]]))
+        else:
+            self.ref_fps = self._compute_ref_fps()
+
+    def _compute_ref_fps(self):
         # Convert ref smiles to mols
-        self.ref_mols = [
-            get_mol(smi) for smi in self.ref_smiles if get_mol(smi) is not None
-        ]
-        if len(self.ref_smiles) != len(self.ref_mols):
+        ref_mols = [get_mol(smi) for smi in self.ref_smiles]
+        ref_mols = [mol for mol in ref_mols if mol is not None]
+        if len(self.ref_smiles) != len(ref_mols):
             logger.warning(
-                f"{len(self.ref_mols)}/{len(ref_smiles)} query smiles converted to mol successfully"
+                f"{len(ref_mols)}/{len(self.ref_smiles)} query smiles converted to mol successfully"
             )
-
         # Convert ref mols to ref fps
-        self.ref_fps = [
+        return [
             Fingerprints.get(mol, self.fp, self.nBits, asarray=False)
-            for mol in self.ref_mols
+            for mol in ref_mols
         ]
 
     @staticmethod
@@ -137,10 +162,65 @@ class MolecularSimilarity:
 
         return result
 
-    def _score(self, smiles: list, **kwargs):
+    @staticmethod
+    def columns_from_matrix(
+        smiles: list,
+        valid: list,
+        sim_matrix: np.ndarray,
+        thresh: float,
+        method: str,
+        prefix: str,
+    ) -> ColumnarResults:
+        """
+        Aggregate a query x reference similarity matrix into columnar results
+        :param smiles: List of SMILES strings
+        :param valid: Indexes of smiles corresponding to rows of sim_matrix, other smiles score 0.0
+        :param sim_matrix: Similarity matrix of valid smiles x reference
+        :param thresh: If provided check if similarity is above threshold binarising the similarity coefficients
+        :param method: 'mean' or 'max'
+        :return: ColumnarResults
+        """
+        sim_matrix = np.asarray(sim_matrix, dtype=np.float64).reshape(len(valid), -1)
+        if thresh:
+            sim_matrix = (sim_matrix >= thresh).astype(np.float64)
+        sims = np.zeros(len(smiles))
+        cmpd_sims = np.full((len(smiles), sim_matrix.shape[1]), np.nan)
+        if len(valid):
+            if method == "mean":
+                sims[valid] = sim_matrix.mean(axis=1)
+            elif method == "max":
+                sims[valid] = sim_matrix.max(axis=1)
+            cmpd_sims[valid] = sim_matrix
+        columns = {f"{prefix}_Sim": sims}
+        columns.update(
+            {f"{prefix}_Cmpd{j+1}_Sim": cmpd_sims[:, j] for j in range(cmpd_sims.shape[1])}
+        )
+        return ColumnarResults(smiles, columns)
+
+    def _score_columnar(self, smiles: list) -> ColumnarResults:
+        """
+        Calculate scores given a list of SMILES as a query x reference similarity matrix
+        :param smiles: List of SMILES strings
+        :return: ColumnarResults
+        """
+        similarity_measure = SimilarityMeasures.get(self.similarity_measure, bulk=True)
+        valid = []
+        sim_matrix = []
+        for i, smi in enumerate(smiles):
+            mol = get_mol(smi)
+            if mol is not None:
+                fp = Fingerprints.get(mol, self.fp, self.nBits, asarray=False)
+                valid.append(i)
+                sim_matrix.append(similarity_measure(fp, self.ref_fps))
+        return self.columns_from_matrix(
+            smiles, valid, sim_matrix, self.thresh, self.method, self.prefix
+        )
+
+    def _score(self, smiles: list, columnar: bool = False, **kwargs):
         """
         Calculate scores for Tanimoto given a list of SMILES.
         :param smiles: List of SMILES strings
+        :param columnar: Return ColumnarResults instead of a list of dicts
         :param kwargs: Ignored
         :return: List of dicts i.e. [{'smiles': smi, 'metric': 'value', ...}, ...]
         """
@@ -155,28 +235,58 @@ class MolecularSimilarity:
                 prefix=self.prefix,
             )
         if self.n_jobs != 1:
-            with Pool(self.n_jobs) as pool:
-                results = [result for result in pool.imap(calculate_sim_p, smiles)]
+            if self.pool is None:
+                self.pool = TimeoutPool(
+                    calculate_sim_p, n_workers=self.n_jobs, timeout=self.timeout
+                )
+            results = self.pool.map(smiles)
+            n_timeout = sum(result is None for result in results)
+            if n_timeout:
+                logger.warning(
+                    f"Timeout of {self.timeout} reached for {n_timeout} molecules, returning 0.0"
+                )
+            results = [
+                result
+                if result is not None
+                else {"smiles": smi, f"{self.prefix}_Sim": 0.0}
+                for smi, result in zip(smiles, results)
+            ]
+        elif columnar:
+            return self._score_columnar(smiles)
         else:
             results = [calculate_sim_p(smi) for smi in smiles]
-        return results
+        return format_results(results, smiles, columnar=columnar)
 
-    def __call__(self, smiles: list, **kwargs):
+    def _timed_score(self, smiles: list, columnar: bool = False, **kwargs):
         """
-        Calculate scores for Tanimoto given a list of SMILES.
+        Calculate scores with a timeout over the whole batch.
         :param smiles: List of SMILES strings
+        :param columnar: Return ColumnarResults instead of a list of dicts
         :param kwargs: Ignored
         :return: List of dicts i.e. [{'smiles': smi, 'metric': 'value', ...}, ...]
         """
         tfunc = timedFunc2(self._score, timeout=self.timeout)
-        results = tfunc(smiles)
+        results = tfunc(smiles, columnar=columnar)
         if results is None:
             logger.warning(
                 f"Timeout of {self.timeout} reached for scoring, returning 0.0"
             )
             results = [{"smiles": smi, f"{self.prefix}_Sim": 0.0} for smi in smiles]
 
-        return results
+        return format_results(results, smiles, columnar=columnar)
+
+    def __call__(self, smiles: list, columnar: bool = False, **kwargs):
+        """
+        Calculate scores for Tanimoto given a list of SMILES.
+        :param smiles: List of SMILES strings
+        :param columnar: Return ColumnarResults instead of a list of dicts
+        :param kwargs: Ignored
+        :return: List of dicts i.e. [{'smiles': smi, 'metric': 'value', ...}, ...]
+        """
+        if self.n_jobs != 1:
+            # Worker pool enforces the timeout per molecule
+            return self._score(smiles, columnar=columnar)
+        return self._timed_score(smiles, columnar=columnar)
 
 
 class LevenshteinSimilarity(MolecularSimilarity):
@@ -201,7 +311,7 @@ class LevenshteinSimilarity(MolecularSimilarity):
         :param ref_smiles: List of SMILES or path to SMILES file with no header (.smi)
         :param thresh: If provided check if similarity is above threshold, binarising the similarity coefficients
         :param method: 'mean' or 'max' ('max' is equiv. singler nearest neighbour) [mean, max]
-        :param n_jobs: Number of python.multiprocessing jobs for multiprocessing
+        :param n_jobs: Number of threads used to compute the batch x reference similarity matrix
         :param timeout: Timeout for the scoring to cease and return a score of 0.0
         :param kwargs:
         """
@@ -269,27 +379,129 @@ class LevenshteinSimilarity(MolecularSimilarity):
 
         return result
 
-    def _score(self, smiles: list, **kwargs):
+    @staticmethod
+    def similarity_matrix(
+        smiles: list, ref_smiles: list, score_cutoff: float = None, n_jobs: int = 1
+    ) -> np.ndarray:
         """
-        Calculate scores for Tanimoto given a list of SMILES.
+        Calculate the normalized Levenshtein similarity matrix between a batch of SMILES and reference SMILES.
+         The edit distance is bounded by the difference in length, so if score_cutoff is provided, references that
+         can't reach it are skipped and similarities below it are returned as 0.0.
         :param smiles: List of SMILES strings
-        :param kwargs: Ignored
+        :param ref_smiles: List of reference SMILES strings
+        :param score_cutoff: Minimum similarity of interest
+        :param n_jobs: Number of threads used by the bulk C implementation (-1 for all cores)
+        :return: ndarray of shape (len(smiles), len(ref_smiles))
+        """
+        if rf_process is not None:
+            return rf_process.cdist(
+                smiles,
+                ref_smiles,
+                scorer=rf_levenshtein.normalized_similarity,
+                score_cutoff=score_cutoff,
+                dtype=np.float64,
+                workers=n_jobs,
+            )
+
+        # Fallback to pairwise distances with length based pruning
+        sim_matrix = np.zeros((len(smiles), len(ref_smiles)), dtype=np.float64)
+        ref_lens = np.asarray([len(ref) for ref in ref_smiles])
+        for i, smi in enumerate(smiles):
+            max_lens = np.maximum(ref_lens, len(smi))
+            # Levenshtein distance >= length difference, so similarity <= min length / max length
+            upper_bounds = np.minimum(ref_lens, len(smi)) / np.maximum(max_lens, 1)
+            for j in np.flatnonzero(upper_bounds >= (score_cutoff or 0.0)):
+                if max_lens[j] == 0:
+                    sim_matrix[i, j] = 1.0
+                    continue
+                max_dist = None
+                if score_cutoff:
+                    max_dist = int(np.floor((1 - score_cutoff) * max_lens[j] + 1e-9))
+                dist = levenshtein(smi, ref_smiles[j], score_cutoff=max_dist)
+                sim = 1 - (dist / max_lens[j])
+                if score_cutoff and (sim < score_cutoff):
+                    sim = 0.0
+                sim_matrix[i, j] = sim
+        return sim_matrix
+
+    @staticmethod
+    def calculate_sim_batch(
+        smiles: list,
+        ref_smiles: list,
+        thresh: float,
+        method: str,
+        prefix: str,
+        n_jobs: int = 1,
+        columnar: bool = False,
+    ):
+        """
+        Calculate the normalized Levenshtein similarity given a batch of SMILES strings and list of reference smiles,
+         computing the whole batch x reference matrix at once
+        :param smiles: List of SMILES strings
+        :param ref_smiles: list of reference smiles
+        :param thresh: If provided check if similarity is above threshold binarising the similarity coefficients
+        :param method: 'mean' or 'max'
+        :param n_jobs: Number of threads for the similarity matrix
+        :param columnar: Return ColumnarResults instead of a list of dicts
         :return: List of dicts i.e. [{'smiles': smi, 'metric': 'value', ...}, ...]
         """
-        calculate_sim_p = partial(
-                    self.calculate_sim,
-                    ref_smiles=self.ref_smiles,
-                    thresh=self.thresh,
-                    method=self.method,
-                    prefix=self.prefix,
-                )
-        if self.n_jobs != 1:
-            with Pool(self.n_jobs) as pool:
-                results = [result for result in pool.imap(calculate_sim_p, smiles)]
-        else:
-            results = [calculate_sim_p(smi) for smi in smiles]
+        if method not in ["mean", "max"]:
+            raise ValueError(f"Method {method} not recognised")
+        valid = [i for i, smi in enumerate(smiles) if smi]
+        # If binarising, similarities below thresh needn't be computed exactly
+        sim_matrix = LevenshteinSimilarity.similarity_matrix(
+            [smiles[i] for i in valid],
+            ref_smiles,
+            score_cutoff=thresh if thresh else None,
+            n_jobs=n_jobs,
+        )
+        if columnar:
+            return MolecularSimilarity.columns_from_matrix(
+                smiles, valid, sim_matrix, thresh, method, prefix
+            )
+        if thresh:
+            sim_matrix = sim_matrix >= thresh
+
+        results = [{"smiles": smi, f"{prefix}_Sim": 0.0} for smi in smiles]
+        for i, sim_vec in zip(valid, sim_matrix):
+            if method == "mean":
+                results[i][f"{prefix}_Sim"] = float(np.mean(sim_vec))
+            else:
+                results[i][f"{prefix}_Sim"] = float(np.max(sim_vec))
+            results[i].update(
+                {f"{prefix}_Cmpd{j+1}_Sim": sim for j, sim in enumerate(sim_vec.tolist())}
+            )
         return results
 
+    def _score(self, smiles: list, columnar: bool = False, **kwargs):
+        """
+        Calculate scores for Levenshtein similarity given a list of SMILES.
+        :param smiles: List of SMILES strings
+        :param columnar: Return ColumnarResults instead of a list of dicts
+        :param kwargs: Ignored
+        :return: List of dicts i.e. [{'smiles': smi, 'metric': 'value', ...}, ...]
+        """
+        return self.calculate_sim_batch(
+            smiles,
+            ref_smiles=self.ref_smiles,
+            thresh=self.thresh,
+            method=self.method,
+            prefix=self.prefix,
+            n_jobs=self.n_jobs,
+            columnar=columnar,
+        )
+
+    def __call__(self, smiles: list, columnar: bool = False, **kwargs):
+        """
+        Calculate scores for Levenshtein similarity given a list of SMILES.
+        :param smiles: List of SMILES strings
+        :param columnar: Return ColumnarResults instead of a list of dicts
+        :param kwargs: Ignored
+        :return: List of dicts i.e. [{'smiles': smi, 'metric': 'value', ...}, ...]
+        """
+        # Similarity matrix is computed in this process, so timeout the whole batch
+        return self._timed_score(smiles, columnar=columnar)
+
 
 # Adding for backwards compatability
 class TanimotoSimilarity(MolecularSimilarity):
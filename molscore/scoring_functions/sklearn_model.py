@@ -1,18 +1,87 @@
 import glob
 import os
-import pickle as pkl
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
-from typing import Union
+from typing import Callable, Union
 
 import joblib
 import numpy as np
 from rdkit import rdBase
+from scipy import sparse as sp
 
-from molscore.scoring_functions.utils import Fingerprints, Pool
+from molscore.scoring_functions.utils import Executor, Fingerprints
 
 rdBase.DisableLog("rdApp.error")
 
 
+def load_model(model_path: Union[str, os.PathLike], mmap: bool = True):
+    """
+    Load a pre-trained model, joblib files are memory-mapped so that multiple processes share the same pages
+    :param model_path: Path to model (.joblib, .pkl or .pickle)
+    :param mmap: Memory-map numpy arrays in (uncompressed) joblib files
+    """
+    model_path = str(model_path)
+    if model_path.endswith((".joblib", ".pkl", ".pickle")):
+        # Copy-on-write as some estimators (e.g., libsvm) require writeable arrays, pages are shared until written,
+        #  joblib also reads plain pickle files (without memory-mapping)
+        return joblib.load(model_path, mmap_mode="c" if mmap else None)
+    else:
+        raise TypeError(f"Unrecognized file extension: {model_path.rsplit('.', 1)[-1]}")
+
+
+def _featurize_batch(smiles: list, featurize: Callable, sparse: bool = False):
+    fps = [featurize(smi) for smi in smiles]
+    valid = np.asarray([fp is not None for fp in fps], dtype=bool)
+    fps = [fp.reshape(1, -1) for fp in fps if fp is not None]
+    if len(fps) == 0:
+        return valid, None
+    X = np.vstack(fps)
+    if sparse:
+        X = sp.csr_matrix(X)
+    return valid, X
+
+
+def feature_matrix(
+    smiles: list, featurize: Callable, executor: Executor = None, sparse: bool = False
+):
+    """
+    Compute one feature matrix for a batch of SMILES, each executor worker stacks the features of its own chunk
+    :param smiles: List of SMILES
+    :param featurize: Function returning a 1D feature array or None if invalid, must be picklable
+    :param executor: Executor to featurize chunks with
+    :param sparse: Return a CSR sparse matrix instead of a dense array
+    :return: (indices of valid SMILES, feature matrix of valid SMILES or None)
+    """
+    executor = executor or Executor()
+    batches = executor.map_batches(
+        partial(_featurize_batch, featurize=featurize, sparse=sparse), smiles
+    )
+    valid = np.flatnonzero(np.concatenate([v for v, _ in batches]))
+    Xs = [X for _, X in batches if X is not None]
+    if len(Xs) == 0:
+        return valid, None
+    X = sp.vstack(Xs, format="csr") if sparse else np.vstack(Xs)
+    return valid, X
+
+
+def chunked_predict(func: Callable, X, chunk_size: int = 10000):
+    """
+    Call a predict function on bounded-size chunks of a feature matrix
+    :param func: Predict function e.g., model.predict
+    :param X: Dense or sparse feature matrix
+    :param chunk_size: Maximum number of rows per call
+    :return: Concatenated predictions
+    """
+    return np.concatenate(
+        [func(X[i : i + chunk_size]) for i in range(0, X.shape[0], chunk_size)]
+    )
+
+
+def predict_proba(model, X, chunk_size: int = 10000):
+    """Probability of the positive class"""
+    return chunked_predict(model.predict_proba, X, chunk_size)[:, 1]
+
+
 class SKLearnClassifier:
     """
     Score structures by loading a pre-trained sklearn classifier and return the predicted values
@@ -27,6 +96,10 @@ class SKLearnClassifier:
         fp: str,
         nBits: int = 1024,
         n_jobs: int = 1,
+        executor: dict = None,
+        chunk_size: int = 10000,
+        sparse: bool = False,
+        mmap: bool = True,
         **kwargs,
     ):
         """
@@ -35,6 +108,10 @@ class SKLearnClassifier:
         :param fp: What type of fingerprint to use [ECFP4, ECFP4c, FCFP4, FCFP4c, ECFP6, ECFP6c, FCFP6, FCFP6c, Avalon, MACCSkeys, hashAP, hashTT, RDK5, RDK6, RDK7]
         :param nBits: Length of fingerprint
         :param n_jobs: Number of python.multiprocessing jobs for multiprocessing of fps
+        :param executor: Executor parameters e.g., {"backend": "dask", "address": "tcp://..."}, default is based on n_jobs
+        :param chunk_size: Maximum number of molecules passed to the model at once
+        :param sparse: Pass fingerprints to the model as a sparse matrix (if supported by the model)
+        :param mmap: Memory-map joblib models so that multiple processes share them
         :param kwargs:
         """
         self.prefix = prefix
@@ -43,15 +120,21 @@ class SKLearnClassifier:
         self.fp = fp
         self.nBits = int(nBits)
         self.n_jobs = n_jobs
+        self.executor = Executor.from_config(executor, n_jobs=n_jobs)
+        self.chunk_size = chunk_size
+        self.sparse = sparse
+        self.mmap = mmap
 
         # Load in model and assign to attribute
-        if model_path.endswith(".joblib"):
-            self.model = joblib.load(model_path)
-        elif model_path.endswith(".pkl") or model_path.endswith(".pickle"):
-            with open(model_path, "rb") as f:
-                self.model = pkl.load(f)
-        else:
-            raise TypeError(f"Unrecognized file extension: {os.rsplit('.', 1)[-1]}")
+        self.model = load_model(model_path, mmap=mmap)
+
+    def _feature_matrix(self, smiles: list):
+        return feature_matrix(
+            smiles,
+            partial(Fingerprints.get, name=self.fp, nBits=self.nBits, asarray=True),
+            executor=self.executor,
+            sparse=self.sparse,
+        )
 
     def __call__(self, smiles: list, **kwargs):
         """
@@ -64,22 +147,10 @@ class SKLearnClassifier:
         """
 
         results = [{"smiles": smi, f"{self.prefix}_pred_proba": 0.0} for smi in smiles]
-        valid = []
-        fps = []
-        with Pool(self.n_jobs) as pool:
-            pcalculate_fp = partial(
-                Fingerprints.get, name=self.fp, nBits=self.nBits, asarray=True
-            )
-            [
-                (valid.append(i), fps.append(fp.reshape(1, -1)))
-                for i, fp in enumerate(pool.imap(pcalculate_fp, smiles))
-                if fp is not None
-            ]
+        valid, X = self._feature_matrix(smiles)
 
         if len(valid) != 0:
-            probs = self.model.predict_proba(np.asarray(fps).reshape(len(fps), -1))[
-                :, 1
-            ]
+            probs = predict_proba(self.model, X, self.chunk_size)
             for i, prob in zip(valid, probs):
                 results[i].update({f"{self.prefix}_pred_proba": prob})
 
@@ -100,6 +171,10 @@ class SKLearnRegressor(SKLearnClassifier):
         fp: str,
         nBits: int = 1024,
         n_jobs: int = 1,
+        executor: dict = None,
+        chunk_size: int = 10000,
+        sparse: bool = False,
+        mmap: bool = True,
         **kwargs,
     ):
         """
@@ -108,10 +183,22 @@ class SKLearnRegressor(SKLearnClassifier):
         :param fp: What type of fingerprint to use [ECFP4, ECFP4c, FCFP4, FCFP4c, ECFP6, ECFP6c, FCFP6, FCFP6c, Avalon, MACCSkeys, hashAP, hashTT, RDK5, RDK6, RDK7]
         :param nBits: Length of fingerprint
         :param n_jobs: Number of python.multiprocessing jobs for multiprocessing of fps
+        :param executor: Executor parameters e.g., {"backend": "dask", "address": "tcp://..."}, default is based on n_jobs
+        :param chunk_size: Maximum number of molecules passed to the model at once
+        :param sparse: Pass fingerprints to the model as a sparse matrix (if supported by the model)
+        :param mmap: Memory-map joblib models so that multiple processes share them
         :param kwargs:
         """
         super().__init__(
-            prefix=prefix, model_path=model_path, fp=fp, nBits=nBits, n_jobs=n_jobs
+            prefix=prefix,
+            model_path=model_path,
+            fp=fp,
+            nBits=nBits,
+            n_jobs=n_jobs,
+            executor=executor,
+            chunk_size=chunk_size,
+            sparse=sparse,
+            mmap=mmap,
         )
 
     def __call__(self, smiles: list, **kwargs):
@@ -125,20 +212,10 @@ class SKLearnRegressor(SKLearnClassifier):
         """
 
         results = [{"smiles": smi, f"{self.prefix}_predict": 0.0} for smi in smiles]
-        valid = []
-        fps = []
-        with Pool(self.n_jobs) as pool:
-            pcalculate_fp = partial(
-                Fingerprints.get, name=self.fp, nBits=self.nBits, asarray=True
-            )
-            [
-                (valid.append(i), fps.append(fp.reshape(1, -1)))
-                for i, fp in enumerate(pool.imap(pcalculate_fp, smiles))
-                if fp is not None
-            ]
+        valid, X = self._feature_matrix(smiles)
 
         if len(valid) != 0:
-            preds = self.model.predict(np.asarray(fps).reshape(len(fps), -1))
+            preds = chunked_predict(self.model.predict, X, self.chunk_size)
             for i, pred in zip(valid, preds):
                 results[i].update({f"{self.prefix}_predict": pred})
 
@@ -162,6 +239,10 @@ class EnsembleSKLearnModel(SKLearnModel):
         fp: str,
         nBits: int,
         n_jobs: int = 1,
+        executor: dict = None,
+        chunk_size: int = 10000,
+        sparse: bool = False,
+        mmap: bool = True,
         **kwargs,
     ):
         """
@@ -170,9 +251,24 @@ class EnsembleSKLearnModel(SKLearnModel):
         :param fp: What type of fingerprint to use [ECFP4, ECFP4c, FCFP4, FCFP4c, ECFP6, ECFP6c, FCFP6, FCFP6c, Avalon, MACCSkeys, hashAP, hashTT, RDK5, RDK6, RDK7]
         :param nBits: Length of fingerprint
         :param n_jobs: Number of python.multiprocessing jobs for multiprocessing of fps
+        :param executor: Executor parameters e.g., {"backend": "dask", "address": "tcp://..."}, default is based on n_jobs
+        :param chunk_size: Maximum number of molecules passed to each model at once
+        :param sparse: Pass fingerprints to the model as a sparse matrix (if supported by the model)
+        :param mmap: Memory-map joblib models so that multiple processes share them
         :param kwargs:
         """
-        super().__init__(prefix, model_path, fp, nBits, n_jobs, **kwargs)
+        super().__init__(
+            prefix,
+            model_path,
+            fp,
+            nBits,
+            n_jobs,
+            executor,
+            chunk_size=chunk_size,
+            sparse=sparse,
+            mmap=mmap,
+            **kwargs,
+        )
         changing = self.model_path.split("_")
         del changing[len(changing) - 1]
         changing = "_".join(changing)
@@ -181,28 +277,19 @@ class EnsembleSKLearnModel(SKLearnModel):
         # Load in model and assign to attribute
         self.models = []
         for f in self.replicates:
-            self.models.append(joblib.load(f))
+            self.models.append(load_model(f, mmap=mmap))
 
     def __call__(self, smiles: list, **kwargs):
         results = [{"smiles": smi, f"{self.prefix}_pred_proba": 0.0} for smi in smiles]
-        valid = []
-        fps = []
-        predictions = []
-        averages = []
-        with Pool(self.n_jobs) as pool:
-            pcalculate_fp = partial(
-                Fingerprints.get, name=self.fp, nBits=self.nBits, asarray=True
+        valid, X = self._feature_matrix(smiles)
+        if len(valid) == 0:
+            return results
+
+        # Predicting the probabilies in parallel threads, most sklearn estimators release the GIL
+        with ThreadPoolExecutor(max_workers=max(1, len(self.models))) as pool:
+            predictions = list(
+                pool.map(lambda m: predict_proba(m, X, self.chunk_size), self.models)
             )
-            [
-                (valid.append(i), fps.append(fp))
-                for i, fp in enumerate(pool.imap(pcalculate_fp, smiles))
-                if fp is not None
-            ]
-
-        # Predicting the probabilies and appending them to a list.
-        for m in self.models:
-            prediction = m.predict_proba(np.asarray(fps).reshape(len(fps), -1))[:, 1]
-            predictions.append(prediction)
         predictions = np.asarray(predictions)
         averages = predictions.mean(axis=0)
 
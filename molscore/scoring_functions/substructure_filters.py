@@ -5,10 +5,10 @@ https://github.com/MolecularAI/Reinvent
 
 from functools import partial
 
-import numpy as np
 from rdkit import Chem
 
-from molscore.scoring_functions.utils import Pool
+from moleval.metrics.substructure_engine import SubstructureEngine
+from molscore.scoring_functions.utils import Executor
 
 
 class SubstructureFilters:
@@ -568,6 +568,8 @@ class SubstructureFilters:
         pains_filters: bool = False,
         custom_filters: list = [],
         n_jobs: int = 1,
+        executor: dict = None,
+        report_matches: bool = True,
         **kwargs,
     ):
         """
@@ -578,10 +580,14 @@ class SubstructureFilters:
         :param pains_filters: Run PAINS filters
         :param custom_filters: A list of SMARTS to define custom substructure filters.
         :param n_jobs: Number of python.multiprocessing jobs for multiprocessing
+        :param executor: Executor parameters e.g., {"backend": "dask", "address": "tcp://..."}, default is based on n_jobs
+        :param report_matches: Report the matched SMARTS, otherwise stop at the first match
         :param kwargs:
         """
         self.prefix = prefix.replace(" ", "_")
         self.n_jobs = n_jobs
+        self.executor = Executor.from_config(executor, n_jobs=n_jobs)
+        self.report_matches = report_matches
         self.smarts = []
 
         if az_filters:
@@ -593,34 +599,35 @@ class SubstructureFilters:
         if len(custom_filters) > 0:
             self.smarts += custom_filters
 
-        # Check all SMARTS are parse-able
-        self.smarts = [sub for sub in set(self.smarts) if Chem.MolFromSmarts(sub)]
+        # Compile SMARTS once, dropping any that aren't parse-able
+        self.engine = SubstructureEngine(list(set(self.smarts)))
+        self.smarts = self.engine.smarts
 
     @staticmethod
-    def match_substructure(smi: str, smarts_filters: list):
+    def match_substructure(
+        smi: str, engine: SubstructureEngine, report_matches: bool = True
+    ):
         """
-        Method to return a score for a given SMILES string and SMARTS patterns as filters
+        Method to return a score for a given SMILES string and compiled SMARTS patterns as filters
          (static method for easier multiprocessing)
         :param smi: SMILES string
-        :param smarts_filters: List of SMARTS strings
-        :return: (SMILES, score)
+        :param engine: SubstructureEngine of SMARTS filters
+        :param report_matches: Return all matched SMARTS, otherwise stop at the first match
+        :return: (SMILES, score, matched SMARTS)
         """
         mol = Chem.MolFromSmiles(smi)
+        subs = None
         if mol:
-            matches = [
-                mol.HasSubstructMatch(Chem.MolFromSmarts(sub)) for sub in smarts_filters
-            ]
-            match = any(matches)
-            if match:
-                subs = " ".join(
-                    [smarts_filters[i] for i in np.argwhere(matches).flatten()]
-                )
+            if report_matches:
+                matches = engine.matched_smarts(mol)
+                match = len(matches) > 0
+                if match:
+                    subs = " ".join(matches)
             else:
-                subs = None
+                match = engine.has_match(mol)
             score = int(not match)
         else:
             score = 0
-            subs = None
         return smi, score, subs
 
     def __call__(self, smiles: list, **kwargs):
@@ -631,25 +638,16 @@ class SubstructureFilters:
         :return: List of dicts i.e. [{'smiles': smi, 'metric': 'value', ...}, ...]
         """
         match_substructure_p = partial(
-                self.match_substructure, smarts_filters=self.smarts
+                self.match_substructure,
+                engine=self.engine,
+                report_matches=self.report_matches,
             )
-        if self.n_jobs <= 1:
-            results = [
-                {
-                    "smiles": smi,
-                    f"{self.prefix}_substruct_filt": match,
-                    f"{self.prefix}_substruct": subs,
-                }
-                for smi, match, subs in map(match_substructure_p, smiles)
-            ]
-        else:
-            with Pool(self.n_jobs) as pool:
-                results = [
-                    {
-                        "smiles": smi,
-                        f"{self.prefix}_substruct_filt": match,
-                        f"{self.prefix}_substruct": subs,
-                    }
-                    for smi, match, subs in pool.imap(match_substructure_p, smiles)
-                ]
+        results = [
+            {
+                "smiles": smi,
+                f"{self.prefix}_substruct_filt": match,
+                f"{self.prefix}_substruct": subs,
+            }
+            for smi, match, subs in self.executor.map(match_substructure_p, smiles)
+        ]
         return results
@@ -9,7 +9,8 @@ from typing import Union
 
 from rdkit import Chem
 
-from molscore.scoring_functions.utils import Pool
+from moleval.metrics.substructure_engine import SubstructureEngine
+from molscore.scoring_functions.utils import Executor
 
 
 class SubstructureMatch:
@@ -25,6 +26,7 @@ class SubstructureMatch:
         smarts: Union[list, os.PathLike],
         n_jobs: int = 1,
         method: str = "any",
+        executor: dict = None,
         **kwargs,
     ):
         """
@@ -32,10 +34,12 @@ class SubstructureMatch:
         :param smarts: List of SMARTS or path to SMARTS file (format of a .smi i.e., txt with one row, no header)
         :param n_jobs: Number of python.multiprocessing jobs for multiprocessing
         :param method: 'any' or 'all': Give reward for 'any' match, or only for 'all' matches (reward is 1 or 0)
+        :param executor: Executor parameters e.g., {"backend": "dask", "address": "tcp://..."}, default is based on n_jobs
         :param kwargs:
         """
         self.prefix = prefix.replace(" ", "_")
         self.n_jobs = n_jobs
+        self.executor = Executor.from_config(executor, n_jobs=n_jobs)
         self.smarts = smarts
         assert method in ["any", "all"]
         self.method = method
@@ -50,34 +54,25 @@ class SubstructureMatch:
             ), "None list or empty list provided"
             self.smarts = smarts
 
+        # Compile SMARTS once, dropping any that aren't parse-able
+        self.engine = SubstructureEngine(self.smarts)
+
     @staticmethod
-    def match_substructure(smi: str, smarts: list, method: str):
+    def match_substructure(smi: str, engine: SubstructureEngine, method: str):
         """
-        Method to return a score for a given SMILES string, SMARTS patterns and method ('all' or 'any')
+        Method to return a score for a given SMILES string, compiled SMARTS patterns and method ('all' or 'any')
          (static method for easier multiprocessing)
         :param smi: SMILES string
-        :param smarts: List of SMARTS strings
+        :param engine: SubstructureEngine of SMARTS patterns
         :param method: Require to match either 'any' or 'all' SMARTS
         :return: (SMILES, score)
         """
         mol = Chem.MolFromSmiles(smi)
         if mol:
             if method == "any":
-                match = any(
-                    [
-                        mol.HasSubstructMatch(Chem.MolFromSmarts(sub))
-                        for sub in smarts
-                        if Chem.MolFromSmarts(sub)
-                    ]
-                )
+                match = engine.has_match(mol)
             if method == "all":
-                match = all(
-                    [
-                        mol.HasSubstructMatch(Chem.MolFromSmarts(sub))
-                        for sub in smarts
-                        if Chem.MolFromSmarts(sub)
-                    ]
-                )
+                match = engine.all_match(mol)
         else:
             match = 0
         return smi, int(match)
@@ -90,17 +85,10 @@ class SubstructureMatch:
         :return: List of dicts i.e. [{'smiles': smi, 'metric': 'value', ...}, ...]
         """
         match_substructure_p = partial(
-                self.match_substructure, smarts=self.smarts, method=self.method
+                self.match_substructure, engine=self.engine, method=self.method
             )
-        if self.n_jobs <= 1:
-            results = [
-                {"smiles": smi, f"{self.prefix}_substruct_match": match}
-                for smi, match in map(match_substructure_p, smiles)
-            ]
-        else:
-            with Pool(self.n_jobs) as pool:
-                results = [
-                    {"smiles": smi, f"{self.prefix}_substruct_match": match}
-                    for smi, match in pool.imap(match_substructure_p, smiles)
-                ]
+        results = [
+            {"smiles": smi, f"{self.prefix}_substruct_match": match}
+            for smi, match in self.executor.map(match_substructure_p, smiles)
+        ]
         return results
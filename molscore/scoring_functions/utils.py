@@ -1,13 +1,23 @@
+import atexit
 import gzip
+import hashlib
+import json
+import logging
 import multiprocessing
 import os
 import platform
 import shutil
 import signal
+import socket
 import subprocess
+import tempfile
 import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from functools import partial
+from multiprocessing.connection import wait as wait_connections
 from pathlib import Path
 from typing import Callable, Sequence, Union
 
@@ -21,6 +31,13 @@ from rdkit.Chem import AllChem as Chem
 from rdkit.Chem import DataStructs, rdMolDescriptors, rdmolops
 from rdkit.Chem.Pharm2D import Generate, Gobbi_Pharm2D
 
+logger = logging.getLogger("utils")
+formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+logger.setLevel(logging.DEBUG)
+ch = logging.StreamHandler()
+ch.setLevel(logging.INFO)
+logger.addHandler(ch)
+
 
 # ----- Requirements related -----
 def check_openbabel():
@@ -147,6 +164,216 @@ class timedFunc2:
         return result
 
 
+def schedule_cores(n_tasks: int, n_cores: int) -> tuple:
+    """
+    Split cores between task level processes and within task threads (e.g., conformer embedding),
+     so that small batches still make use of all cores
+    :param n_tasks: Number of tasks in the batch (e.g., molecules)
+    :param n_cores: Number of cores available
+    :return: Number of processes, number of threads per process
+    """
+    n_cores = max(1, n_cores)
+    n_procs = max(1, min(n_tasks, n_cores))
+    n_threads = max(1, n_cores // n_procs)
+    return n_procs, n_threads
+
+
+class TimeoutPool:
+    """
+    Pool of warm worker processes that enforces a hard per-task timeout, including on C++ bindings i.e, RDKit.
+    A worker that overruns its deadline is killed and replaced, other in-flight tasks are unaffected.
+    """
+
+    @staticmethod
+    def _worker(func, conn):
+        while True:
+            try:
+                task = conn.recv()
+            except (EOFError, OSError, KeyboardInterrupt):
+                break
+            if task is None:
+                break
+            idx, args, kwargs = task
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                result = e
+            try:
+                conn.send((idx, result))
+            except Exception as e:
+                # E.g., result could not be pickled
+                conn.send((idx, RuntimeError(f"Failed to return result: {e}")))
+        conn.close()
+
+    def __init__(
+        self,
+        func: Callable,
+        n_workers: int = 1,
+        timeout: Union[int, float] = None,
+    ):
+        """
+        :param func: A function to be run with timeout, passed to workers once at start up
+        :param n_workers: Number of worker processes, overridden by MOLSCORE_NJOBS if set
+        :param timeout: Default timeout per task, None means no timeout
+        """
+        if platform.system() == "Linux":
+            self._context = multiprocessing.get_context("fork")
+        else:
+            self._context = multiprocessing.get_context("spawn")
+        # Extract from environment as default, overriding configs
+        if "MOLSCORE_NJOBS" in os.environ.keys():
+            n_workers = int(os.environ["MOLSCORE_NJOBS"])
+        self.func = func
+        self.n_workers = max(1, n_workers)
+        self.timeout = timeout
+        self._workers = []
+
+    def _start_worker(self):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=self._worker, args=(self.func, child_conn), daemon=True
+        )
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    @staticmethod
+    def _stop_worker(process, conn):
+        conn.close()
+        process.terminate()
+        process.join(1)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+    def _replace_worker(self, i: int):
+        self._stop_worker(*self._workers[i])
+        self._workers[i] = self._start_worker()
+
+    def _run(self, tasks: list, timeout: Union[int, float] = None):
+        """
+        Run tasks of (args, kwargs) across workers
+        :return: List of results in task order, None if timed out or the worker died
+        """
+        timeout = self.timeout if timeout is None else timeout
+        while len(self._workers) < self.n_workers:
+            self._workers.append(self._start_worker())
+
+        results = [None] * len(tasks)
+        errors = []
+        pending = deque(range(len(tasks)))
+        busy = {}  # Worker index -> (task index, deadline)
+        try:
+            while pending or busy:
+                # Dispatch to idle workers
+                for w in range(len(self._workers)):
+                    if not pending:
+                        break
+                    if w in busy:
+                        continue
+                    i = pending.popleft()
+                    args, kwargs = tasks[i]
+                    try:
+                        self._workers[w][1].send((i, args, kwargs))
+                    except (BrokenPipeError, EOFError, ConnectionResetError):
+                        self._replace_worker(w)
+                        pending.appendleft(i)
+                        continue
+                    busy[w] = (i, time.monotonic() + timeout if timeout else None)
+
+                # Wait for results or the next deadline
+                deadlines = [d for _, d in busy.values() if d is not None]
+                wait_time = (
+                    max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+                )
+                conns = {self._workers[w][1]: w for w in busy}
+                for conn in wait_connections(list(conns), timeout=wait_time):
+                    w = conns[conn]
+                    i, _ = busy.pop(w)
+                    try:
+                        _, result = conn.recv()
+                    except (EOFError, OSError):
+                        logger.warning(f"Worker died running task {i}, replacing")
+                        self._replace_worker(w)
+                        continue
+                    if isinstance(result, Exception):
+                        errors.append(result)
+                    else:
+                        results[i] = result
+
+                # Kill and replace workers that overran their deadline
+                now = time.monotonic()
+                for w, (i, deadline) in list(busy.items()):
+                    if (deadline is not None) and (now >= deadline):
+                        logger.debug(f"Task {i} timed out after {timeout}s, replacing worker")
+                        busy.pop(w)
+                        self._replace_worker(w)
+        finally:
+            # If interrupted, don't leave workers running orphaned tasks
+            for w in busy:
+                self._replace_worker(w)
+
+        if errors:
+            raise errors[0]
+        return results
+
+    def map(
+        self, iterable, timeout: Union[int, float] = None, kwargs: dict = None
+    ) -> list:
+        """
+        Apply function to each item in iterable
+        :param iterable: Items to be passed as the first argument
+        :param timeout: Timeout per item, defaults to pool timeout
+        :param kwargs: Keyword arguments passed with every item
+        :return: List of results in order, None for items that timed out
+        """
+        return self._run([((x,), kwargs or {}) for x in iterable], timeout=timeout)
+
+    def starmap(
+        self, iterable, timeout: Union[int, float] = None, kwargs: dict = None
+    ) -> list:
+        """
+        Apply function to each tuple of args in iterable
+        :param iterable: Tuples of arguments
+        :param timeout: Timeout per item, defaults to pool timeout
+        :param kwargs: Keyword arguments passed with every item
+        :return: List of results in order, None for items that timed out
+        """
+        return self._run(
+            [(tuple(args), kwargs or {}) for args in iterable], timeout=timeout
+        )
+
+    def __call__(self, *args, **kwargs):
+        """
+        Run the timeout wrapped function with input args and kwargs in a warm worker
+        :return: Function result or None if timedout
+        """
+        return self._run([(args, kwargs)])[0]
+
+    def close(self):
+        for process, conn in self._workers:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process, conn in self._workers:
+            process.join(1)
+            self._stop_worker(process, conn)
+        self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __getstate__(self):
+        # Workers can't be pickled, they are restarted lazily
+        state = self.__dict__.copy()
+        state["_workers"] = []
+        return state
+
+
 class timedThread(object):
     """
     Subprocess wrapped into a thread to add a more well defined timeout, use os to send a signal to all PID in
@@ -389,6 +616,485 @@ class DaskUtils:
             except Exception:
                 pass
 
+class Executor:
+    """
+    Single interface to map a function over inputs using a serial, thread, process or dask backend.
+    Pools/clients are created on first use and kept warm. Also usable by moleval mapper(n_jobs=executor).
+    """
+
+    backends = ["serial", "thread", "process", "dask"]
+
+    def __init__(
+        self,
+        backend: str = "serial",
+        n_jobs: int = 1,
+        address: str = None,
+        chunksize: int = None,
+        local_directory: str = None,
+    ):
+        """
+        :param backend: Parallelization backend [serial, thread, process, dask]
+        :param n_jobs: Number of threads, processes or local dask workers
+        :param address: Address of dask scheduler to connect to (otherwise a local cluster of n_jobs is started)
+        :param chunksize: Number of inputs sent to a worker at once, default is automatic
+        :param local_directory: Local directory for dask workers
+        """
+        assert backend in self.backends, f"Backend must be one of {self.backends}"
+        self.backend = backend
+        self.n_jobs = n_jobs
+        self.address = address
+        self.chunksize = chunksize
+        self.local_directory = local_directory
+        self._pool = None
+        self._client = None
+
+    @classmethod
+    def from_config(cls, config: Union[dict, "Executor"] = None, n_jobs: int = 1):
+        """
+        Create an executor from a scoring function config
+        :param config: Executor or dictionary of executor parameters e.g., {"backend": "dask", "address": "tcp://..."}
+        :param n_jobs: Default number of jobs if not specified in config
+        :return: Executor, by default process if n_jobs > 1 (or MOLSCORE_NJOBS is set) otherwise serial
+        """
+        if isinstance(config, cls):
+            return config
+        config = dict(config or {})
+        config.setdefault("n_jobs", n_jobs)
+        if "backend" not in config:
+            if (config["n_jobs"] > 1) or ("MOLSCORE_NJOBS" in os.environ.keys()):
+                config["backend"] = "process"
+            else:
+                config["backend"] = "serial"
+        return cls(**config)
+
+    def _get_chunksize(self, n: int):
+        if self.chunksize:
+            return self.chunksize
+        # Same heuristic as multiprocessing i.e., ~4 chunks per worker
+        chunksize, extra = divmod(n, max(1, self.n_jobs) * 4)
+        return max(1, chunksize + bool(extra))
+
+    @staticmethod
+    def _map_chunk(func, chunk):
+        return [func(x) for x in chunk]
+
+    def map(self, func: Callable, iterable) -> list:
+        """
+        Apply function to each item in iterable
+        :param func: Function to apply, must be picklable for process and dask backends
+        :param iterable: Inputs
+        :return: List of results in order
+        """
+        items = list(iterable)
+        if (self.backend == "serial") or (len(items) == 0):
+            return [func(x) for x in items]
+
+        if self.backend == "thread":
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.n_jobs)
+                atexit.register(self.close)
+            return list(self._pool.map(func, items))
+
+        if self.backend == "process":
+            if self._pool is None:
+                self._pool = Pool(self.n_jobs)
+                atexit.register(self.close)
+            return self._pool.map(func, items, chunksize=self._get_chunksize(len(items)))
+
+        # Dask
+        if self._client is None:
+            self._client = DaskUtils.setup_dask(
+                cluster_address_or_n_workers=self.address or self.n_jobs,
+                local_directory=self.local_directory,
+                logger=logger,
+            )
+            if self._client is None:
+                raise ValueError(
+                    f"Failed to setup dask with address={self.address}, n_jobs={self.n_jobs}"
+                )
+            atexit.register(self.close)
+        chunksize = self._get_chunksize(len(items))
+        chunks = [items[i : i + chunksize] for i in range(0, len(items), chunksize)]
+        futures = self._client.map(
+            self._map_chunk, [func] * len(chunks), chunks, pure=False
+        )
+        return [r for chunk in self._client.gather(futures) for r in chunk]
+
+    def map_batches(self, func: Callable, iterable) -> list:
+        """
+        Apply function to batches of the inputs e.g., to compute a feature matrix per batch
+        :param func: Function taking a list of inputs, must be picklable for process and dask backends
+        :param iterable: Inputs
+        :return: List of results per batch in order, a single batch if serial
+        """
+        items = list(iterable)
+        if (self.backend == "serial") or (len(items) == 0):
+            return [func(items)]
+        chunksize = self._get_chunksize(len(items))
+        chunks = [items[i : i + chunksize] for i in range(0, len(items), chunksize)]
+        return self.map(func, chunks)
+
+    def close(self):
+        """Shutdown any pool, and any local dask cluster started by this executor"""
+        if self._pool is not None:
+            if self.backend == "thread":
+                self._pool.shutdown()
+            else:
+                self._pool.terminate()
+                self._pool.join()
+            self._pool = None
+        if self._client is not None:
+            # Clients connected by address have no cluster of their own
+            cluster = getattr(self._client, "cluster", None)
+            self._client.close()
+            if cluster is not None:
+                if os.environ.get("MOLSCORE_CLUSTER") == cluster.scheduler_address:
+                    del os.environ["MOLSCORE_CLUSTER"]
+                cluster.close()
+            self._client = None
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __getstate__(self):
+        # Pools and clients can't be pickled, they are recreated lazily
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        state["_client"] = None
+        return state
+
+
+# ----- Caching related -----
+def get_cache_dir():
+    """
+    Get the directory used for on-disk caches, can be overridden via the MOLSCORE_CACHE environment variable
+    """
+    if "MOLSCORE_CACHE" in os.environ.keys():
+        cache_dir = os.environ["MOLSCORE_CACHE"]
+    else:
+        cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "molscore")
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def hash_file(file_path: os.PathLike, chunk_size: int = 2**20):
+    """Return the SHA-256 hex digest of a file's contents"""
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ReferenceCache:
+    """
+    Content-addressed on-disk cache for arrays computed from a reference file (e.g., reference fingerprints),
+     keyed by the file hash and any parameters used to compute them. Arrays are stored as .npy files so that
+     later loads are memory-mapped rather than recomputed. Set MOLSCORE_NO_CACHE to disable.
+    """
+
+    def __init__(self, file_path: os.PathLike, name: str, cache_dir: str = None, **params):
+        """
+        :param file_path: Path to reference file, the contents of which are hashed
+        :param name: Name of the computed features (e.g., fps), used as a subdirectory
+        :param cache_dir: Overwrite the default cache directory
+        :param params: Any parameters affecting the computed features (e.g., fp type, nBits)
+        """
+        self.enabled = "MOLSCORE_NO_CACHE" not in os.environ.keys()
+        self.name = name
+        self.params = params
+        if self.enabled:
+            key = json.dumps(
+                {"file": hash_file(file_path), "name": name, **params},
+                sort_keys=True,
+                default=str,
+            )
+            self.key = hashlib.sha256(key.encode()).hexdigest()[:32]
+            self.directory = os.path.join(cache_dir or get_cache_dir(), name, self.key)
+
+    def _path(self, array_name: str):
+        return os.path.join(self.directory, f"{array_name}.npy")
+
+    def exists(self, *array_names: str) -> bool:
+        return self.enabled and all(
+            os.path.exists(self._path(n)) for n in array_names
+        )
+
+    def load(self, *array_names: str, mmap_mode: str = "r") -> dict:
+        """Load (memory-mapped) arrays by name"""
+        return {n: np.load(self._path(n), mmap_mode=mmap_mode) for n in array_names}
+
+    def save(self, **arrays: np.ndarray):
+        """Save arrays by name, written to a temporary file first so concurrent readers never see partial files"""
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for n, array in arrays.items():
+            tmp_path = os.path.join(self.directory, f".{n}.{os.getpid()}.tmp.npy")
+            np.save(tmp_path, np.asarray(array))
+            os.replace(tmp_path, self._path(n))
+
+    def get(self, array_names: Sequence[str], func: Callable, **kwargs) -> dict:
+        """
+        Load arrays if cached, otherwise compute them and cache the result
+        :param array_names: Names of arrays expected
+        :param func: Function returning a dictionary of arrays by name, or None if the result should not be cached
+        :param kwargs: Passed to func
+        :return: Dictionary of arrays by name
+        """
+        if self.exists(*array_names):
+            return self.load(*array_names)
+        arrays = func(**kwargs)
+        if arrays is not None:
+            self.save(**arrays)
+        return arrays
+
+
+class ConformerCache:
+    """
+    Content-addressed on-disk cache of molecules with conformers, keyed by canonical SMILES and any parameters
+     used to generate them. Persists across steps and runs, and is safe to use from several processes. The cache
+     is bounded in size by evicting the least recently used molecules. Set MOLSCORE_NO_CACHE to disable.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        cache_dir: str = None,
+        max_size_mb: float = 1024,
+        evict_every: int = 1000,
+        **params,
+    ):
+        """
+        :param name: Name of the conformer generation protocol, used as a subdirectory
+        :param cache_dir: Overwrite the default cache directory
+        :param max_size_mb: Maximum size of this cache on disk, least recently used molecules are evicted beyond it
+        :param evict_every: Check the size of the cache every this many writes (per process)
+        :param params: Any parameters affecting the conformers generated (e.g., max_confs)
+        """
+        self.enabled = "MOLSCORE_NO_CACHE" not in os.environ.keys()
+        self.name = name
+        self.params = params
+        self.max_size = max_size_mb * 2**20
+        self.evict_every = evict_every
+        self._writes = 0
+        key = json.dumps({"name": name, **params}, sort_keys=True, default=str)
+        self.key = hashlib.sha256(key.encode()).hexdigest()[:32]
+        self.directory = os.path.join(cache_dir or get_cache_dir(), name, self.key)
+        if self.enabled:
+            self.evict()
+
+    def _path(self, smiles: str):
+        digest = hashlib.sha256(smiles.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}.mol")
+
+    def get(self, smiles: str):
+        """
+        Load a cached molecule
+        :param smiles: Canonical SMILES
+        :return: RDKit mol with conformers or None if not cached
+        """
+        if not self.enabled:
+            return None
+        path = self._path(smiles)
+        try:
+            with open(path, "rb") as f:
+                mol = Chem.Mol(f.read())
+            # Mark as recently used, so that it's evicted last
+            os.utime(path)
+            return mol
+        except (OSError, RuntimeError):
+            return None
+
+    def set(self, smiles: str, mol: Chem.rdchem.Mol):
+        """
+        Cache a molecule, written to a temporary file first so concurrent readers never see partial files
+        :param smiles: Canonical SMILES
+        :param mol: RDKit mol with conformers
+        """
+        if not self.enabled:
+            return
+        path = self._path(smiles)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(mol.ToBinary())
+        os.replace(tmp_path, path)
+        self._writes += 1
+        if self._writes % self.evict_every == 0:
+            self.evict()
+
+    def size(self) -> int:
+        """Size of this cache on disk in bytes"""
+        return sum(st.st_size for _, st in self._entries())
+
+    def _entries(self) -> list:
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith(".mol"):
+                    try:
+                        entries.append((entry.path, entry.stat()))
+                    except FileNotFoundError:
+                        continue
+        return entries
+
+    def evict(self):
+        """Remove the least recently used molecules until the cache is under 90% of its maximum size"""
+        entries = self._entries()
+        size = sum(st.st_size for _, st in entries)
+        if size <= self.max_size:
+            return
+        target = 0.9 * self.max_size
+        for path, st in sorted(entries, key=lambda e: e[1].st_mtime):
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= st.st_size
+        logger.debug(f"Evicted conformers from {self.directory} down to {size / 2**20:.0f} MB")
+
+
+# ----- Server related -----
+def get_runtime_dir():
+    """
+    Get the directory used to track running servers, can be overridden via the MOLSCORE_RUNTIME environment variable
+    """
+    if "MOLSCORE_RUNTIME" in os.environ.keys():
+        runtime_dir = os.environ["MOLSCORE_RUNTIME"]
+    else:
+        runtime_dir = os.path.join(get_cache_dir(), "servers")
+    os.makedirs(runtime_dir, exist_ok=True)
+    return runtime_dir
+
+
+def pid_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ServerRegistry:
+    """
+    Registry of running scoring function servers shared between processes, stored as JSON in the runtime directory
+     and guarded by a lockfile. Servers are keyed by their host, launch command and arguments, and record the PIDs of
+     the processes using them (one per scoring function instance) so that the last user can shut them down. The
+     runtime directory may be shared between nodes of a cluster, so servers of other hosts are never touched.
+    """
+
+    def __init__(self, runtime_dir: str = None):
+        """
+        :param runtime_dir: Overwrite the default runtime directory
+        """
+        self.directory = runtime_dir or get_runtime_dir()
+        self.path = os.path.join(self.directory, "registry.json")
+        self.lock_path = os.path.join(self.directory, "registry.lock")
+        self.hostname = socket.gethostname()
+
+    @staticmethod
+    def key(**params) -> str:
+        """Identify a server by any parameters used to launch it"""
+        key = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+    def log_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.log")
+
+    def socket_path(self, key: str) -> str:
+        path = os.path.join(self.directory, f"{key}.sock")
+        # Unix domain socket paths are limited to ~100 characters
+        if len(path) > 100:
+            path = os.path.join(tempfile.gettempdir(), f"molscore_{key}.sock")
+        return path
+
+    def is_local(self, server: dict) -> bool:
+        """Whether a server runs on this host, so that its PIDs and process group are meaningful"""
+        return server.get("host", self.hostname) == self.hostname
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, "rt") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write(self, servers: dict):
+        tmp_path = f"{self.path}.{self.hostname}.{os.getpid()}.tmp"
+        with open(tmp_path, "wt") as f:
+            json.dump(servers, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    @contextmanager
+    def lock(self, key: str = None):
+        """
+        Hold an exclusive lock on the registry, or only on launching the server with this key so that other servers
+         can be launched and attached to meanwhile
+        """
+        import fcntl
+
+        if key is None:
+            lock_path = self.lock_path
+        else:
+            lock_path = os.path.join(self.directory, f"{key}.lock")
+        with open(lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @contextmanager
+    def edit(self):
+        """
+        Lock the registry and yield servers by key i.e., {key: {'host', 'url', 'unix_socket', 'pgid', 'cmd', 'users', 'keep_alive'}},
+         users of servers on this host that are no longer running are removed and any changes are saved on exit
+        """
+        with self.lock():
+            servers = self._read()
+            for server in servers.values():
+                if self.is_local(server):
+                    server["users"] = [pid for pid in server["users"] if pid_exists(pid)]
+            yield servers
+            self._write(servers)
+
+    @staticmethod
+    def terminate(pgid: int, unix_socket: str = None):
+        """Terminate a server by process group, and remove its Unix domain socket"""
+        try:
+            os.killpg(pgid, signal.SIGTERM)
+        except OSError:
+            pass
+        if unix_socket and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+
+    def shutdown(self, force: bool = False):
+        """
+        Shut down servers of this host kept alive without users
+        :param force: Also shut down servers that are still in use
+        """
+        with self.edit() as servers:
+            for key in list(servers.keys()):
+                if not self.is_local(servers[key]):
+                    continue
+                if force or not servers[key]["users"]:
+                    self.terminate(servers[key]["pgid"], servers[key].get("unix_socket"))
+                    del servers[key]
+
+
 # ----- Chemistry related -----
 def disable_rdkit_logging():
     """
@@ -461,6 +1167,25 @@ def read_smiles(file_path):
     return smiles
 
 
+def iter_smiles(file_path, chunk_size: int = 100000):
+    """Read a smiles file separated by \n in chunks of at most chunk_size, skipping empty lines"""
+    if any(["gz" in ext for ext in os.path.basename(file_path).split(".")[1:]]):
+        f = gzip.open(file_path, "rt")
+    else:
+        f = open(file_path, "rt")
+    with f:
+        chunk = []
+        for line in f:
+            smi = line.rstrip("\r\n")
+            if smi:
+                chunk.append(smi)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
 def write_smiles(smiles, file_path):
     """Save smiles to a file path seperated by \n"""
     if (not os.path.exists(os.path.dirname(file_path))) and (
@@ -698,6 +1423,37 @@ class Fingerprints:
             return Generate.Gen2DFingerprint(mol, Gobbi_Pharm2D.factory)
 
 
+def pack_fps(fps: list):
+    """
+    Pack a list of RDKit ExplicitBitVect fingerprints into a (n, ceil(nBits/8)) uint8 array
+    :param fps: List of ExplicitBitVect of equal length
+    :return: Packed array and number of bits, or None if fingerprints are not ExplicitBitVects
+    """
+    if (len(fps) == 0) or not all(
+        isinstance(fp, DataStructs.ExplicitBitVect) for fp in fps
+    ):
+        return None
+    n_bits = fps[0].GetNumBits()
+    array = np.zeros((len(fps), n_bits), dtype=np.uint8)
+    for i, fp in enumerate(fps):
+        DataStructs.ConvertToNumpyArray(fp, array[i])
+    return np.packbits(array, axis=1, bitorder="little"), n_bits
+
+
+def unpack_fps(packed: np.ndarray, n_bits: int) -> list:
+    """
+    Unpack a uint8 array created by pack_fps back into a list of RDKit ExplicitBitVect fingerprints
+    """
+    if n_bits % 8 == 0:
+        return [DataStructs.CreateFromFPSText(row.tobytes().hex()) for row in packed]
+    fps = []
+    for row in np.unpackbits(packed, axis=1, count=n_bits, bitorder="little"):
+        fp = DataStructs.ExplicitBitVect(int(n_bits))
+        fp.SetBitsFromList(np.flatnonzero(row).tolist())
+        fps.append(fp)
+    return fps
+
+
 class SimilarityMeasures:
     @staticmethod
     def get(name, bulk=False):
@@ -0,0 +1,109 @@
+import argparse
+import json
+import os
+import random
+import re
+import time
+from glob import glob
+
+from rdkit import Chem
+
+from molscore.scoring_functions.reaction_filter import (
+    DecoratedReactionFilter,
+    SelectiveDecoratedReactionFilter,
+)
+
+DECORATIONS = [
+    "[*]c1ccccc1",
+    "[*]c1ccc(Cl)cc1",
+    "[*]c1ccccc1OC",
+    "[*]c1ncccn1",
+    "[*]c1nc2ccccc2s1",
+    "[*]C(=O)c1ccccc1",
+    "[*]C(=O)c1ccncc1",
+    "[*]C(=O)C1CCCCC1",
+    "[*]C(=O)C(C)(C)C",
+    "[*]C(=O)CC",
+    "[*]C(=O)N1CCCC1",
+    "[*]CC(=O)Nc1ccccc1",
+    "[*]CCc1ccccc1",
+    "[*]Cc1ccco1",
+    "[*]S(=O)(=O)c1ccccc1",
+]
+
+
+def decorate(scaffold: str, n: int, seed: int = 123):
+    """Randomly decorate a LibINVENT scaffold with atom mapped attachment points e.g., [N:0]"""
+    random.seed(seed)
+    vectors = sorted(set(re.findall(r":([0-9]+)\]", scaffold)))
+    # Add dummy atoms to attachment points so that decorations can be zipped on
+    scaffold = re.sub(r"\[([a-zA-Z]+):([0-9]+)\]", r"\1([*:\2])", scaffold)
+    scaffold = Chem.MolFromSmiles(scaffold)
+    smiles = []
+    for _ in range(n):
+        decorations = ".".join(
+            random.choice(DECORATIONS).replace("[*]", f"[*:{v}]") for v in vectors
+        )
+        mol = Chem.molzip(scaffold, Chem.MolFromSmiles(decorations))
+        smiles.append(Chem.MolToSmiles(mol))
+    return smiles
+
+
+def main(configs: list, n: int, n_jobs: int):
+    for config in configs:
+        with open(config, "rt") as f:
+            cfg = json.load(f)
+        for sf in cfg["scoring_functions"]:
+            if sf["name"] == "SelectiveDecoratedReactionFilter":
+                sf_class = SelectiveDecoratedReactionFilter
+            elif sf["name"] == "DecoratedReactionFilter":
+                sf_class = DecoratedReactionFilter
+            else:
+                continue
+            parameters = dict(sf["parameters"], n_jobs=n_jobs)
+            smiles = decorate(parameters["scaffold"], n)
+            # Decorate the scaffold, and also benchmark the full set of LibINVENT reactions
+            scaffold = re.sub(r"\[([a-zA-Z]+):[0-9]+\]", r"\1", parameters["scaffold"])
+            for name, inst in [
+                (sf["name"], sf_class(**parameters)),
+                (
+                    "DecoratedReactionFilter",
+                    DecoratedReactionFilter(
+                        prefix=parameters["prefix"],
+                        scaffold=scaffold,
+                        n_jobs=n_jobs,
+                    ),
+                ),
+            ]:
+                # Score once and again to measure cached synthon analysis
+                for run in ["first", "repeat"]:
+                    t0 = time.time()
+                    inst(smiles)
+                    t = time.time() - t0
+                    print(
+                        f"{os.path.basename(config)} {name} ({run}): {t:.2f}s ({n/t:.0f} mol/s)"
+                    )
+                inst.executor.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark reaction filters on decorated scaffolds from LibINVENT configs"
+    )
+    parser.add_argument(
+        "configs",
+        type=str,
+        nargs="*",
+        default=[os.path.join(os.path.dirname(__file__), "..", "configs", "LibINVENT")],
+        help="Config files or directories of config files",
+    )
+    parser.add_argument("--n", type=int, default=1000, help="Number of molecules")
+    parser.add_argument("--n_jobs", type=int, default=1, help="Number of jobs")
+    args = parser.parse_args()
+    configs = []
+    for arg in args.configs:
+        if os.path.isdir(arg):
+            configs.extend(glob(os.path.join(arg, "*.json")))
+        else:
+            configs.append(arg)
+    main(configs, args.n, args.n_jobs)
@@ -48,5 +48,38 @@ class TestADParallel(BaseTests.TestScoringFunction):
         print(f"\nAD Output:\n{json.dumps(cls.output, indent=2)}\n")
 
 
+class TestADkNN(BaseTests.TestScoringFunction):
+    # Only set up once per class, otherwise too long
+    @classmethod
+    def setUpClass(cls):
+        # Clean the output directory
+        mg = MockGenerator(seed_no=0)
+        cls.ref_smiles = mg.sample(500)
+        # Instantiate
+        cls.obj = ApplicabilityDomain
+        cls.inst = ApplicabilityDomain(
+            prefix="test",
+            ref_smiles=cls.ref_smiles,
+            fp="ECFP4c",
+            qed=True,
+            physchem=True,
+            method="kNN",
+            k=5,
+        )
+        # Call
+        mg = MockGenerator(seed_no=123)
+        cls.input = mg.sample(5)
+        cls.output = cls.inst(smiles=cls.input)
+        print(f"\nAD Output:\n{json.dumps(cls.output, indent=2)}\n")
+
+    def test_reference_in_domain(self):
+        output = self.inst(smiles=self.ref_smiles[:50])
+        for o in output:
+            self.assertEqual(o["test_physchem_in_AD"], 1.0)
+            self.assertEqual(
+                o["test_in_AD"], float(o["test_kNN_dist"] <= self.inst.knn_threshold)
+            )
+
+
 if __name__ == "__main__":
     unittest.main()
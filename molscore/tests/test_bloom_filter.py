@@ -1,8 +1,13 @@
 import json
+import os
+import tempfile
 import unittest
 
+from rdkit import Chem
+
 from molscore import resources
-from molscore.scoring_functions.bloom_filter import BloomFilter
+from molscore.scoring_functions.bloom_filter import BloomFilter, build_bloom_filter
+from molscore.scoring_functions.utils import write_smiles
 from molscore.tests import BaseTests, MockGenerator
 
 
@@ -29,5 +34,71 @@ class TestBloomFilter(BaseTests.TestScoringFunction):
         print(f"\nBloomFilter Output:\n{json.dumps(cls.output, indent=2)}\n")
 
 
+class TestBloomFilterBuild(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        mg = MockGenerator(seed_no=123, augment_invalids=True)
+        cls.ref_sample = mg.sample(100)
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.smiles_path = os.path.join(cls.tmp_dir.name, "ref.smi")
+        write_smiles(cls.ref_sample, cls.smiles_path)
+        cls.inst = BloomFilter(
+            prefix="test", smiles_path=cls.smiles_path, chunk_size=16
+        )
+        cls.valid = [smi for smi in cls.ref_sample if smi and Chem.MolFromSmiles(smi)]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_saved(self):
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir.name, "ref.bloom")))
+        self.assertFalse(
+            os.path.exists(os.path.join(self.tmp_dir.name, "ref.bloom.parts"))
+        )
+
+    def test_inside(self):
+        output = self.inst(smiles=self.valid)
+        self.assertTrue(all(o["test_inside"] == 1 for o in output))
+
+    def test_mols(self):
+        output = self.inst(smiles=self.valid)
+        mol_output = self.inst(smiles=[Chem.MolFromSmiles(smi) for smi in self.valid])
+        self.assertEqual(
+            [o["test_inside"] for o in output], [o["test_inside"] for o in mol_output]
+        )
+
+    def test_resume(self):
+        # Simulate an interrupted build by leaving checkpointed chunks behind
+        bloom_path = os.path.join(self.tmp_dir.name, "resumed.bloom")
+        with open(self.smiles_path, "rt") as f:
+            n_lines = len(f.read().splitlines())
+        parts_dir = bloom_path + ".parts"
+        os.makedirs(parts_dir)
+        with open(os.path.join(parts_dir, "000000.smi"), "wt") as f:
+            f.write("C\n")
+        stat = os.stat(self.smiles_path)
+        with open(os.path.join(parts_dir, "progress.json"), "wt") as f:
+            json.dump(
+                {
+                    "source": {
+                        "smiles_path": os.path.abspath(self.smiles_path),
+                        "size": stat.st_size,
+                        "mtime": stat.st_mtime,
+                        "canonize": True,
+                        "chunk_size": n_lines,
+                    },
+                    "counts": [1],
+                },
+                f,
+            )
+        bloom = build_bloom_filter(
+            self.smiles_path, bloom_path, chunk_size=n_lines, resume=True
+        )
+        # Only the checkpointed chunk is used
+        self.assertTrue("C" in bloom)
+        self.assertFalse(all(Chem.CanonSmiles(smi) in bloom for smi in self.valid))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,105 @@
+import atexit
+import json
+import os
+import tempfile
+import unittest
+
+from molscore import MolScore
+from molscore.scoring_functions.descriptors import MolecularDescriptors
+from molscore.tests import BaseTests, MockGenerator
+
+
+class TestMolecularDescriptors(BaseTests.TestScoringFunction):
+    # Only set up once per class, otherwise too long
+    @classmethod
+    def setUpClass(cls):
+        # Instantiate
+        cls.obj = MolecularDescriptors
+        cls.inst = MolecularDescriptors(prefix="test")
+        # Call
+        mg = MockGenerator(seed_no=123)
+        cls.input = mg.sample(5)
+        cls.output = cls.inst(smiles=cls.input)
+        print(f"\n{cls.__name__} Output:\n{json.dumps(cls.output, indent=2)}\n")
+
+
+class TestMolecularDescriptorsSubset(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        mg = MockGenerator(seed_no=123, augment_invalids=True)
+        cls.input = mg.sample(10)
+        cls.subset = ["QED", "PenLogP"]
+        cls.output = MolecularDescriptors(prefix="test", subset=cls.subset)(
+            smiles=cls.input
+        )
+        cls.full_output = MolecularDescriptors(prefix="test")(smiles=cls.input)
+
+    def test_only_subset(self):
+        for o in self.output:
+            self.assertEqual(
+                set(o.keys()), {"smiles"} | {f"test_{m}" for m in self.subset}
+            )
+
+    def test_subset_matches(self):
+        for o, fo in zip(self.output, self.full_output):
+            for k, v in o.items():
+                self.assertEqual(v, fo[k])
+
+
+class TestMolScoreConsumedMetrics(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.input = MockGenerator(seed_no=123).sample(5)
+
+    def run_task(self, metrics: list):
+        config = {
+            "task": "consumed_metrics",
+            "output_dir": self.tmp.name,
+            "load_from_previous": False,
+            "monitor_app": False,
+            "diversity_filter": {"run": False},
+            "scoring_functions": [
+                {
+                    "name": "MolecularDescriptors",
+                    "run": True,
+                    "parameters": {"prefix": "desc", "n_jobs": 1},
+                }
+            ],
+            "scoring": {
+                "method": "wsum",
+                "metrics": [
+                    {"name": m, "weight": 1, "modifier": "raw", "parameters": {}}
+                    for m in metrics
+                ],
+            },
+        }
+        config_path = os.path.join(self.tmp.name, "config.json")
+        with open(config_path, "w") as f:
+            json.dump(config, f)
+        ms = MolScore(
+            model_name="test", task_config=config_path, output_dir=self.tmp.name
+        )
+        self.addCleanup(ms.kill_monitor)
+        self.addCleanup(atexit.unregister, ms.write_scores)
+        return ms
+
+    def test_only_consumed(self):
+        ms = self.run_task(["desc_QED", "desc_TPSA"])
+        self.assertEqual(ms.scoring_functions[0].subset, ["QED", "TPSA"])
+        ms(self.input)
+        self.assertEqual(
+            sorted(c for c in ms.main_df.columns if c.startswith("desc_")),
+            ["desc_QED", "desc_TPSA"],
+        )
+
+    def test_missing_metric(self):
+        # Metrics that aren't returned are ignored when subsetting, but still fail scoring
+        ms = self.run_task(["desc_QED", "desc_Missing"])
+        self.assertEqual(ms.scoring_functions[0].subset, ["QED"])
+        with self.assertRaises(AssertionError):
+            ms(self.input)
+
+
+if __name__ == "__main__":
+    unittest.main()
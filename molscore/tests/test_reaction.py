@@ -1,10 +1,15 @@
 import json
 import unittest
+from unittest import mock
 
+from molscore.scoring_functions import reaction_filter
 from molscore.scoring_functions.reaction_filter import (
     DecoratedReactionFilter,
     SelectiveDecoratedReactionFilter,
+    bond_disconnectable,
+    bond_key,
 )
+from molscore.scoring_functions.utils import get_mol
 from molscore.tests import BaseTests
 
 
@@ -93,5 +98,98 @@ class TestSelectiveDecoratedReactionFilter(BaseTests.TestScoringFunction):
         )
 
 
+class TestDisconnectionCache(unittest.TestCase):
+    def setUp(self):
+        reaction_filter._disconnection_cache.clear()
+        self.input = [
+            "Cc1nc2n(c(=O)c1CCN1CCC(c3noc4cc(F)ccc34)CC1)CCCC2",
+            "O=c1[nH]c2ccccc2n1CCCN1CCC(n2c(=O)[nH]c3cc(Cl)ccc32)CC1",
+            "Cc1nc2ccccn2c(=O)c1CCN1CCc2oc3ccccc3c2C1",
+            "O=c1c(CO)coc2cc(OCCCN3CCC(c4noc5cc(F)ccc45)CC3)ccc12",
+            # Two new bonds with the same canonical key
+            "COc1ccc(OC)cc1",
+            "Clc1ccc(Cl)cc1",
+        ]
+
+    def tearDown(self):
+        reaction_filter._disconnection_cache.clear()
+
+    def _new_bonds(self, inst, smiles):
+        molecule = get_mol(smiles)
+        return molecule, inst._identify_new_bonds(molecule)
+
+    def _disconnectable(self, inst):
+        results = []
+        for smi in self.input:
+            molecule, new_bonds = self._new_bonds(inst, smi)
+            results.append(
+                [
+                    bond_disconnectable(molecule, bond, inst.reaction_smirks)
+                    for bond in new_bonds
+                ]
+            )
+        return results
+
+    def _check(self, inst, cached: bool):
+        with mock.patch.object(reaction_filter, "MIN_CACHED_REACTIONS", float("inf")):
+            uncached = self._disconnectable(inst)
+            self.assertEqual(len(reaction_filter._disconnection_cache), 0)
+        for _ in range(2):
+            self.assertEqual(self._disconnectable(inst), uncached)
+        self.assertEqual(len(reaction_filter._disconnection_cache) > 0, cached)
+
+    def test_cached(self):
+        inst = DecoratedReactionFilter(prefix="test", scaffold="c1ccccc1")
+        self.assertGreaterEqual(
+            len(inst.reaction_smirks), reaction_filter.MIN_CACHED_REACTIONS
+        )
+        self._check(inst, cached=True)
+
+    def test_uncached(self):
+        inst = DecoratedReactionFilter(
+            prefix="test",
+            scaffold="c1ccccc1",
+            custom_reactions=DecoratedReactionFilter.LibINVENT_reactions[-1:],
+            libinvent_reactions=False,
+        )
+        self.assertLess(len(inst.reaction_smirks), reaction_filter.MIN_CACHED_REACTIONS)
+        self._check(inst, cached=False)
+
+    def test_shared_key(self):
+        inst = DecoratedReactionFilter(prefix="test", scaffold="c1ccccc1")
+        for smi in ["COc1ccc(OC)cc1", "Clc1ccc(Cl)cc1"]:
+            molecule, new_bonds = self._new_bonds(inst, smi)
+            self.assertEqual(len(new_bonds), 2)
+            self.assertEqual(
+                bond_key(molecule, new_bonds[0]), bond_key(molecule, new_bonds[1])
+            )
+            with mock.patch.object(
+                reaction_filter, "MIN_CACHED_REACTIONS", float("inf")
+            ):
+                uncached = [
+                    bond_disconnectable(molecule, bond, inst.reaction_smirks)
+                    for bond in new_bonds
+                ]
+            n_cached = len(reaction_filter._disconnection_cache)
+            cached = [
+                bond_disconnectable(molecule, bond, inst.reaction_smirks)
+                for bond in new_bonds
+            ]
+            self.assertEqual(cached, uncached)
+            # The second bond is looked up from the first bond's entry
+            self.assertEqual(len(reaction_filter._disconnection_cache), n_cached + 1)
+
+    def test_thread_scores(self):
+        inst = DecoratedReactionFilter(
+            prefix="test",
+            scaffold="C1CCN(CC1)CC",
+            executor={"backend": "thread", "n_jobs": 4},
+        )
+        with mock.patch.object(reaction_filter, "MIN_CACHED_REACTIONS", float("inf")):
+            uncached = [r["test_score"] for r in inst(self.input * 4)]
+        for _ in range(2):
+            self.assertEqual([r["test_score"] for r in inst(self.input * 4)], uncached)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,480 @@
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from unittest import mock
+
+import numpy as np
+import requests
+
+from molscore.scoring_functions.base import BaseServerSF, ColumnarResults
+from molscore.scoring_functions.external_server import POSTServer
+from molscore.scoring_functions.servers.protocol import (
+    columns_to_records,
+    decode_columnar,
+    encode_columnar,
+)
+from molscore.scoring_functions.utils import ServerRegistry, pid_exists
+
+# Servers import sibling modules directly as they run in their own environment
+SERVERS_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "scoring_functions", "servers"
+)
+sys.path.insert(0, SERVERS_DIR)
+from model_server import HostedModel, ModelServer, ServerBusy  # noqa: E402
+
+
+class TestProtocol(unittest.TestCase):
+    def test_columnar_roundtrip(self):
+        results = [
+            {"smiles": "CCO", "pred": 0.5, "active": True},
+            {"smiles": "c1ccccc1", "pred": 0.1, "active": False, "extra": 2},
+        ]
+        smiles, columns = decode_columnar(encode_columnar(results))
+        self.assertEqual(smiles, ["CCO", "c1ccccc1"])
+        self.assertEqual(list(columns.keys()), ["pred", "active", "extra"])
+        self.assertEqual(columns["pred"].tolist(), [0.5, 0.1])
+        self.assertEqual(columns["active"].tolist(), [True, False])
+        self.assertTrue(np.isnan(columns["extra"][0]))
+
+    def test_columnar_fallback(self):
+        # None can't be represented without pickling, so should fall back to JSON
+        results = [{"smiles": "CCO", "pred": 0.5}, {"smiles": "X", "pred": None}]
+        self.assertIsNone(encode_columnar(results))
+        # Missing strings would otherwise be encoded as 'nan'
+        results = [{"smiles": "CCO", "name": "a"}, {"smiles": "X"}]
+        self.assertIsNone(encode_columnar(results))
+        results = [{"smiles": "CCO", "name": "a"}, {"smiles": "X", "name": 1.0}]
+        self.assertIsNone(encode_columnar(results))
+        # Ragged values can't be stacked
+        results = [{"smiles": "CCO", "fp": [1, 2]}, {"smiles": "X", "fp": [1]}]
+        self.assertIsNone(encode_columnar(results))
+        # Complete string columns are still encoded
+        results = [{"smiles": "CCO", "name": "a"}, {"smiles": "X", "name": "b"}]
+        _, columns = decode_columnar(encode_columnar(results))
+        self.assertEqual(columns["name"].tolist(), ["a", "b"])
+
+    def test_columns_to_records(self):
+        records = columns_to_records(
+            ["CCO", "X"],
+            {"pred": np.array([0.5, 0.0]), "active": np.array([True, False])},
+        )
+        self.assertEqual(
+            records,
+            [
+                {"smiles": "CCO", "pred": 0.5, "active": True},
+                {"smiles": "X", "pred": 0.0, "active": False},
+            ],
+        )
+        self.assertEqual(columns_to_records(["CCO"], {}), [{"smiles": "CCO"}])
+
+    def test_from_records_missing(self):
+        results = ColumnarResults.from_records(
+            [{"smiles": "CCO", "name": "a", "pred": 0.5}, {"smiles": "CCC"}]
+        )
+        self.assertEqual(results["name"][0], "a")
+        self.assertTrue(np.isnan(results["name"][1]))
+        self.assertEqual(results["pred"].dtype.kind, "f")
+        self.assertEqual(results.to_frame().fillna(0.0)["name"].tolist(), ["a", 0.0])
+
+    def test_concatenate(self):
+        results = ColumnarResults.concatenate(
+            [
+                ColumnarResults(["CCO"], {"pred": [0.5], "name": ["a"]}),
+                ColumnarResults(["CCC", "CCN"], {"pred": [0.1, 0.2]}),
+            ]
+        )
+        self.assertEqual(results.smiles, ["CCO", "CCC", "CCN"])
+        self.assertEqual(results["pred"].tolist(), [0.5, 0.1, 0.2])
+        self.assertEqual(results["name"][0], "a")
+        self.assertTrue(np.isnan(results["name"][1]))
+
+
+class TestHostedModel(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+
+    def predict(self, smiles):
+        self.batches.append(len(smiles))
+        time.sleep(0.05)
+        return [{"smiles": smi, "length": len(smi)} for smi in smiles]
+
+    def test_micro_batching(self):
+        server = HostedModel(self.predict, batch_window=0.2, cache_size=0)
+        requests_smiles = [["C" * (i + 1), "CCO"] for i in range(8)]
+        with ThreadPoolExecutor(8) as pool:
+            futures = list(pool.map(server.submit, requests_smiles))
+        for smiles, future in zip(requests_smiles, futures):
+            results = future.result()
+            self.assertEqual([r["smiles"] for r in results], smiles)
+            self.assertEqual([r["length"] for r in results], [len(s) for s in smiles])
+        # Concurrent requests are merged into fewer model calls
+        self.assertLess(len(self.batches), len(requests_smiles))
+        self.assertEqual(sum(self.batches), 16)
+
+    def test_max_batch_size(self):
+        server = HostedModel(self.predict, batch_window=0.2, max_batch_size=4)
+        futures = [server.submit(["C", "CC"]) for _ in range(4)]
+        [f.result() for f in futures]
+        self.assertTrue(all(n <= 4 for n in self.batches))
+
+    def test_backpressure(self):
+        server = HostedModel(
+            self.predict, batch_window=0, max_pending=2, queue_timeout=0.01
+        )
+        future = server.submit(["C", "CC"])
+        with self.assertRaises(ServerBusy):
+            server.submit(["CCC"])
+        future.result()
+
+    def test_cache(self):
+        server = HostedModel(self.predict, batch_window=0)
+        results = server.submit(["CCO", "OCC", "CCO"]).result()
+        # Equivalent SMILES are predicted once, but returned as requested
+        self.assertEqual(self.batches, [1])
+        self.assertEqual([r["smiles"] for r in results], ["CCO", "OCC", "CCO"])
+        server.submit(["OCC", "CCC"]).result()
+        self.assertEqual(self.batches, [1, 1])
+        self.assertEqual(server.cache.hits, 1)
+        self.assertEqual(server.cache.misses, 4)
+
+    def test_persistent_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache.db")
+            server = HostedModel(self.predict, cache_path=path, model_key="a")
+            server.submit(["CCO", "CCC"]).result()
+            # A new server for the same model re-uses predictions
+            server = HostedModel(self.predict, cache_path=path, model_key="a")
+            results = server.submit(["OCC", "CCN"]).result()
+            self.assertEqual(self.batches, [2, 1])
+            self.assertEqual(results[0], {"smiles": "OCC", "length": 3})
+            # But not for a different model
+            server = HostedModel(self.predict, cache_path=path, model_key="b")
+            server.submit(["CCO"]).result()
+            self.assertEqual(self.batches, [2, 1, 1])
+
+
+class TestModelServer(unittest.TestCase):
+    @staticmethod
+    def predict(factor, smiles):
+        return [{"smiles": smi, "length": len(smi) * factor} for smi in smiles]
+
+    def setUp(self):
+        from werkzeug.serving import make_server
+
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--factor", type=int, default=1)
+        parser.add_argument("--batch_window", type=float, default=0.005)
+        self.loaded = []
+
+        def load(args):
+            self.loaded.append(args.factor)
+            return partial(self.predict, args.factor)
+
+        self.server = ModelServer(name="test", parser=parser, load=load)
+        self.server.load_model("test", [])
+        self.httpd = make_server("localhost", 0, self.server.app, threaded=True)
+        self.url = f"http://localhost:{self.httpd.server_port}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.httpd.shutdown()
+
+    def test_http(self):
+        response = requests.post(self.url + "/", json={"smiles": ["CCO"]})
+        self.assertEqual(response.json(), [{"smiles": "CCO", "length": 3}])
+        stats = requests.get(self.url + "/stats").json()
+        self.assertEqual(stats["models"]["test"]["cache"]["misses"], 1)
+
+    def test_multi_model(self):
+        response = requests.post(self.url + "/model/double", json={"smiles": ["CCO"]})
+        self.assertEqual(response.status_code, 404)
+        response = requests.post(
+            self.url + "/load", json={"name": "double", "args": ["--factor", "2"]}
+        )
+        self.assertEqual(response.status_code, 200)
+        response = requests.post(self.url + "/model/double", json={"smiles": ["CCO"]})
+        self.assertEqual(response.json(), [{"smiles": "CCO", "length": 6}])
+        # Models with the same arguments (other than runtime arguments) are only loaded once
+        for name, args in [
+            ("double2", ["--factor", "2"]),
+            ("single", ["--batch_window", "0"]),
+        ]:
+            requests.post(self.url + "/load", json={"name": name, "args": args})
+        self.assertEqual(self.loaded, [1, 2])
+        self.assertIs(self.server.models["single"], self.server.models["test"])
+        self.assertEqual(
+            requests.get(self.url + "/models").json(),
+            ["test", "double", "double2", "single"],
+        )
+        response = requests.post(
+            self.url + "/load", json={"name": "x", "args": ["--factor", "a"]}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_metrics(self):
+        for smiles in [["CCO"], ["CCO", "CCC", "CCN"]]:
+            response = requests.post(self.url + "/", json={"smiles": smiles})
+            self.assertGreaterEqual(float(response.headers["X-Model-Time"]), 0)
+            self.assertGreaterEqual(float(response.headers["X-Queue-Time"]), 0)
+        metrics = requests.get(self.url + "/metrics").json()
+        self.assertGreater(metrics["memory"]["peak_rss_mb"], 0)
+        model = metrics["models"]["test"]
+        self.assertEqual((model["requests"], model["smiles"]), (2, 4))
+        self.assertEqual(model["batch_size_histogram"], {"1": 1, "4": 1})
+        self.assertEqual(model["cache"]["hits"], 1)
+        self.assertEqual(set(model["model_latency"]), {"p50", "p90", "p99", "max"})
+
+    def test_client_timings(self):
+        client = object.__new__(BaseServerSF)
+        client.__setstate__(
+            {
+                "prefix": "test",
+                "server_url": self.url,
+                "model_url": None,
+                "unix_socket": None,
+                "chunk_size": 2,
+                "max_in_flight": 2,
+                "compress": False,
+                "busy_retries": 0,
+                "timings": {},
+                "server_metrics": {},
+                "_session": None,
+                "_pool": None,
+            }
+        )
+        results = client(["CCO", "CCC", "CCN"], columnar=True)
+        self.assertEqual(results["test_length"].tolist(), [3, 3, 3])
+        self.assertEqual(client.timings["requests"], 2)
+        self.assertEqual(
+            set(client.timings),
+            {"requests", "http", "server_queue", "server_model", "total"},
+        )
+        # Metrics are only pulled from the server when logged
+        self.assertEqual(client.server_metrics, {})
+        with self.assertLogs("molscore", level="DEBUG") as logs:
+            client.log_metrics(logging.getLogger("molscore"))
+        self.assertEqual(client.server_metrics["models"]["test"]["smiles"], 3)
+        self.assertTrue(any("2 requests" in line for line in logs.output))
+
+    def test_reload_model(self):
+        # A worker that hasn't loaded the model responds 404, which is reloaded without a busy retry
+        server_kwargs = {"factor": 2}
+        name = ServerRegistry.key(server_kwargs=server_kwargs)
+        client = object.__new__(BaseServerSF)
+        client.__setstate__(
+            {
+                "prefix": "test",
+                "server_url": self.url,
+                "model_url": f"{self.url}/model/{name}",
+                "server_kwargs": server_kwargs,
+                "unix_socket": None,
+                "chunk_size": None,
+                "max_in_flight": 1,
+                "compress": False,
+                "busy_retries": 0,
+                "timings": {},
+                "server_metrics": {},
+                "_session": None,
+                "_pool": None,
+            }
+        )
+        results = client(["CCO", "CCCC"], columnar=True)
+        self.assertEqual(self.loaded, [1, 2])
+        self.assertEqual(results["test_length"].tolist(), [6, 8])
+        self.assertEqual(client.timings["requests"], 1)
+
+
+class TestPOSTServer(unittest.TestCase):
+    def setUp(self):
+        from flask import Flask, jsonify, request
+        from werkzeug.serving import make_server
+
+        self.chunk_sizes = []
+        app = Flask("external")
+
+        @app.route("/", methods=["POST"])
+        def score():
+            # Fail the first request to be retried
+            if not self.chunk_sizes:
+                self.chunk_sizes.append(0)
+                return "Unavailable", 503
+            names = [b.split("\n")[0] for b in request.form["sdf"].split("$$$$\n")[:-1]]
+            self.chunk_sizes.append(len(names))
+            return jsonify({"data": [{"value": int(n.split("_")[1])} for n in names]})
+
+        self.httpd = make_server("localhost", 0, app, threaded=True)
+        self.url = f"http://localhost:{self.httpd.server_port}/"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.httpd.shutdown()
+
+    def test_chunks(self):
+        smiles = ["CCO", "c1ccccc1", "invalid", "CCN", "CCC"]
+        names = [f"0_{i}" for i in range(len(smiles))]
+        scorer = POSTServer(
+            "test", self.url, "sdf", "value", chunk_size=2, max_in_flight=2
+        )
+        results = scorer(smiles=smiles, file_names=names)
+        self.assertEqual(sorted(self.chunk_sizes), [0, 2, 2])
+        self.assertEqual([r["test_server_value"] for r in results], [0.0, 1, 0.0, 3, 4])
+
+    def test_unreachable(self):
+        smiles = ["CCO", "invalid", "CCN"]
+        names = [f"0_{i}" for i in range(len(smiles))]
+        scorer = POSTServer("test", "http://localhost:1/", "sdf", "value", retries=0)
+        results = scorer(smiles=smiles, file_names=names)
+        self.assertEqual(
+            results,
+            [
+                {"smiles": smi, "test_value": 0.0, "test_server_value": 0.0}
+                for smi in smiles
+            ],
+        )
+
+
+class TemplateServerSF(BaseServerSF):
+    """Run the template server with this Python rather than from a conda environment"""
+
+    def __init__(
+        self, share_server=True, keep_alive=False, server_kwargs={}, transport="tcp"
+    ):
+        self.prefix = "template"
+        self.engine = "python"
+        self.env_name = "template"
+        self.server_path = os.path.join(SERVERS_DIR, "base.py")
+        self.server_kwargs = server_kwargs
+        self.server_grace = 30
+        self.max_in_flight = 1
+        self.share_server = share_server
+        self.keep_alive = keep_alive
+        self.server_key = None
+        self.model_url = None
+        self.transport = transport
+        self.unix_socket = None
+        self.server_subprocess = None
+        self._session = None
+        self._pool = None
+        self.timings = {}
+        self.server_metrics = {}
+        self._timings_lock = threading.Lock()
+        self._launch_server()
+
+    def _server_command(self, address):
+        return f"cd {SERVERS_DIR} && {sys.executable} {self.server_path} {address}"
+
+
+class TestServerRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(os.environ, {"MOLSCORE_RUNTIME": self.tmp.name})
+        self.env.start()
+
+    def tearDown(self):
+        ServerRegistry().shutdown(force=True)
+        self.env.stop()
+        self.tmp.cleanup()
+
+    def test_prune_users(self):
+        registry = ServerRegistry()
+        with registry.edit() as servers:
+            servers["a"] = {
+                "url": "",
+                "pgid": -1,
+                "cmd": "",
+                "users": [os.getpid(), 2**22 + 1],
+                "keep_alive": False,
+            }
+        with registry.edit() as servers:
+            self.assertEqual(servers["a"]["users"], [os.getpid()])
+
+    def test_other_host(self):
+        # The runtime directory may be shared between nodes, whose PIDs and process groups aren't ours
+        registry = ServerRegistry()
+        with registry.edit() as servers:
+            servers["a"] = {
+                "host": f"not-{registry.hostname}",
+                "url": "",
+                "pgid": 2**22 + 1,
+                "cmd": "",
+                "users": [2**22 + 1],
+                "keep_alive": False,
+            }
+        registry.shutdown(force=True)
+        with registry.edit() as servers:
+            self.assertEqual(servers["a"]["users"], [2**22 + 1])
+            del servers["a"]
+
+    def test_host_key(self):
+        sf1 = TemplateServerSF()
+        with mock.patch("socket.gethostname", return_value="other-host"):
+            sf2 = TemplateServerSF()
+        self.assertNotEqual(sf1.server_key, sf2.server_key)
+        self.assertNotEqual(sf1.server_url, sf2.server_url)
+        with ServerRegistry().edit() as servers:
+            self.assertEqual(servers[sf2.server_key]["host"], "other-host")
+        sf1._kill_server()
+        sf2._kill_server()
+
+    def test_share_server(self):
+        sf1 = TemplateServerSF()
+        sf2 = TemplateServerSF()
+        self.assertEqual(sf1.server_url, sf2.server_url)
+        self.assertIsNone(sf2.server_subprocess)
+        pgid = sf1.server_subprocess.pid
+        with ServerRegistry().edit() as servers:
+            self.assertEqual(servers[sf1.server_key]["users"], [os.getpid()] * 2)
+        # The server is only shut down by the last user
+        sf1._kill_server()
+        self.assertTrue(sf2._check_server())
+        sf2._kill_server()
+        with ServerRegistry().edit() as servers:
+            self.assertEqual(servers, {})
+        os.waitpid(pgid, 0)
+        self.assertFalse(pid_exists(pgid))
+
+    def test_keep_alive(self):
+        sf1 = TemplateServerSF(keep_alive=True)
+        url = sf1.server_url
+        sf1._kill_server()
+        sf2 = TemplateServerSF()
+        self.assertEqual(sf2.server_url, url)
+        self.assertTrue(sf2._check_server())
+        sf2._kill_server()
+
+    def test_multi_model(self):
+        class MultiModelSF(TemplateServerSF):
+            multi_model = True
+
+        sf1 = MultiModelSF(server_kwargs={"cache_size": 10})
+        sf2 = MultiModelSF(server_kwargs={"cache_size": 20})
+        self.assertEqual(sf1.server_url, sf2.server_url)
+        self.assertNotEqual(sf1.model_url, sf2.model_url)
+        models = requests.get(sf1.server_url + "/models").json()
+        self.assertEqual(len(models), 3)
+        sf1._kill_server()
+        sf2._kill_server()
+
+    def test_unix_socket(self):
+        for share_server in [True, False]:
+            sf1 = TemplateServerSF(share_server=share_server, transport="unix")
+            self.assertTrue(os.path.exists(sf1.unix_socket))
+            self.assertTrue(sf1._check_server())
+            if share_server:
+                sf2 = TemplateServerSF(transport="unix")
+                self.assertEqual(sf1.unix_socket, sf2.unix_socket)
+                self.assertTrue(sf2._check_server())
+                sf2._kill_server()
+            sf1._kill_server()
+            self.assertFalse(os.path.exists(sf1.unix_socket))
+
+
+if __name__ == "__main__":
+    unittest.main()
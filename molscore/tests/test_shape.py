@@ -1,8 +1,12 @@
 import json
 import os
+import tempfile
 import unittest
 
+from rdkit.Chem import AllChem as Chem
+
 from molscore.scoring_functions import Align3D
+from molscore.scoring_functions.utils import ConformerCache
 from molscore.tests import BaseTests, MockGenerator, test_files
 
 
@@ -67,5 +71,145 @@ class TestAlign3DParallel(BaseTests.TestScoringFunction):
         os.system(f"rm -r {os.path.join(cls.output_directory, '*')}")
 
 
+class TestAlign3DTimeout(unittest.TestCase):
+    # Only set up once per class, otherwise too long
+    @classmethod
+    def setUpClass(cls):
+        # Clean the output directory
+        cls.output_directory = BaseTests.TestScoringFunction.output_directory
+        os.makedirs(cls.output_directory, exist_ok=True)
+        # Instantiate
+        cls.inst = Align3D(
+            prefix="test",
+            ref_smiles=["Cc1ccc(-c2cc(C(F)(F)F)nn2-c2ccc(S(N)(=O)=O)cc2)cc1"],
+            similarity_method="Tanimoto",
+            agg_method="mean",
+            pharmacophore_similarity=True,
+            cache_conformers=False,
+            n_jobs=2,
+            timeout=0.01,
+        )
+        # Call
+        mg = MockGenerator(seed_no=123)
+        cls.input = mg.sample(5)
+        file_names = [str(i) for i in range(len(cls.input))]
+        cls.output = cls.inst(
+            smiles=cls.input, directory=cls.output_directory, file_names=file_names
+        )
+        print(f"\nAlign3D Output:\n{json.dumps(cls.output, indent=2)}\n")
+
+    def test_timeout(self):
+        for r in self.output:
+            self.assertEqual(r["test_shape_score"], 0.0)
+        # Workers are replaced, so the pool is still usable
+        self.assertEqual(len(self.inst.pool._workers), self.inst.pool.n_workers)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.system(f"rm -r {os.path.join(cls.output_directory, '*')}")
+
+
+class TestAlign3DCoarse(BaseTests.TestScoringFunction):
+    # Only set up once per class, otherwise too long
+    @classmethod
+    def setUpClass(cls):
+        # Clean the output directory
+        os.makedirs(cls.output_directory, exist_ok=True)
+        # Instantiate
+        cls.obj = Align3D
+        cls.inst = Align3D(
+            prefix="test",
+            ref_smiles=["Cc1ccc(-c2cc(C(F)(F)F)nn2-c2ccc(S(N)(=O)=O)cc2)cc1"],
+            ref_sdf=test_files["DRD2_ref_ligand"],
+            similarity_method="Tanimoto",
+            agg_method="mean",
+            pharmacophore_similarity=True,
+            coarse_top_k=5,
+            cache_conformers=True,
+        )
+        # Call
+        mg = MockGenerator(seed_no=123)
+        cls.input = mg.sample(5)
+        cls.file_names = [str(i) for i in range(len(cls.input))]
+        cls.output = cls.inst(
+            smiles=cls.input, directory=cls.output_directory, file_names=cls.file_names
+        )
+        print(f"\nAlign3D Output:\n{json.dumps(cls.output, indent=2)}\n")
+
+    def test_cached_conformers(self):
+        # Conformers are loaded from the cache, so scores are reproduced
+        output = self.inst(
+            smiles=self.input,
+            directory=self.output_directory,
+            file_names=self.file_names,
+        )
+        for o1, o2 in zip(self.output, output):
+            self.assertAlmostEqual(o1["test_shape_score"], o2["test_shape_score"])
+
+    def test_stage_times(self):
+        # Timings are logged, but not returned as (nondeterministic) metrics
+        for o in self.output:
+            self.assertFalse(any(k.endswith("_time") for k in o), o.keys())
+            self.assertNotIn("_timings", o)
+        self.assertEqual(set(self.inst.stage_times), {"embed", "coarse", "align"})
+
+    @classmethod
+    def tearDownClass(cls):
+        os.system(f"rm -r {os.path.join(cls.output_directory, '*')}")
+
+
+class TestConformerCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.smiles = MockGenerator(seed_no=123).sample(10)
+        self.mols = {}
+        for smi in self.smiles:
+            mol = Chem.AddHs(Chem.MolFromSmiles(smi))
+            Chem.EmbedMolecule(mol, randomSeed=123)
+            self.mols[smi] = mol
+
+    def test_get_set(self):
+        cache = ConformerCache("test", cache_dir=self.tmp.name, max_confs=1)
+        self.assertIsNone(cache.get(self.smiles[0]))
+        cache.set(self.smiles[0], self.mols[self.smiles[0]])
+        mol = cache.get(self.smiles[0])
+        self.assertEqual(mol.GetNumConformers(), 1)
+        self.assertEqual(
+            Chem.MolToSmiles(mol), Chem.MolToSmiles(self.mols[self.smiles[0]])
+        )
+
+    def test_evict(self):
+        cache = ConformerCache("test", cache_dir=self.tmp.name, max_confs=1)
+        for i, smi in enumerate(self.smiles):
+            cache.set(smi, self.mols[smi])
+            # Older molecules were used longer ago
+            os.utime(cache._path(smi), (i, i))
+        # Reading a molecule makes it the most recently used
+        cache.get(self.smiles[0])
+        size = cache.size()
+        sizes = [os.path.getsize(cache._path(smi)) for smi in self.smiles]
+        # Bound the cache to half its size, evicted on init and checked on every write
+        cache = ConformerCache(
+            "test",
+            cache_dir=self.tmp.name,
+            max_size_mb=size / 2 / 2**20,
+            evict_every=1,
+            max_confs=1,
+        )
+        self.assertLessEqual(cache.size(), 0.9 * size / 2)
+        self.assertIsNotNone(cache.get(self.smiles[0]))
+        self.assertIsNotNone(cache.get(self.smiles[-1]))
+        self.assertIsNone(cache.get(self.smiles[1]))
+        # Writes beyond the bound evict again
+        for smi in self.smiles:
+            cache.set(smi, self.mols[smi])
+            self.assertLessEqual(cache.size(), size / 2)
+        self.assertEqual(
+            cache.size(),
+            sum(s for smi, s in zip(self.smiles, sizes) if cache.get(smi) is not None),
+        )
+
+
 if __name__ == "__main__":
     unittest.main()
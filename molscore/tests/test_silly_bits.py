@@ -2,6 +2,8 @@ import json
 import tempfile
 import unittest
 
+from moleval.metrics.bit_count_index import BitCountIndex
+from moleval.metrics.metrics_utils import SillyWalks
 from molscore.scoring_functions.silly_bits import SillyBits
 from molscore.scoring_functions.utils import write_smiles
 from molscore.tests import BaseTests, MockGenerator
@@ -51,5 +53,34 @@ class TestSillyBitsParallel(BaseTests.TestScoringFunction):
             print(f"\n{cls.__name__} Output:\n{json.dumps(cls.output, indent=2)}\n")
 
 
+class TestBitCountIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        mg = MockGenerator(seed_no=123, augment_invalids=True)
+        cls.ref_sample = [smi for smi in mg.sample(200) if smi]
+        cls.input = mg.sample(20)
+        cls.index = BitCountIndex.from_mols(cls.ref_sample)
+
+    def test_sorted(self):
+        self.assertTrue((self.index.bits[1:] > self.index.bits[:-1]).all())
+        self.assertTrue((self.index.counts > 0).all())
+
+    def test_silly_ratios(self):
+        ratios = self.index.silly_ratios(
+            [BitCountIndex.mol_bits(smi) for smi in self.input]
+        )
+        for smi, ratio in zip(self.input, ratios):
+            result = SillyWalks._score(smi, self.index)
+            if result is None:
+                self.assertTrue(ratio != ratio)
+            else:
+                self.assertEqual(result[0], ratio)
+
+    def test_silly_walks(self):
+        sw = SillyWalks(self.ref_sample)
+        self.assertEqual(sw.index.bits.tolist(), self.index.bits.tolist())
+        self.assertEqual(sw.index.counts.tolist(), self.index.counts.tolist())
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,11 +1,15 @@
 import json
+import os
+import tempfile
 import unittest
+from unittest import mock
 
 from molscore.scoring_functions.similarity import (
     MolecularSimilarity,
     LevenshteinSimilarity,
     TanimotoSimilarity,
 )
+from molscore.scoring_functions.utils import write_smiles
 from molscore.tests import BaseTests, MockGenerator
 
 
@@ -276,6 +280,70 @@ class TestSimilarityECFP4ThreshMaxParallel(BaseTests.TestScoringFunction):
         print(f"Similarity Output:\n{json.dumps(cls.output, indent=2)}\n")
 
 
+class TestSimilarityECFP4CachedReferenceFile(BaseTests.TestScoringFunction):
+    @classmethod
+    def setUpClass(cls):
+        mg = MockGenerator(seed_no=123)
+        cls.obj = MolecularSimilarity
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            ref_path = os.path.join(tmp_dir, "ref.smi")
+            write_smiles(mg.sample(100), ref_path)
+            with mock.patch.dict(
+                os.environ, {"MOLSCORE_CACHE": os.path.join(tmp_dir, "cache")}
+            ):
+                # Instantiate twice, the second loads reference fps from cache
+                cls.uncached_inst = MolecularSimilarity(
+                    prefix="test", ref_smiles=ref_path, fp="ECFP4", method="max"
+                )
+                cls.inst = MolecularSimilarity(
+                    prefix="test", ref_smiles=ref_path, fp="ECFP4", method="max"
+                )
+            print("\nSimilarity Input: fp=ECFP4, method=max, cached reference file")
+            # Call
+            cls.input = mg.sample(5)
+            cls.uncached_output = cls.uncached_inst(smiles=cls.input)
+            cls.output = cls.inst(smiles=cls.input)
+            print(f"Similarity Output:\n{json.dumps(cls.output, indent=2)}\n")
+
+    def test_cache_matches(self):
+        self.assertEqual(self.uncached_inst.ref_fps, self.inst.ref_fps)
+        self.assertEqual(
+            [o["test_Sim"] for o in self.uncached_output],
+            [o["test_Sim"] for o in self.output],
+        )
+
+
+
+class TestSimilarityECFP4Columnar(BaseTests.TestScoringFunction):
+    @classmethod
+    def setUpClass(cls):
+        mg = MockGenerator(seed_no=123)
+        # Instantiate
+        cls.obj = MolecularSimilarity
+        cls.inst = MolecularSimilarity(
+            prefix="test",
+            ref_smiles=mg.sample(10),
+            fp="ECFP4",
+            bits=1024,
+            thresh=0.3,
+            method="mean",
+            n_jobs=1,
+        )
+        print("\nSimilarity Input: fp=ECFP4, thresh=0.3, method=mean, columnar")
+        # Call
+        cls.input = mg.sample(5)
+        cls.output = cls.inst(smiles=cls.input)
+        cls.columnar_output = cls.inst(smiles=cls.input, columnar=True)
+        print(f"Similarity Output:\n{json.dumps(cls.output, indent=2)}\n")
+
+    def test_columnar_matches(self):
+        self.assertEqual(self.columnar_output.smiles, self.input)
+        self.assertEqual(
+            [o["test_Sim"] for o in self.output],
+            self.columnar_output["test_Sim"].tolist(),
+        )
+        self.assertEqual(self.output, self.columnar_output.to_records())
+
 # ---- Test Levenshtein Similarity ----
 
 
@@ -297,6 +365,36 @@ class TestLevenshteinSimilarity(BaseTests.TestScoringFunction):
         print(f"Levenshtein Similarity Output:\n{json.dumps(cls.output, indent=2)}\n")
 
 
+class TestLevenshteinSimilarityThreshMaxParallel(BaseTests.TestScoringFunction):
+    @classmethod
+    def setUpClass(cls):
+        mg = MockGenerator(seed_no=123)
+        # Instantiate
+        cls.obj = LevenshteinSimilarity
+        cls.inst = LevenshteinSimilarity(
+            prefix="test",
+            ref_smiles=mg.sample(100),
+            thresh=0.5,
+            method="max",
+            n_jobs=4,
+        )
+        print("\nLevenshtein Similarity Input: thresh=0.5, method=max")
+        # Call
+        cls.input = mg.sample(5)
+        cls.output = cls.inst(smiles=cls.input)
+        print(f"Levenshtein Similarity Output:\n{json.dumps(cls.output, indent=2)}\n")
+
+    def test_batch_matches_single(self):
+        for smi, o in zip(self.input, self.output):
+            single = self.inst.calculate_sim(
+                smi,
+                ref_smiles=self.inst.ref_smiles,
+                thresh=self.inst.thresh,
+                method=self.inst.method,
+                prefix=self.inst.prefix,
+            )
+            self.assertEqual(single["test_Sim"], o["test_Sim"])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,253 @@
+import os
+import tempfile
+import unittest
+
+import joblib
+import numpy as np
+from rdkit import Chem
+from rdkit.Chem import Descriptors
+from sklearn.linear_model import LogisticRegression, Ridge
+from sklearn.svm import SVC
+
+from molscore.scoring_functions.reinvent_svm import ActivityModel
+from molscore.scoring_functions.sklearn_model import (
+    EnsembleSKLearnModel,
+    SKLearnClassifier,
+    SKLearnRegressor,
+    chunked_predict,
+    feature_matrix,
+    load_model,
+    predict_proba,
+)
+from molscore.scoring_functions.utils import Executor, Fingerprints
+from molscore.tests import BaseTests, MockGenerator
+
+INVALID = "C1CC(C"
+
+
+def train_data(featurize, n: int = 100):
+    smiles = MockGenerator(seed_no=123).sample(n)
+    X = np.vstack([featurize(smi).reshape(1, -1) for smi in smiles])
+    # Dummy task, predict logP
+    y = np.asarray([Descriptors.MolLogP(Chem.MolFromSmiles(smi)) for smi in smiles])
+    return X, y
+
+
+def ecfp4(smi: str):
+    return Fingerprints.get(smi, name="ECFP4", nBits=1024, asarray=True)
+
+
+class TestLoadModel(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        X, logp = train_data(ecfp4)
+        cls.model = LogisticRegression().fit(X, logp > 3)
+        cls.model_path = os.path.join(cls.tmp.name, "model.joblib")
+        joblib.dump(cls.model, cls.model_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_mmap(self):
+        model = load_model(self.model_path)
+        self.assertIsInstance(model.coef_, np.memmap)
+        self.assertEqual(model.coef_.tolist(), self.model.coef_.tolist())
+
+    def test_no_mmap(self):
+        model = load_model(self.model_path, mmap=False)
+        self.assertNotIsInstance(model.coef_, np.memmap)
+
+    def test_extension(self):
+        with self.assertRaises(TypeError):
+            load_model(os.path.join(self.tmp.name, "model.txt"))
+
+
+class TestFeatureMatrix(unittest.TestCase):
+    def setUp(self):
+        self.input = MockGenerator(seed_no=123).sample(20) + [INVALID]
+
+    def test_feature_matrix(self):
+        valid, X = feature_matrix(self.input, ecfp4)
+        self.assertEqual(valid.tolist(), list(range(20)))
+        self.assertEqual(X.shape, (20, 1024))
+        for i, smi in zip(valid, self.input):
+            self.assertEqual(X[i].tolist(), ecfp4(smi).tolist())
+
+    def test_sparse(self):
+        valid, X = feature_matrix(self.input, ecfp4)
+        valid_sp, X_sp = feature_matrix(self.input, ecfp4, sparse=True)
+        self.assertEqual(valid.tolist(), valid_sp.tolist())
+        self.assertEqual(X.tolist(), X_sp.toarray().tolist())
+
+    def test_thread(self):
+        valid, X = feature_matrix(self.input, ecfp4)
+        valid_t, X_t = feature_matrix(
+            self.input, ecfp4, executor=Executor(backend="thread", n_jobs=2)
+        )
+        self.assertEqual(valid.tolist(), valid_t.tolist())
+        self.assertEqual(X.tolist(), X_t.tolist())
+
+    def test_all_invalid(self):
+        valid, X = feature_matrix([INVALID, INVALID], ecfp4)
+        self.assertEqual(len(valid), 0)
+        self.assertIsNone(X)
+
+
+class TestSKLearnClassifier(BaseTests.TestScoringFunction):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        X, logp = train_data(ecfp4)
+        cls.model_path = os.path.join(cls.tmp.name, "model.joblib")
+        joblib.dump(LogisticRegression().fit(X, logp > 3), cls.model_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        self.obj = SKLearnClassifier
+        self.inst = SKLearnClassifier(
+            prefix="test",
+            model_path=self.model_path,
+            fp="ECFP4",
+            nBits=1024,
+            chunk_size=7,
+            executor={"backend": "thread", "n_jobs": 2},
+        )
+        self.input = MockGenerator(seed_no=321).sample(20) + [INVALID]
+        self.output = self.inst(self.input)
+
+    def test_chunked_predict(self):
+        model = load_model(self.model_path)
+        X = np.vstack([ecfp4(smi) for smi in self.input[:-1]])
+        single = model.predict_proba(X)[:, 1]
+        np.testing.assert_allclose(predict_proba(model, X, chunk_size=7), single)
+        np.testing.assert_allclose(
+            chunked_predict(model.predict, X, chunk_size=3), model.predict(X)
+        )
+        np.testing.assert_allclose(
+            [o["test_pred_proba"] for o in self.output[:-1]], single
+        )
+
+    def test_invalid(self):
+        self.assertEqual(self.output[-1]["test_pred_proba"], 0.0)
+
+
+class TestSKLearnRegressor(BaseTests.TestScoringFunction):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        X, logp = train_data(ecfp4)
+        cls.model_path = os.path.join(cls.tmp.name, "model.joblib")
+        joblib.dump(Ridge().fit(X, logp), cls.model_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        self.obj = SKLearnRegressor
+        self.inst = SKLearnRegressor(
+            prefix="test",
+            model_path=self.model_path,
+            fp="ECFP4",
+            nBits=1024,
+            chunk_size=7,
+            sparse=True,
+        )
+        self.input = MockGenerator(seed_no=321).sample(20) + [INVALID]
+        self.output = self.inst(self.input)
+
+    def test_chunked_predict(self):
+        model = load_model(self.model_path)
+        X = np.vstack([ecfp4(smi) for smi in self.input[:-1]])
+        np.testing.assert_allclose(
+            [o["test_predict"] for o in self.output[:-1]], model.predict(X)
+        )
+
+    def test_invalid(self):
+        self.assertEqual(self.output[-1]["test_predict"], 0.0)
+
+
+class TestEnsembleSKLearnModel(BaseTests.TestScoringFunction):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        X, logp = train_data(ecfp4)
+        cls.models = []
+        for seed in range(3):
+            model = LogisticRegression(C=0.1 * (seed + 1), random_state=seed).fit(
+                X, logp > 3
+            )
+            joblib.dump(model, os.path.join(cls.tmp.name, f"model_{seed}.joblib"))
+            cls.models.append(model)
+        cls.model_path = os.path.join(cls.tmp.name, "model_0.joblib")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        self.obj = EnsembleSKLearnModel
+        self.inst = EnsembleSKLearnModel(
+            prefix="test",
+            model_path=self.model_path,
+            fp="ECFP4",
+            nBits=1024,
+            chunk_size=7,
+        )
+        self.input = MockGenerator(seed_no=321).sample(20) + [INVALID]
+        self.output = self.inst(self.input)
+
+    def test_replicates(self):
+        self.assertEqual(len(self.inst.models), 3)
+
+    def test_threaded_ensemble(self):
+        X = np.vstack([ecfp4(smi) for smi in self.input[:-1]])
+        mean = np.mean([m.predict_proba(X)[:, 1] for m in self.models], axis=0)
+        np.testing.assert_allclose(
+            [o["test_pred_proba"] for o in self.output[:-1]], mean
+        )
+
+    def test_invalid(self):
+        self.assertEqual(self.output[-1]["test_pred_proba"], 0.0)
+
+
+class TestActivityModel(BaseTests.TestScoringFunction):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        X, logp = train_data(ActivityModel.fingerprints_from_smiles)
+        cls.model_path = os.path.join(cls.tmp.name, "clf.pkl")
+        joblib.dump(
+            SVC(probability=True, random_state=123).fit(X, logp > 3), cls.model_path
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        self.obj = ActivityModel
+        self.inst = ActivityModel(
+            prefix="test", model_path=self.model_path, chunk_size=7
+        )
+        self.input = MockGenerator(seed_no=321).sample(20) + [INVALID]
+        self.output = self.inst(self.input)
+
+    def test_chunked_predict(self):
+        for smi, o in zip(self.input[:-1], self.output):
+            self.assertAlmostEqual(
+                self.inst(smi)["test_pred_proba"], o["test_pred_proba"]
+            )
+
+    def test_invalid(self):
+        self.assertEqual(self.output[-1]["test_pred_proba"], 0.0)
+        self.assertEqual(self.inst(INVALID)["test_pred_proba"], 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
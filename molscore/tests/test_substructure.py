@@ -1,8 +1,11 @@
 import json
 import unittest
 
-from molscore.scoring_functions.substructure_match import SubstructureMatch
+from rdkit import Chem
+
 from molscore.scoring_functions.substructure_filters import SubstructureFilters
+from molscore.scoring_functions.substructure_match import SubstructureMatch
+from molscore.scoring_functions.utils import Executor
 from molscore.tests import BaseTests, MockGenerator
 
 
@@ -40,5 +43,89 @@ class TestSubstructureFilters(BaseTests.TestScoringFunction):
         print(f"SubstructureFilters Output:\n{json.dumps(cls.output, indent=2)}\n")
 
 
+class TestSubstructureFiltersExecutors(BaseTests.TestScoringFunction):
+    @classmethod
+    def setUpClass(cls):
+        mg = MockGenerator(seed_no=123)
+        cls.obj = SubstructureFilters
+        cls.inst = SubstructureFilters(
+            prefix="test",
+            az_filters=True,
+            mcf_filters=True,
+            pains_filters=True,
+            executor={"backend": "thread", "n_jobs": 2},
+        )
+        cls.input = mg.sample(20)
+        cls.output = cls.inst(smiles=cls.input)
+        print(f"SubstructureFilters Output:\n{json.dumps(cls.output, indent=2)}\n")
+
+    def test_backends_match(self):
+        for executor in [
+            {"backend": "serial"},
+            {"backend": "process", "n_jobs": 2, "chunksize": 3},
+        ]:
+            with self.subTest(executor=executor["backend"]):
+                inst = SubstructureFilters(
+                    prefix="test",
+                    az_filters=True,
+                    mcf_filters=True,
+                    pains_filters=True,
+                    executor=executor,
+                )
+                self.assertEqual(inst(smiles=self.input), self.output)
+                inst.executor.close()
+
+    def test_close(self):
+        executor = Executor(backend="process", n_jobs=2)
+        self.assertEqual(executor.map(abs, [-1, 2]), [1, 2])
+        pool = executor._pool
+        executor.close()
+        self.assertIsNone(executor._pool)
+        with self.assertRaises(ValueError):
+            pool.map(abs, [-1])
+
+
+class TestSubstructureFiltersFirstMatch(BaseTests.TestScoringFunction):
+    @classmethod
+    def setUpClass(cls):
+        mg = MockGenerator(seed_no=123)
+        cls.obj = SubstructureFilters
+        cls.inst = SubstructureFilters(
+            prefix="test",
+            az_filters=True,
+            mcf_filters=True,
+            pains_filters=True,
+            report_matches=False,
+        )
+        cls.input = mg.sample(20)
+        cls.output = cls.inst(smiles=cls.input)
+        print(f"SubstructureFilters Output:\n{json.dumps(cls.output, indent=2)}\n")
+
+    def test_scores_match_report(self):
+        inst = SubstructureFilters(
+            prefix="test",
+            az_filters=True,
+            mcf_filters=True,
+            pains_filters=True,
+            report_matches=True,
+        )
+        output = inst(smiles=self.input)
+        self.assertEqual(
+            [o["test_substruct_filt"] for o in output],
+            [o["test_substruct_filt"] for o in self.output],
+        )
+        # Reported SMARTS are exactly those matched by brute force
+        for smi, o in zip(self.input, output):
+            mol = Chem.MolFromSmiles(smi)
+            if mol is None:
+                continue
+            expected = sorted(
+                sub
+                for sub in inst.smarts
+                if mol.HasSubstructMatch(Chem.MolFromSmarts(sub))
+            )
+            self.assertEqual(sorted((o["test_substruct"] or "").split()), expected)
+
+
 if __name__ == "__main__":
-    unittest.main()
\ No newline at end of file
+    unittest.main()